@@ -0,0 +1,56 @@
+"""
+Gunicorn configuration for production.
+
+Run with:
+    gunicorn numan_python_takehome.wsgi:application
+
+The app is preloaded in the master so workers share imported code
+copy-on-write, and each worker warms up before it accepts connections.
+See main/warmup.py.
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 30))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 0))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", 0))
+preload_app = True
+accesslog = None  # main.access logs every request already.
+
+# Metrics from all workers are merged through files in this directory; it has
+# to be set before prometheus_client is imported and emptied on every start.
+if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = os.path.join(
+        tempfile.gettempdir(), "numan-prometheus"
+    )
+shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"])
+
+
+def when_ready(server):
+    from main import warmup
+
+    warmup.warm_up_preload()
+    # Anything the preload opened must not leak into the forked workers.
+    warmup.close_db_connections()
+
+
+def post_worker_init(worker):
+    from main import warmup
+
+    warmup.close_db_connections()
+    warmup.warm_up_worker()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,14 +1,181 @@
+from copy import copy
+from itertools import islice
+
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
 from django.contrib.auth.admin import UserAdmin
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils import timezone
+from django.utils.text import Truncator
+
+from . import events, exports, lab_stats, outbox, result_summaries
+from .models import BloodTestResults, CustomToken, Lab, Notification, User
+from .paginators import EstimatedCountPaginator
+from .sharding import get_shards, is_sharded, scatter_gather
+
+
+@admin.register(User)
+class LabUserAdmin(UserAdmin):
+    fieldsets = UserAdmin.fieldsets + (
+        ("Patient", {"fields": ("sex", "date_of_birth")}),
+        ("Lab", {"fields": ("lab",)}),
+    )
+
 
-from .models import BloodTestResults, CustomToken, Lab, User
+class ShardListFilter(admin.SimpleListFilter):
+    """Browse the results stored on one shard."""
 
-admin.site.register(User, UserAdmin)
+    title = "shard"
+    parameter_name = "shard"
+
+    def lookups(self, request, model_admin):
+        if not is_sharded():
+            return []
+        return [(alias, alias) for alias in get_shards()]
+
+    def queryset(self, request, queryset):
+        if self.value() in get_shards():
+            return queryset.using(self.value())
+        return queryset
+
+
+class ResultChangeList(ChangeList):
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if queryset.db != DEFAULT_DB_ALIAS and queryset.db in get_shards():
+            # Users and labs live on "default" and can't be joined from a
+            # shard: fetch the page's in one query each instead.
+            return queryset.prefetch_related(
+                Prefetch("user", queryset=User.objects.using(DEFAULT_DB_ALIAS)),
+                Prefetch("lab", queryset=Lab.objects.using(DEFAULT_DB_ALIAS)),
+            )
+        return queryset.select_related("user", "lab")
 
 
 @admin.register(BloodTestResults)
 class BloodTestResultAdmin(admin.ModelAdmin):
-    list_display = ("user", "timestamp", "results", "ready", "lab")
+    # Every column comes from the page's one query (see ResultChangeList), the
+    # filters are backed by indexes and don't count rows, and the total is
+    # estimated on Postgres, so a page costs the same on any size of table.
+    list_display = (
+        "user",
+        "timestamp",
+        "results_summary",
+        "ready",
+        "lab",
+        "claimed_until",
+    )
+    list_select_related = ()
+    list_filter = (ShardListFilter, "ready", ("timestamp", admin.DateFieldListFilter))
+    ordering = ("-timestamp",)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    raw_id_fields = ("user", "lab", "claimed_by")
+    actions = ["export_csv"]
+    all_shards_limit = 100
+    export_chunk_size = 2000
+
+    def get_changelist(self, request, **kwargs):
+        return ResultChangeList
+
+    @admin.display(description="results")
+    def results_summary(self, obj):
+        values = exports.analyte_values(obj.results)
+        summary = ", ".join(f"{code}: {value}" for code, value in values.items())
+        return Truncator(summary).chars(60)
+
+    @admin.action(description="Export selected results as CSV")
+    def export_csv(self, request, queryset):
+        """Stream the selected results as gzipped CSV, a chunk at a time."""
+        size = self.export_chunk_size
+        rows = (
+            queryset.prefetch_related(None)
+            .order_by("pk")
+            .values_list("id", "user_id", "lab_id", "timestamp", "ready", "results")
+            .iterator(chunk_size=size)
+        )
+        chunks = exports.encode_csv(exports.chunked(rows, size))
+        response = StreamingHttpResponse(
+            (chunk.data for chunk in chunks),
+            content_type=exports.CONTENT_TYPES[exports.FORMAT_CSV],
+        )
+        response[
+            "Content-Disposition"
+        ] = f'attachment; filename="results.{exports.EXTENSIONS[exports.FORMAT_CSV]}"'
+        return response
+
+    def save_model(self, request, obj, form, change):
+        # Keep the lab's daily stats and the patient's stream, snapshot and email
+        # notifications in step with edits made here.
+        flipped = "ready" in form.changed_data if change else obj.ready
+        before = copy(obj)
+        if flipped:
+            obj.ready_at = timezone.now() if obj.ready else None
+        super().save_model(request, obj, form, change)
+        if not change:
+            lab_stats.record_created([obj])
+            result_summaries.record_created([obj])
+            events.publish([obj], events.EVENT_CREATED, using=obj._state.db)
+        if flipped and obj.ready:
+            lab_stats.record_ready([obj])
+            result_summaries.record_ready([obj])
+            events.publish([obj], events.EVENT_READY, using=obj._state.db)
+            outbox.enqueue([obj], Notification.KIND_RESULT_READY, using=obj._state.db)
+        elif flipped:
+            lab_stats.record_ready([before], sign=-1)
+        if change and ("results" in form.changed_data or (flipped and not obj.ready)):
+            # Values may have been taken back: recompute from the results.
+            result_summaries.rebuild(user_ids=[obj.user_id])
+
+    def delete_model(self, request, obj):
+        with transaction.atomic(using=obj._state.db):
+            super().delete_model(request, obj)
+            lab_stats.record_deleted([obj])
+            result_summaries.record_deleted([obj])
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic(using=queryset.db):
+            orders = list(
+                queryset.only(
+                    "pk", "user_id", "lab_id", "timestamp", "ready", "ready_at"
+                )
+            )
+            super().delete_queryset(request, queryset)
+            lab_stats.record_deleted(orders)
+            result_summaries.record_deleted(orders)
+
+    def get_urls(self):
+        return [
+            path(
+                "all-shards/",
+                self.admin_site.admin_view(self.all_shards_view),
+                name="main_bloodtestresults_all_shards",
+            ),
+        ] + super().get_urls()
+
+    def all_shards_view(self, request):
+        """List the most recent results across every shard."""
+        limit = self.all_shards_limit
+        results = scatter_gather(
+            lambda: BloodTestResults.objects.order_by("-timestamp", "-pk")[:limit],
+            key=lambda result: (result.timestamp, result.pk),
+            reverse=True,
+        )
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "title": "Latest blood test results on all shards",
+            "results": [
+                (result, result._state.db) for result in islice(results, limit)
+            ],
+        }
+        return TemplateResponse(
+            request, "admin/main/bloodtestresults/all_shards.html", context
+        )
 
 
 @admin.register(Lab)
@@ -0,0 +1,166 @@
+"""Admission control: adaptive concurrency limits per class of endpoint.
+
+Every view belongs to a class in ``ADMISSION_CLASSES`` (``"default"`` unless
+listed; ``None`` means never limited) and each class has a ``Limiter`` per
+process. A request is admitted while fewer than ``limit`` requests of its
+class are in flight. Otherwise it may wait up to ``queue_timeout`` seconds
+in a queue of at most ``queue`` requests, and is refused with a 503 and
+``Retry-After`` when the queue is full or the wait runs out. Slow upstreams
+then cost a bounded number of worker threads, and requests of other classes
+still find threads free.
+
+Limits adapt to latency, AIMD style: a request finishing within its class's
+``latency_target`` (and without a server error) raises the limit by
+``1 / limit``, about one per round of requests, up to ``max_limit``; a slower
+or failed one cuts it by ``backoff``, down to ``min_limit``, at most once per
+``latency_target`` so a burst of slow requests counts as one signal.
+
+Limits are per process, like the threads they protect. Decisions are counted
+in ``numan_admission_decisions`` and current limits exported as
+``numan_admission_limit``.
+"""
+import math
+import threading
+import time
+from typing import Dict, NamedTuple, Optional
+
+from django.conf import settings
+from django.http import JsonResponse
+
+from . import metrics
+
+ADMITTED = "admitted"
+QUEUED = "queued"
+QUEUE_FULL = "queue_full"
+TIMED_OUT = "timed_out"
+
+
+class LimitConfig(NamedTuple):
+    limit: float
+    min_limit: float
+    max_limit: float
+    queue: int
+    queue_timeout: float
+    latency_target: float
+    backoff: float = 0.9
+
+
+class Limiter:
+    """An AIMD concurrency limit with a short, bounded wait queue."""
+
+    def __init__(self, name: str, config: LimitConfig):
+        self.name = name
+        self.config = config
+        self.limit = float(config.limit)
+        self.in_flight = 0
+        self.waiting = 0
+        self.latency = config.latency_target
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+        metrics.ADMISSION_LIMIT.labels(endpoint=name).set(self.limit)
+
+    def acquire(self) -> str:
+        """Take a slot, returning ``ADMITTED``/``QUEUED`` or why it was refused."""
+        with self._condition:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return ADMITTED
+            if self.waiting >= self.config.queue:
+                return QUEUE_FULL
+            self.waiting += 1
+            try:
+                admitted = self._condition.wait_for(
+                    lambda: self.in_flight < int(self.limit),
+                    self.config.queue_timeout,
+                )
+            finally:
+                self.waiting -= 1
+            if not admitted:
+                return TIMED_OUT
+            self.in_flight += 1
+            return QUEUED
+
+    def release(self, latency: float, failed: bool = False) -> None:
+        config = self.config
+        with self._condition:
+            self.in_flight -= 1
+            # Smoothed, for Retry-After.
+            self.latency += (latency - self.latency) / 8
+            now = time.monotonic()
+            if failed or latency > config.latency_target:
+                if now - self._last_decrease >= config.latency_target:
+                    self.limit = max(config.min_limit, self.limit * config.backoff)
+                    self._last_decrease = now
+            else:
+                self.limit = min(config.max_limit, self.limit + 1 / self.limit)
+            self._condition.notify()
+        metrics.ADMISSION_LIMIT.labels(endpoint=self.name).set(self.limit)
+
+    def retry_after(self) -> int:
+        """Seconds to suggest to refused clients: about one request's time."""
+        return max(1, math.ceil(self.latency))
+
+
+_limiters: Dict[str, Limiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name: str) -> Limiter:
+    limiter = _limiters.get(name)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(name)
+            if limiter is None:
+                config = LimitConfig(**settings.ADMISSION_LIMITS[name])
+                limiter = _limiters[name] = Limiter(name, config)
+    return limiter
+
+
+def reset() -> None:
+    """Forget every limiter, e.g. after the limits settings change."""
+    with _limiters_lock:
+        _limiters.clear()
+
+
+def endpoint_class(view_name: str) -> Optional[str]:
+    return settings.ADMISSION_CLASSES.get(view_name, "default")
+
+
+class AdmissionControlMiddleware:
+    """Shed load per endpoint class before it ties up worker threads."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        admission = getattr(request, "admission", None)
+        if admission is not None:
+            limiter, started = admission
+
+            def release():
+                limiter.release(
+                    time.perf_counter() - started, response.status_code >= 500
+                )
+
+            # Released when the response is closed: for a streaming response,
+            # once the whole body has gone out.
+            response._resource_closers.append(release)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        name = endpoint_class(request.resolver_match.view_name)
+        if name is None:
+            return None
+        limiter = get_limiter(name)
+        decision = limiter.acquire()
+        metrics.ADMISSION_DECISIONS.labels(endpoint=name, decision=decision).inc()
+        if decision not in (ADMITTED, QUEUED):
+            response = JsonResponse(
+                {"detail": "The service is overloaded, try again later."},
+                status=503,
+            )
+            response["Retry-After"] = str(limiter.retry_after())
+            return response
+        request.admission = (limiter, time.perf_counter())
+        return None
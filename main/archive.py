@@ -0,0 +1,225 @@
+"""Cold archive of old blood test results.
+
+``./manage.py archive_results`` moves every month older than
+``RESULT_RETENTION_MONTHS`` out of the database into ``RESULT_ARCHIVE_DIR``.
+Each shard's month becomes ``results-<shard>-YYYY-MM.ndjson.gz``, holding the
+results' fields as the results endpoint serializes them, but without flags,
+which are added when they're read so they follow the current reference
+ranges. There is one gzip member per user, plus a ``.index.json`` sidecar mapping user ids to the byte ranges of
+their members. Reading one user's history therefore decompresses only their
+own rows.
+
+Where the month is a partition of its own (see main/partitions.py) it is
+written out, then detached and dropped, which costs no table or index bloat;
+otherwise its rows are written out and deleted a chunk at a time. Archiving a
+month twice appends to its file, so stragglers are never lost, but results
+the file already holds aren't written again: a run whose delete failed after
+writing can simply be retried.
+"""
+import datetime
+import glob
+import itertools
+import json
+import os
+import zlib
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from . import partitions, result_summaries
+from .models import BloodTestResults
+from .serializers import ArchivedResultSerializer
+
+# user id -> [[offset, length], ...] of their gzip members
+Index = Dict[str, List[List[int]]]
+
+
+def archive_dir() -> str:
+    return settings.RESULT_ARCHIVE_DIR
+
+
+def archive_path(alias: str, month: datetime.date) -> str:
+    return os.path.join(archive_dir(), f"results-{alias}-{month:%Y-%m}.ndjson.gz")
+
+
+def index_path(alias: str, month: datetime.date) -> str:
+    return os.path.join(archive_dir(), f"results-{alias}-{month:%Y-%m}.index.json")
+
+
+def retention_cutoff(today: Optional[datetime.date] = None) -> datetime.date:
+    """Return the first month that is kept in the database."""
+    today = today or timezone.now().date()
+    return partitions.add_months(
+        partitions.month_start(today), -settings.RESULT_RETENTION_MONTHS
+    )
+
+
+def _bounds(month: datetime.date) -> Tuple[datetime.datetime, datetime.datetime]:
+    start = datetime.datetime.combine(month, datetime.time(), datetime.timezone.utc)
+    end = datetime.datetime.combine(
+        partitions.add_months(month, 1), datetime.time(), datetime.timezone.utc
+    )
+    return start, end
+
+
+def months_to_archive(using: str, cutoff: datetime.date) -> List[datetime.date]:
+    """Return the months before ``cutoff`` that still have results on ``using``."""
+    months = [
+        moment.date()
+        for moment in BloodTestResults.objects.using(using)
+        .filter(timestamp__lt=_bounds(cutoff)[0])
+        .datetimes("timestamp", "month", tzinfo=datetime.timezone.utc)
+    ]
+    if partitions.is_partitioned(connections[using]):
+        # Empty partitions have no rows to find but still want dropping.
+        months.extend(
+            p.start
+            for p in partitions.monthly_partitions(using)
+            if p.start < cutoff and p.start not in months
+        )
+    return sorted(months)
+
+
+def _gzip(data: bytes) -> bytes:
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _load_index(path: str) -> Index:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _read_members(f, spans: List[List[int]]) -> Iterator[dict]:
+    for offset, length in spans:
+        f.seek(offset)
+        data = zlib.decompress(f.read(length), wbits=zlib.MAX_WBITS | 16)
+        yield from (json.loads(line) for line in data.splitlines())
+
+
+def write_archive(
+    alias: str, month: datetime.date, results: Iterable[BloodTestResults]
+) -> int:
+    """Append ``results``, ordered by user, to the month's archive.
+
+    Results already in the archive are skipped. Returns the number of
+    results that are archived now, skipped ones included. The index is
+    replaced only after the data is on disk, so a crash leaves at worst some
+    unreferenced bytes.
+    """
+    os.makedirs(archive_dir(), exist_ok=True)
+    path = archive_path(alias, month)
+    index = _load_index(index_path(alias, month))
+    archived = 0
+    with open(path, "a+b") as f:
+        for user_id, group in itertools.groupby(results, key=lambda r: r.user_id):
+            group = list(group)
+            archived += len(group)
+            spans = index.setdefault(str(user_id), [])
+            if spans:
+                # Only users with stragglers or a failed run have members yet.
+                done = {row["id"] for row in _read_members(f, spans)}
+                group = [result for result in group if result.pk not in done]
+                f.seek(0, os.SEEK_END)
+            if not group:
+                continue
+            rows = ArchivedResultSerializer(instance=group, many=True).data
+            member = _gzip("".join(json.dumps(row) + "\n" for row in rows).encode())
+            spans.append([f.tell(), len(member)])
+            f.write(member)
+        f.flush()
+        os.fsync(f.fileno())
+    tmp = index_path(alias, month) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp, index_path(alias, month))
+    return archived
+
+
+def _archive_partition(alias: str, partition: partitions.Partition) -> int:
+    quote = connections[alias].ops.quote_name
+    with transaction.atomic(using=alias):
+        with connections[alias].cursor() as cursor:
+            # Late writes to the month wait rather than miss the archive.
+            cursor.execute(f"LOCK TABLE {quote(partition.name)} IN SHARE MODE")
+        results = BloodTestResults.objects.raw(
+            f'SELECT * FROM {quote(partition.name)} ORDER BY user_id, "timestamp"'
+        ).using(alias)
+        pending = []
+
+        def collect(results):
+            for result in results:
+                if not result.ready:
+                    pending.append(result)
+                yield result
+
+        archived = write_archive(alias, partition.start, collect(results.iterator()))
+        partitions.detach_partition(partition, using=alias)
+        partitions.drop_table(partition.name, using=alias)
+        result_summaries.record_archived(pending)
+    return archived
+
+
+def _archive_rows(alias: str, month: datetime.date, chunk_size: int) -> int:
+    start, end = _bounds(month)
+    queryset = BloodTestResults.objects.using(alias).filter(
+        timestamp__gte=start, timestamp__lt=end
+    )
+    archived, last_pk = 0, 0
+    while True:
+        chunk = list(queryset.filter(pk__gt=last_pk).order_by("pk")[:chunk_size])
+        if not chunk:
+            return archived
+        last_pk = chunk[-1].pk
+        chunk.sort(key=lambda result: (result.user_id, result.timestamp))
+        archived += write_archive(alias, month, chunk)
+        # Delete exactly what was written, not whatever matches afterwards.
+        with transaction.atomic(using=alias):
+            queryset.filter(pk__in=[result.pk for result in chunk]).delete()
+            result_summaries.record_archived(chunk)
+
+
+def archive_month(alias: str, month: datetime.date, chunk_size: int = 5000) -> int:
+    """Move the month starting on ``month`` on ``alias`` into the archive."""
+    partition = partitions.partition_for(month)
+    connection = connections[alias]
+    if partitions.is_partitioned(connection) and partition in (
+        partitions.monthly_partitions(alias)
+    ):
+        return _archive_partition(alias, partition)
+    return _archive_rows(alias, month, chunk_size)
+
+
+@lru_cache(maxsize=256)
+def _cached_index(path: str, mtime: float) -> Index:
+    return _load_index(path)
+
+
+def _indexes() -> Iterator[Tuple[str, Index]]:
+    """Yield (archive path, index) for every archived month, oldest first."""
+    paths = glob.glob(os.path.join(archive_dir(), "results-*.index.json"))
+    # Sort on the month, not the shard alias that comes before it.
+    for path in sorted(paths, key=lambda p: (p[-18:], p)):
+        archive = path[: -len(".index.json")] + ".ndjson.gz"
+        yield archive, _cached_index(path, os.path.getmtime(path))
+
+
+def archived_results(user_id: int) -> List[dict]:
+    """Return ``user_id``'s archived results, serialized, oldest first.
+
+    The rows have no flags; see ``serializers.add_archived_flags``.
+    """
+    rows = {}
+    for archive, index in _indexes():
+        spans = index.get(str(user_id))
+        if not spans:
+            continue
+        with open(archive, "rb") as f:
+            # Archives written before retries skipped results may repeat one.
+            rows.update((row["id"], row) for row in _read_members(f, spans))
+    return sorted(rows.values(), key=lambda row: row["timestamp"])
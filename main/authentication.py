@@ -1,7 +1,13 @@
 from rest_framework import authentication
 
 from .models import CustomToken
+from .routers import replica_reads
 
 
 class TokenAuthentication(authentication.TokenAuthentication):
     model = CustomToken
+
+    def authenticate_credentials(self, key):
+        # Tokens are written once and read on every request.
+        with replica_reads():
+            return super().authenticate_credentials(key)
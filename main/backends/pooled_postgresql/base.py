@@ -0,0 +1,92 @@
+"""PostgreSQL with connections taken from a per-process pool.
+
+Use it as the ``ENGINE`` of a Postgres database with a ``POOL`` mapping of
+``SIZE``, ``MAX_OVERFLOW``, ``TIMEOUT``, ``RECYCLE`` and ``PRE_PING`` (see
+main/db_pool.py) and ``CONN_MAX_AGE = 0``, so connections go back to the pool
+at the end of every request instead of staying with the thread.
+"""
+import psycopg2
+from django.db.backends.postgresql import base
+from django.db.backends.postgresql.psycopg_any import IsolationLevel
+from psycopg2 import extensions
+
+from main import db_pool
+
+from .creation import DatabaseCreation
+
+
+def _check(connection) -> bool:
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+    except psycopg2.Error:
+        return False
+    return True
+
+
+def _reset(connection) -> bool:
+    """Leave ``connection`` outside any transaction; False if it's unusable."""
+    if connection.closed:
+        return False
+    status = connection.info.transaction_status
+    if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+        return False
+    if status != extensions.TRANSACTION_STATUS_IDLE:
+        connection.rollback()
+    # As Django expects a new connection to be: otherwise the pre-ping would
+    # open a transaction and Django couldn't set autocommit afterwards.
+    connection.autocommit = True
+    return True
+
+
+def _close(connection) -> None:
+    connection.close()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def get_pool(self, conn_params) -> db_pool.ConnectionPool:
+        options = self.settings_dict.get("POOL", {})
+        # Per set of connection parameters as well as per alias: the test
+        # runner points an alias at another database and reconnects.
+        return db_pool.get_pool(
+            f"{self.alias}:{sorted(conn_params.items())!r}",
+            name=self.alias,
+            check=_check,
+            reset=_reset,
+            close=_close,
+            size=options.get("SIZE", 5),
+            max_overflow=options.get("MAX_OVERFLOW", 5),
+            timeout=options.get("TIMEOUT", 5.0),
+            recycle=options.get("RECYCLE"),
+            pre_ping=options.get("PRE_PING", True),
+        )
+
+    def get_new_connection(self, conn_params):
+        self.connection_pool = self.get_pool(conn_params)
+        try:
+            connection = self.connection_pool.acquire(
+                lambda: super(DatabaseWrapper, self).get_new_connection(conn_params)
+            )
+        except db_pool.PoolTimeout as e:
+            # Raised as a database error, which Django knows how to report.
+            raise self.Database.OperationalError(str(e)) from e
+        # Set by the parent class when it opens a connection, so a reused
+        # connection needs it too.
+        self.isolation_level = IsolationLevel(
+            self.settings_dict["OPTIONS"].get(
+                "isolation_level", IsolationLevel.READ_COMMITTED
+            )
+        )
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                if self.in_atomic_block:
+                    # Django holds on to the connection until the block exits,
+                    # so it can't go to anyone else; close it, as Django would.
+                    self.connection_pool.discard(self.connection)
+                else:
+                    self.connection_pool.release(self.connection)
@@ -0,0 +1,10 @@
+from django.db.backends.postgresql import creation
+
+from main import db_pool
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Idle pooled connections would keep the database in use.
+        db_pool.close_pools(self.connection.alias)
+        super()._destroy_test_db(test_database_name, verbosity)
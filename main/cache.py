@@ -0,0 +1,154 @@
+"""A small typed facade over Django's cache framework.
+
+Every cache in the app is a ``Cache`` with its own namespace, so keys can't
+collide and hits and misses are reported per namespace in ``/metrics``. Keys
+carry the cache's ``version``: bump it whenever the shape of the cached value
+changes and old entries are simply never read again.
+
+``get_or_set`` protects expensive values against stampedes. Values are stored
+with a soft expiry and kept for ``stale_grace`` seconds longer; when an entry
+goes stale, one caller recomputes it (holding a short lock taken with
+``cache.add``) while everyone else keeps getting the stale value. On a cold
+miss, the others wait briefly for the lock holder instead of all computing.
+"""
+import time
+from typing import Any, Callable, Dict, Generic, Iterable, Optional, Tuple, TypeVar
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+from . import metrics
+
+T = TypeVar("T")
+
+
+class Cache(Generic[T]):
+    def __init__(
+        self,
+        namespace: str,
+        version: int = 1,
+        timeout: Optional[float] = 300,
+        stale_grace: float = 60,
+        lock_timeout: float = 10,
+        alias: str = "default",
+    ):
+        self.namespace = namespace
+        self.version = version
+        self.timeout = timeout
+        self.stale_grace = stale_grace
+        self.lock_timeout = lock_timeout
+        self.alias = alias
+
+    @property
+    def backend(self):
+        # Looked up per use: ``caches`` is thread-local and tests swap settings.
+        return caches[self.alias]
+
+    def make_key(self, key: str) -> str:
+        return f"{self.namespace}:v{self.version}:{key}"
+
+    def _envelope(self, value: T, timeout: Optional[float]) -> Tuple[T, float]:
+        fresh_until = float("inf") if timeout is None else time.time() + timeout
+        return value, fresh_until
+
+    def _backend_timeout(self, timeout: Optional[float]) -> Optional[float]:
+        return None if timeout is None else timeout + self.stale_grace
+
+    def _record(self, hit: bool) -> None:
+        metrics.record_cache_lookup(self.namespace, hit)
+
+    def get(self, key: str, default: Optional[T] = None) -> Optional[T]:
+        envelope = self.backend.get(self.make_key(key))
+        if envelope is None or envelope[1] <= time.time():
+            self._record(hit=False)
+            return default
+        self._record(hit=True)
+        return envelope[0]
+
+    def _timeout(self, timeout: Any) -> Optional[float]:
+        return self.timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+    def set(self, key: str, value: T, timeout: Any = DEFAULT_TIMEOUT) -> None:
+        timeout = self._timeout(timeout)
+        self.backend.set(
+            self.make_key(key),
+            self._envelope(value, timeout),
+            self._backend_timeout(timeout),
+        )
+
+    def delete(self, key: str) -> None:
+        self.backend.delete(self.make_key(key))
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, T]:
+        """Return the fresh values for ``keys`` in one round trip."""
+        made = {self.make_key(key): key for key in keys}
+        now = time.time()
+        found = {
+            made[made_key]: envelope[0]
+            for made_key, envelope in self.backend.get_many(made.keys()).items()
+            if envelope[1] > now
+        }
+        for key in made.values():
+            self._record(hit=key in found)
+        return found
+
+    def set_many(self, values: Dict[str, T], timeout: Any = DEFAULT_TIMEOUT) -> None:
+        timeout = self._timeout(timeout)
+        self.backend.set_many(
+            {
+                self.make_key(key): self._envelope(value, timeout)
+                for key, value in values.items()
+            },
+            self._backend_timeout(timeout),
+        )
+
+    def delete_many(self, keys: Iterable[str]) -> None:
+        self.backend.delete_many([self.make_key(key) for key in keys])
+
+    def _lock_key(self, key: str) -> str:
+        return self.make_key(key) + ":lock"
+
+    def _acquire(self, key: str) -> bool:
+        return self.backend.add(self._lock_key(key), 1, self.lock_timeout)
+
+    def _release(self, key: str) -> None:
+        self.backend.delete(self._lock_key(key))
+
+    def _compute(self, key: str, compute: Callable[[], T], timeout) -> T:
+        try:
+            value = compute()
+            self.set(key, value, timeout)
+            return value
+        finally:
+            self._release(key)
+
+    def get_or_set(
+        self,
+        key: str,
+        compute: Callable[[], T],
+        timeout: Any = DEFAULT_TIMEOUT,
+        poll_interval: float = 0.05,
+    ) -> T:
+        """Return the cached value for ``key``, computing it once on a miss."""
+        timeout = self._timeout(timeout)
+        envelope = self.backend.get(self.make_key(key))
+        if envelope is not None:
+            value, fresh_until = envelope
+            self._record(hit=True)
+            if fresh_until > time.time() or not self._acquire(key):
+                return value
+            return self._compute(key, compute, timeout)
+
+        self._record(hit=False)
+        deadline = time.monotonic() + self.lock_timeout
+        while not self._acquire(key):
+            if time.monotonic() > deadline:
+                # The lock holder is stuck or gone: compute it ourselves.
+                value = compute()
+                self.set(key, value, timeout)
+                return value
+            time.sleep(poll_interval)
+            envelope = self.backend.get(self.make_key(key))
+            if envelope is not None:
+                return envelope[0]
+        return self._compute(key, compute, timeout)
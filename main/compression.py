@@ -0,0 +1,204 @@
+"""Content-negotiated response compression.
+
+``CompressionMiddleware`` compresses responses with the best encoding the
+client accepts: zstd, then brotli, then gzip (brotli and zstd need the
+"compression" extra). Bodies under ``COMPRESSION_MIN_SIZE`` bytes, and types
+that are already compressed, go out as they are. Streaming responses are
+compressed chunk by chunk, flushing after each so the client gets every
+chunk as soon as it's produced.
+
+Views whose payload is cached can store it as a ``Payload``, rendered and
+compressed once with every encoding at the highest levels, and return it
+with ``payload_response``: the middleware then sends the stored bytes
+without compressing anything.
+"""
+import zlib
+from typing import Dict, Iterable, Iterator, NamedTuple, Optional
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+GZIP = "gzip"
+BROTLI = "br"
+ZSTD = "zstd"
+
+# In order of preference when the client accepts several equally.
+ENCODINGS = [
+    encoding
+    for encoding, available in ((ZSTD, zstandard), (BROTLI, brotli), (GZIP, zlib))
+    if available is not None
+]
+
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    # The binary wire formats still repeat every key in every row.
+    "application/msgpack",
+    "application/cbor",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+)
+
+_q_re = _lazy_re_compile(r"^q=([0-9.]+)$")
+
+
+def accepted_encodings(accept_encoding: str) -> Dict[str, float]:
+    """Parse an Accept-Encoding header into encoding -> q-value."""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, *params = [part.strip() for part in item.split(";")]
+        if not name:
+            continue
+        quality = 1.0
+        for param in params:
+            match = _q_re.match(param)
+            if match:
+                try:
+                    quality = float(match[1])
+                except ValueError:
+                    quality = 0.0
+        accepted[name.lower()] = quality
+    return accepted
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """Pick the encoding to use for ``accept_encoding``, if any."""
+    accepted = accepted_encodings(accept_encoding)
+    default = accepted.get("*", 0.0)
+    best, best_quality = None, 0.0
+    for encoding in ENCODINGS:
+        quality = accepted.get(encoding, default)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(data: bytes, encoding: str, best: bool = False) -> bytes:
+    """Compress ``data``, at the highest level with ``best`` for stored bytes."""
+    if encoding == ZSTD:
+        return zstandard.ZstdCompressor(level=19 if best else 3).compress(data)
+    if encoding == BROTLI:
+        return brotli.compress(data, quality=11 if best else 5)
+    compressor = zlib.compressobj(9 if best else 6, wbits=zlib.MAX_WBITS | 16)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(chunks: Iterable[bytes], encoding: str) -> Iterator[bytes]:
+    """Compress ``chunks`` as one stream, flushing after every chunk."""
+    if encoding == ZSTD:
+        compressor = zstandard.ZstdCompressor(level=3).compressobj()
+        process = compressor.compress
+
+        def flush():
+            return compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+        finish = compressor.flush
+    elif encoding == BROTLI:
+        compressor = brotli.Compressor(quality=5)
+        process, flush, finish = (
+            compressor.process,
+            compressor.flush,
+            compressor.finish,
+        )
+    else:
+        compressor = zlib.compressobj(6, wbits=zlib.MAX_WBITS | 16)
+        process = compressor.compress
+
+        def flush():
+            return compressor.flush(zlib.Z_SYNC_FLUSH)
+
+        finish = compressor.flush
+    for chunk in chunks:
+        data = process(chunk) + flush()
+        if data:
+            yield data
+    yield finish()
+
+
+class Payload(NamedTuple):
+    """A rendered body with its compressed variants, fit for caching."""
+
+    content: bytes
+    content_type: str
+    # encoding -> compressed content
+    encoded: Dict[str, bytes]
+
+
+def precompress(content: bytes, content_type: str) -> Payload:
+    encoded = {}
+    if len(content) >= settings.COMPRESSION_MIN_SIZE:
+        encoded = {
+            encoding: compress(content, encoding, best=True) for encoding in ENCODINGS
+        }
+    return Payload(content, content_type, encoded)
+
+
+def payload_response(payload: Payload, status: int = 200) -> HttpResponse:
+    response = HttpResponse(
+        payload.content, content_type=payload.content_type, status=status
+    )
+    response.precompressed = payload.encoded
+    return response
+
+
+def is_compressible(response) -> bool:
+    content_type = response.get("Content-Type", "")
+    return (
+        not response.has_header("Content-Encoding")
+        and content_type.startswith(COMPRESSIBLE_TYPES)
+        and not content_type.startswith("text/event-stream")
+    )
+
+
+class CompressionMiddleware:
+    """Compress responses with the best encoding the client accepts."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not is_compressible(response):
+            return response
+        if response.streaming and response.is_async:
+            return response
+        patch_vary_headers(response, ("Accept-Encoding",))
+        encoding = negotiate(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compress_stream(
+                response.streaming_content, encoding
+            )
+            del response["Content-Length"]
+        else:
+            if len(response.content) < settings.COMPRESSION_MIN_SIZE:
+                return response
+            precompressed = getattr(response, "precompressed", {})
+            content = precompressed.get(encoding) or compress(
+                response.content, encoding
+            )
+            if len(content) >= len(response.content):
+                return response
+            response.content = content
+            response["Content-Length"] = str(len(content))
+
+        # The body differs from the identity one, so a strong ETag can't stay.
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = "W/" + etag
+        response["Content-Encoding"] = encoding
+        return response
@@ -1,10 +1,57 @@
+from typing import Dict, NamedTuple, Optional
+
 BLOOD_TEST_CBC = "CBC"
 BLOOD_TEST_LDL = "LDL"
 BLOOD_TEST_HDL = "HDL"
 
+SEX_ANY = ""
+SEX_FEMALE = "F"
+SEX_MALE = "M"
+SEX_CHOICES = (
+    (SEX_FEMALE, "Female"),
+    (SEX_MALE, "Male"),
+)
+
+
+class BloodTest(NamedTuple):
+    code: str
+    name: str
+    unit: str
+
+
+class ReferenceRange(NamedTuple):
+    """The normal range of ``test`` for people of ``sex`` aged [min_age, max_age).
+
+    ``low`` or ``high`` is None where the range is open on that side.
+    """
+
+    test: str
+    sex: str
+    min_age: Optional[float]
+    max_age: Optional[float]
+    low: Optional[float]
+    high: Optional[float]
+
+
+BLOOD_TESTS: Dict[str, BloodTest] = {
+    test.code: test
+    for test in (
+        # A panel rather than a single measurement: it has no range of its own.
+        BloodTest(BLOOD_TEST_CBC, "Complete Blood Count", ""),
+        BloodTest(BLOOD_TEST_LDL, "low-density lipoprotein", "mg/dL"),
+        BloodTest(BLOOD_TEST_HDL, "high-density lipoprotein", "mg/dL"),
+    )
+}
+
+BLOOD_TEST_CHOICES = tuple((test.code, test.name) for test in BLOOD_TESTS.values())
 
-BLOOD_TEST_CHOICES = (
-    (BLOOD_TEST_CBC, "Complete Blood Count"),
-    (BLOOD_TEST_LDL, "low-density lipoprotein"),
-    (BLOOD_TEST_HDL, "high-density lipoprotein"),
+# Where several ranges match a result, the first one listed wins, so more
+# specific ranges come before the catch-alls.
+REFERENCE_RANGES = (
+    ReferenceRange(BLOOD_TEST_LDL, SEX_ANY, None, 20, None, 110),
+    ReferenceRange(BLOOD_TEST_LDL, SEX_ANY, None, None, None, 130),
+    ReferenceRange(BLOOD_TEST_HDL, SEX_ANY, None, 20, 45, None),
+    ReferenceRange(BLOOD_TEST_HDL, SEX_FEMALE, 20, None, 50, None),
+    ReferenceRange(BLOOD_TEST_HDL, SEX_MALE, 20, None, 40, None),
+    ReferenceRange(BLOOD_TEST_HDL, SEX_ANY, None, None, 40, None),
 )
@@ -0,0 +1,187 @@
+"""A connection pool shared by the threads of a process.
+
+Without it every gunicorn thread keeps a Postgres connection of its own, so
+a deploy of W workers with T threads holds W * T connections whether they
+are busy or not, and opens them all again at once on restart. With the
+``main.backends.pooled_postgresql`` engine, a thread takes a connection from
+its process's pool when it first queries and gives it back when Django
+closes it (at the end of the request, since pooled databases have
+``CONN_MAX_AGE = 0``).
+
+A pool keeps up to ``size`` connections open. Under load it opens up to
+``max_overflow`` more, which are closed as soon as they are given back;
+beyond that, callers wait up to ``timeout`` seconds for a connection and get
+``PoolTimeout`` after. Idle connections are reused newest first, so the
+oldest ones go unused and can be recycled: connections older than
+``recycle`` seconds are closed instead of being handed out, and with
+``pre_ping`` every connection is checked before it is handed out, and
+replaced if the server dropped it.
+
+The pool itself knows nothing of Postgres: the engine passes it functions to
+open, check, reset and close connections. Pools are per process and
+forgotten in forked children, which must open their own.
+"""
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from . import metrics
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(
+        self,
+        name: str,
+        check: Callable[[Any], bool],
+        reset: Callable[[Any], bool],
+        close: Callable[[Any], None],
+        size: int = 5,
+        max_overflow: int = 5,
+        timeout: float = 5.0,
+        recycle: Optional[float] = None,
+        pre_ping: bool = True,
+    ):
+        self.name = name
+        self.check = check
+        self.reset = reset
+        self._close = close
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        # (connection, opened at), most recently returned last.
+        self._idle: Deque[Tuple[Any, float]] = deque()
+        # id(connection) -> opened at, for connections handed out.
+        self._in_use: Dict[int, float] = {}
+        # Connections open or being opened.
+        self._open = 0
+        self._condition = threading.Condition()
+
+    def _report(self) -> None:
+        gauge = metrics.DB_POOL_CONNECTIONS
+        gauge.labels(database=self.name, state="idle").set(len(self._idle))
+        gauge.labels(database=self.name, state="in_use").set(len(self._in_use))
+
+    def _discard(self, connection) -> None:
+        try:
+            self._close(connection)
+        except Exception:
+            pass
+        with self._condition:
+            self._open -= 1
+            self._condition.notify()
+            self._report()
+
+    def acquire(self, connect: Callable[[], Any]):
+        """Hand out an idle connection, or one from ``connect()`` if allowed."""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        while True:
+            with self._condition:
+                while not self._idle and self._open >= self.size + self.max_overflow:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        metrics.DB_POOL_TIMEOUTS.labels(database=self.name).inc()
+                        raise PoolTimeout(
+                            f"No connection to {self.name} free after "
+                            f"{self.timeout}s ({self._open} open)."
+                        )
+                    self._condition.wait(remaining)
+                if self._idle:
+                    connection, opened_at = self._idle.pop()
+                else:
+                    connection, opened_at = None, None
+                    self._open += 1
+
+            if connection is None:
+                try:
+                    connection = connect()
+                except BaseException:
+                    with self._condition:
+                        self._open -= 1
+                        self._condition.notify()
+                    raise
+                opened_at = time.monotonic()
+            elif (
+                self.recycle is not None and time.monotonic() - opened_at > self.recycle
+            ) or (self.pre_ping and not self.check(connection)):
+                self._discard(connection)
+                continue
+
+            with self._condition:
+                self._in_use[id(connection)] = opened_at
+                self._report()
+            metrics.DB_POOL_WAIT.labels(database=self.name).observe(
+                time.monotonic() - started
+            )
+            return connection
+
+    def release(self, connection) -> None:
+        """Take ``connection`` back, closing it if it's broken or overflow."""
+        with self._condition:
+            opened_at = self._in_use.pop(id(connection))
+        try:
+            reusable = self.reset(connection)
+        except Exception:
+            reusable = False
+        with self._condition:
+            if reusable and self._open <= self.size:
+                self._idle.append((connection, opened_at))
+                self._condition.notify()
+                self._report()
+                return
+        self._discard(connection)
+
+    def discard(self, connection) -> None:
+        """Close ``connection`` rather than take it back, freeing its slot."""
+        with self._condition:
+            self._in_use.pop(id(connection))
+        self._discard(connection)
+
+    def close(self) -> None:
+        """Close the idle connections; ones in use are closed when released."""
+        with self._condition:
+            idle = list(self._idle)
+            self._idle.clear()
+            self.size = 0
+        for connection, _ in idle:
+            self._discard(connection)
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(key: str, name: str, **options) -> ConnectionPool:
+    """Return this process's pool for ``key``, made with ``options`` if new."""
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = ConnectionPool(name, **options)
+    return pool
+
+
+def close_pools(name: str) -> None:
+    """Close the idle connections of every pool called ``name``."""
+    with _pools_lock:
+        keys = [key for key, pool in _pools.items() if pool.name == name]
+        pools = [_pools.pop(key) for key in keys]
+    for pool in pools:
+        pool.close()
+
+
+def _forget_pools() -> None:
+    # A child's copies of the parent's sockets aren't its own to use.
+    _pools.clear()
+
+
+os.register_at_fork(after_in_child=_forget_pools)
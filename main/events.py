@@ -0,0 +1,333 @@
+"""Result notifications for the Server-Sent Events stream.
+
+``publish`` is called wherever a result is created or turns ready. Once the
+transaction commits, the broker gives each event an increasing id and, in one
+step, so buffers and streams see events in id order whichever transaction
+committed first,
+
+* appends it to the user's replay buffer, so a client reconnecting with
+  ``Last-Event-ID`` gets what it missed, and
+* fans it out to the streams open for that user.
+
+The broker is in-process unless ``EVENTS_BROKER_URL`` points at Redis, in
+which case events go through one Redis pub/sub channel and every process
+runs a single listener task that feeds its own local subscribers. Either
+way an open stream costs an ``asyncio.Queue``, not a thread. The in-process
+broker numbers events with a per-process counter and keeps the replay buffers
+in the cache; the Redis one numbers them with ``INCR`` and keeps the buffers
+in Redis lists, both in the same Lua script that publishes them.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Iterable, List, NamedTuple, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+from .cache import Cache
+
+logger = logging.getLogger(__name__)
+
+EVENT_CREATED = "result.created"
+EVENT_READY = "result.ready"
+
+CHANNEL = "numan:events"
+REPLAY_KEY = "numan:events:replay:{}"
+ID_KEY = "numan:events:id"
+
+# KEYS: the id counter, then each event's replay buffer. ARGV: the buffer
+# size, its lifetime, the channel, then each event without its id.
+SEND_SCRIPT = """
+local size, ttl, channel = tonumber(ARGV[1]), tonumber(ARGV[2]), ARGV[3]
+local ids = {}
+for i = 2, #KEYS do
+    local event = cjson.decode(ARGV[i + 2])
+    event.id = string.format("%020d", redis.call("INCR", KEYS[1]))
+    local encoded = cjson.encode(event)
+    redis.call("RPUSH", KEYS[i], encoded)
+    redis.call("LTRIM", KEYS[i], -size, -1)
+    redis.call("EXPIRE", KEYS[i], ttl)
+    redis.call("PUBLISH", channel, encoded)
+    ids[#ids + 1] = event.id
+end
+return ids
+"""
+
+
+class Event(NamedTuple):
+    id: str
+    user_id: int
+    type: str
+    data: Dict[str, Any]
+
+    def numbered(self, event_id: str) -> "Event":
+        return self._replace(id=event_id)
+
+    def encode(self) -> str:
+        """Render the event in the text/event-stream format."""
+        return f"id: {self.id}\nevent: {self.type}\ndata: {json.dumps(self.data)}\n\n"
+
+
+replay: Cache[List[Event]] = Cache(
+    "events", timeout=settings.EVENTS_REPLAY_SECONDS, stale_grace=0
+)
+
+
+_last_id = 0
+_id_lock = threading.Lock()
+
+
+def _event_id() -> str:
+    global _last_id
+    with _id_lock:
+        # Strictly increasing within a process even when the clock isn't.
+        _last_id = max(time.time_ns(), _last_id + 1)
+        # Zero-padded so ids compare the same as strings and as numbers.
+        return f"{_last_id:020d}"
+
+
+def is_after(event_id: str, last_event_id: str) -> bool:
+    try:
+        return int(event_id) > int(last_event_id)
+    except ValueError:
+        return True
+
+
+class Hub:
+    """Fans events out to the queues of this process's open streams."""
+
+    def __init__(self):
+        # user id -> {queue: the event loop its stream runs on}
+        self._subscribers: Dict[int, Dict[asyncio.Queue, Any]] = defaultdict(dict)
+        self._lock = threading.Lock()
+
+    @asynccontextmanager
+    async def subscribe(self, user_id: int) -> AsyncIterator[asyncio.Queue]:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=settings.EVENTS_REPLAY_SIZE)
+        with self._lock:
+            self._subscribers[user_id][queue] = asyncio.get_running_loop()
+        try:
+            yield queue
+        finally:
+            with self._lock:
+                self._subscribers[user_id].pop(queue, None)
+                if not self._subscribers[user_id]:
+                    del self._subscribers[user_id]
+
+    def subscribers(self, user_id: int) -> int:
+        return len(self._subscribers.get(user_id, ()))
+
+    def dispatch(self, event: Event) -> None:
+        """Queue ``event`` for its user's streams; safe from any thread."""
+        with self._lock:
+            queues = list(self._subscribers.get(event.user_id, {}).items())
+        for queue, loop in queues:
+            loop.call_soon_threadsafe(_offer, queue, event)
+
+
+def _offer(queue: asyncio.Queue, event: Event) -> None:
+    try:
+        queue.put_nowait(event)
+    except asyncio.QueueFull:
+        # A stream this far behind gets a replay when it reconnects.
+        logger.warning("Dropping event %s for a slow stream", event.id)
+
+
+hub = Hub()
+
+
+def _by_user(events: List[Event]) -> Dict[int, List[Event]]:
+    by_user: Dict[int, List[Event]] = defaultdict(list)
+    for event in events:
+        by_user[event.user_id].append(event)
+    return by_user
+
+
+class LocalBroker:
+    def __init__(self):
+        # Numbering, buffering and dispatching happen as one step.
+        self._lock = threading.Lock()
+
+    async def start(self) -> None:
+        pass
+
+    def send(self, events: List[Event]) -> List[Event]:
+        size = settings.EVENTS_REPLAY_SIZE
+        with self._lock:
+            events = [event.numbered(_event_id()) for event in events]
+            by_user = _by_user(events)
+            buffers = replay.get_many(str(user_id) for user_id in by_user)
+            replay.set_many(
+                {
+                    str(user_id): (buffers.get(str(user_id), []) + new)[-size:]
+                    for user_id, new in by_user.items()
+                }
+            )
+            for event in events:
+                hub.dispatch(event)
+        return events
+
+    def buffered(self, user_id: int) -> List[Event]:
+        return replay.get(str(user_id), [])
+
+
+class RedisBroker:
+    """Shares events between processes through one Redis channel."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self._client = None
+        self._listener = None
+
+    def _redis(self):
+        if self._client is None:
+            import redis
+
+            self._client = redis.Redis.from_url(self.url)
+        return self._client
+
+    async def start(self) -> None:
+        """Start this process's listener, once, on the running loop."""
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+
+    async def _listen(self) -> None:
+        import redis.asyncio
+
+        while True:
+            try:
+                client = redis.asyncio.Redis.from_url(self.url)
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(CHANNEL)
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            hub.dispatch(Event(**json.loads(message["data"])))
+            except Exception:
+                logger.exception("Event listener lost its Redis connection")
+                await asyncio.sleep(1)
+
+    def send(self, events: List[Event]) -> List[Event]:
+        # One script, so publishers on every process share one sequence and
+        # never drop each other's events.
+        ids = self._redis().eval(
+            SEND_SCRIPT,
+            len(events) + 1,
+            ID_KEY,
+            *(REPLAY_KEY.format(event.user_id) for event in events),
+            settings.EVENTS_REPLAY_SIZE,
+            settings.EVENTS_REPLAY_SECONDS,
+            CHANNEL,
+            *(json.dumps(event._asdict()) for event in events),
+        )
+        return [
+            event.numbered(event_id.decode()) for event, event_id in zip(events, ids)
+        ]
+
+    def buffered(self, user_id: int) -> List[Event]:
+        items = self._redis().lrange(REPLAY_KEY.format(user_id), 0, -1)
+        return [Event(**json.loads(item)) for item in items]
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        url = settings.EVENTS_BROKER_URL
+        _broker = RedisBroker(url) if url else LocalBroker()
+    return _broker
+
+
+def send(events: List[Event]) -> List[Event]:
+    """Number, buffer and publish ``events``; returns them with their ids."""
+    if not events:
+        return []
+    try:
+        return get_broker().send(events)
+    except Exception:
+        # Notifications are best effort: clients still see the results on
+        # their next fetch.
+        logger.exception("Couldn't publish %d result events", len(events))
+        return []
+
+
+def publish(orders: Iterable, event_type: str, using: str = "default") -> None:
+    """Publish ``event_type`` for each of ``orders`` once the transaction commits.
+
+    The events are numbered when they're sent, not now, so ids follow the
+    order in which transactions commit.
+    """
+    events = [
+        Event(
+            "",
+            order.user_id,
+            event_type,
+            {"id": order.pk, "ready": order.ready},
+        )
+        for order in orders
+    ]
+    if events:
+        transaction.on_commit(lambda: send(events), using=using)
+
+
+def missed(user_id: int, last_event_id: str) -> List[Event]:
+    """Return the buffered events for ``user_id`` after ``last_event_id``.
+
+    That's those buffered after it, when it's still in the buffer, and
+    otherwise those with a later id.
+    """
+    buffered = get_broker().buffered(user_id)
+    ids = [event.id for event in buffered]
+    if last_event_id in ids:
+        start = ids.index(last_event_id) + 1
+        return buffered[start:]
+    return [event for event in buffered if is_after(event.id, last_event_id)]
+
+
+async def stream(
+    user_id: int,
+    last_event_id: Optional[str] = None,
+    heartbeat: Optional[float] = None,
+    duration: Optional[float] = None,
+) -> AsyncIterator[str]:
+    """Yield ``user_id``'s events in the text/event-stream format.
+
+    Subscribes before replaying what the client missed, so nothing published
+    in between is lost, and skips live events the replay already delivered.
+    Sends a comment every ``heartbeat`` seconds to keep proxies from timing
+    the connection out, and ends after ``duration`` seconds; the client then
+    reconnects with its Last-Event-ID, which spreads streams across workers.
+    """
+    heartbeat = heartbeat or settings.EVENTS_HEARTBEAT_SECONDS
+    duration = duration or settings.EVENTS_STREAM_SECONDS
+    await get_broker().start()
+    async with hub.subscribe(user_id) as queue:
+        yield f"retry: {settings.EVENTS_RETRY_MILLISECONDS}\n\n"
+        replayed = set()
+        if last_event_id:
+            for event in await sync_to_async(missed)(user_id, last_event_id):
+                yield event.encode()
+                replayed.add(event.id)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + duration
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            try:
+                event = await asyncio.wait_for(
+                    queue.get(), timeout=min(heartbeat, remaining)
+                )
+            except asyncio.TimeoutError:
+                if loop.time() < deadline:
+                    yield ": keep-alive\n\n"
+                continue
+            if event.id not in replayed:
+                yield event.encode()
@@ -0,0 +1,268 @@
+"""Streaming exports of blood test results.
+
+Rows are read in primary-key order with ``QuerySet.iterator`` (a server-side
+cursor on Postgres) from every shard, flattened to one value column and one
+reference-range flag column per analyte in ``BLOOD_TEST_CHOICES`` and encoded
+chunk by chunk, so memory use depends on ``chunk_size`` and not on the size
+of the export.
+
+Each encoder yields one ``ExportChunk`` per chunk of rows. The gzip
+formats finish a gzip member per chunk, so the output up to any chunk
+boundary is a complete file, which is what lets ``export_results --resume``
+truncate to its checkpoint and carry on.
+"""
+import csv
+import heapq
+import io
+import json
+import zlib
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import QuerySet
+
+from .constants.blood_tests import BLOOD_TEST_CHOICES
+from .models import BloodTestResults
+from .sharding import get_shards
+
+FORMAT_NDJSON = "ndjson"
+FORMAT_CSV = "csv"
+FORMAT_PARQUET = "parquet"
+FORMATS = (FORMAT_NDJSON, FORMAT_CSV, FORMAT_PARQUET)
+
+CONTENT_TYPES = {
+    FORMAT_NDJSON: "application/gzip",
+    FORMAT_CSV: "application/gzip",
+    FORMAT_PARQUET: "application/vnd.apache.parquet",
+}
+EXTENSIONS = {
+    FORMAT_NDJSON: "ndjson.gz",
+    FORMAT_CSV: "csv.gz",
+    FORMAT_PARQUET: "parquet",
+}
+
+ANALYTES = [code for code, _ in BLOOD_TEST_CHOICES]
+COLUMNS = (
+    ["id", "user_id", "lab_id", "timestamp", "ready"]
+    + [f"result_{code}" for code in ANALYTES]
+    + [f"flag_{code}" for code in ANALYTES]
+)
+
+
+class ExportChunk(NamedTuple):
+    data: bytes
+    last_id: int
+    rows: int
+
+
+def export_queryset(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    lab: Optional[int] = None,
+    ready: Optional[bool] = None,
+    after_id: int = 0,
+) -> QuerySet:
+    filters: Dict[str, Any] = {"pk__gt": after_id}
+    if since is not None:
+        filters["timestamp__gte"] = since
+    if until is not None:
+        filters["timestamp__lt"] = until
+    if lab is not None:
+        filters["lab_id"] = lab
+    if ready is not None:
+        filters["ready"] = ready
+    return (
+        BloodTestResults.objects.filter(**filters)
+        .order_by("pk")
+        .values_list("id", "user_id", "lab_id", "timestamp", "ready", "results")
+    )
+
+
+def iter_rows(queryset: QuerySet, chunk_size: int) -> Iterator[tuple]:
+    """Stream ``queryset`` from every shard, merged in primary-key order."""
+    shards = get_shards()
+    if len(shards) == 1:
+        return queryset.iterator(chunk_size=chunk_size)
+    return heapq.merge(
+        *(queryset.using(alias).iterator(chunk_size=chunk_size) for alias in shards),
+        key=lambda row: row[0],
+    )
+
+
+def analyte_values(results: Any) -> Dict[str, Any]:
+    """Return the analyte -> value mapping from a ``results`` JSON document.
+
+    Lab results come either flat (``{"HDL": 87}``) or nested under
+    ``"values"``.
+    """
+    if not isinstance(results, dict):
+        return {}
+    values = results.get("values")
+    return values if isinstance(values, dict) else results
+
+
+def flatten(row: tuple) -> Dict[str, Any]:
+    pk, user_id, lab_id, timestamp, ready, results = row
+    values = analyte_values(results)
+    flat = {
+        "id": pk,
+        "user_id": user_id,
+        "lab_id": lab_id,
+        "timestamp": timestamp,
+        "ready": ready,
+    }
+    for code in ANALYTES:
+        flat[f"result_{code}"] = values.get(code)
+    return flat
+
+
+def add_flags(chunk: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Fill in the ``flag_*`` columns of a chunk of flattened rows at once."""
+    from .flagging import flag_rows
+
+    flags = flag_rows(
+        [
+            (
+                row["user_id"],
+                row["timestamp"],
+                {code: row[f"result_{code}"] for code in ANALYTES},
+            )
+            for row in chunk
+        ]
+    )
+    for row, row_flags in zip(chunk, flags):
+        for code in ANALYTES:
+            row[f"flag_{code}"] = row_flags.get(code)
+    return chunk
+
+
+def chunked(rows: Iterable[tuple], size: int) -> Iterator[List[Dict[str, Any]]]:
+    chunk = []
+    for row in rows:
+        chunk.append(flatten(row))
+        if len(chunk) >= size:
+            yield add_flags(chunk)
+            chunk = []
+    if chunk:
+        yield add_flags(chunk)
+
+
+def _gzip(data: bytes) -> bytes:
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    return compressor.compress(data) + compressor.flush()
+
+
+def encode_ndjson(
+    chunks: Iterable[List[Dict[str, Any]]], header: bool = True
+) -> Iterator[ExportChunk]:
+    for chunk in chunks:
+        lines = "".join(json.dumps(row, cls=DjangoJSONEncoder) + "\n" for row in chunk)
+        yield ExportChunk(_gzip(lines.encode()), chunk[-1]["id"], len(chunk))
+
+
+def encode_csv(
+    chunks: Iterable[List[Dict[str, Any]]], header: bool = True
+) -> Iterator[ExportChunk]:
+    for chunk in chunks:
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=COLUMNS)
+        if header:
+            writer.writeheader()
+            header = False
+        for row in chunk:
+            writer.writerow({**row, "timestamp": row["timestamp"].isoformat()})
+        yield ExportChunk(
+            _gzip(buffer.getvalue().encode()), chunk[-1]["id"], len(chunk)
+        )
+
+
+class _DrainableSink(io.RawIOBase):
+    """A write-only file that hands back whatever was written since last time."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def _numeric(value: Any) -> Optional[float]:
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def encode_parquet(
+    chunks: Iterable[List[Dict[str, Any]]], header: bool = True
+) -> Iterator[ExportChunk]:
+    """Write one Parquet row group per chunk; the footer comes with the last."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema(
+        [
+            ("id", pa.int64()),
+            ("user_id", pa.int64()),
+            ("lab_id", pa.int64()),
+            ("timestamp", pa.timestamp("us", tz="UTC")),
+            ("ready", pa.bool_()),
+        ]
+        + [(f"result_{code}", pa.float64()) for code in ANALYTES]
+        + [(f"flag_{code}", pa.string()) for code in ANALYTES]
+    )
+    sink = _DrainableSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    last_id = 0
+    for chunk in chunks:
+        columns: Dict[str, list] = {name: [] for name in schema.names}
+        for row in chunk:
+            for name in schema.names:
+                value = row[name]
+                columns[name].append(
+                    _numeric(value) if name.startswith("result_") else value
+                )
+        writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+        last_id = chunk[-1]["id"]
+        yield ExportChunk(sink.drain(), last_id, len(chunk))
+    writer.close()
+    yield ExportChunk(sink.drain(), last_id, 0)
+
+
+ENCODERS = {
+    FORMAT_NDJSON: encode_ndjson,
+    FORMAT_CSV: encode_csv,
+    FORMAT_PARQUET: encode_parquet,
+}
+
+
+def export(
+    queryset: QuerySet, fmt: str, chunk_size: int = 5000, header: bool = True
+) -> Iterator[ExportChunk]:
+    """Encode ``queryset`` as ``fmt``, one ``ExportChunk`` at a time.
+
+    ``header`` is false when the output continues an earlier, interrupted
+    export: CSV then leaves out its header row. NDJSON has none, and a Parquet
+    file can't be continued at all, as its footer covers every row group.
+    """
+    if fmt == FORMAT_PARQUET and not header:
+        raise ValueError("Parquet exports can't continue an earlier file.")
+    chunks = chunked(iter_rows(queryset, chunk_size), chunk_size)
+    return ENCODERS[fmt](chunks, header=header)
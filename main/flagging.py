@@ -0,0 +1,208 @@
+"""Flagging results against the reference ranges in main/constants/blood_tests.py.
+
+``flag`` works on whole batches at once: it takes parallel NumPy arrays of
+test indexes, values, sexes and ages and returns an array of flags, looping
+in Python only over the (few) reference ranges, never over the values.
+``flag_results`` and ``flag_rows`` adapt it to results as stored, one
+``{code: value}`` mapping per order.
+
+Each value gets the first range listed in ``REFERENCE_RANGES`` that matches
+its test, the patient's sex and their age when the sample was taken; values
+without a matching range, or that aren't numbers, are left unflagged.
+"""
+import datetime
+import math
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from .constants.blood_tests import (
+    BLOOD_TESTS,
+    REFERENCE_RANGES,
+    SEX_ANY,
+    SEX_FEMALE,
+    SEX_MALE,
+    ReferenceRange,
+)
+from .models import User
+
+FLAG_NONE = 0
+FLAG_LOW = 1
+FLAG_NORMAL = 2
+FLAG_HIGH = 3
+FLAG_LABELS: Dict[int, Optional[str]] = {
+    FLAG_NONE: None,
+    FLAG_LOW: "L",
+    FLAG_NORMAL: "N",
+    FLAG_HIGH: "H",
+}
+
+TEST_CODES = list(BLOOD_TESTS)
+TEST_INDEX = {code: i for i, code in enumerate(TEST_CODES)}
+SEX_INDEX = {SEX_ANY: 0, SEX_FEMALE: 1, SEX_MALE: 2}
+
+# code -> flag for one {code: value} mapping
+Flags = Dict[str, Optional[str]]
+
+
+class RangeTable(NamedTuple):
+    test: np.ndarray
+    sex: np.ndarray
+    min_age: np.ndarray
+    max_age: np.ndarray
+    low: np.ndarray
+    high: np.ndarray
+
+
+def compile_ranges(ranges: Sequence[ReferenceRange] = REFERENCE_RANGES) -> RangeTable:
+    """Turn ``ranges`` into arrays, with open bounds as infinities."""
+
+    def bound(value, default):
+        return default if value is None else value
+
+    return RangeTable(
+        test=np.array([TEST_INDEX[r.test] for r in ranges], dtype=np.intp),
+        sex=np.array([SEX_INDEX[r.sex] for r in ranges], dtype=np.int8),
+        min_age=np.array([bound(r.min_age, -np.inf) for r in ranges]),
+        max_age=np.array([bound(r.max_age, np.inf) for r in ranges]),
+        low=np.array([bound(r.low, -np.inf) for r in ranges]),
+        high=np.array([bound(r.high, np.inf) for r in ranges]),
+    )
+
+
+RANGES = compile_ranges()
+
+
+def flag(
+    tests: np.ndarray,
+    values: np.ndarray,
+    sexes: Optional[np.ndarray] = None,
+    ages: Optional[np.ndarray] = None,
+    table: RangeTable = RANGES,
+) -> np.ndarray:
+    """Return a ``FLAG_*`` per value.
+
+    ``tests`` are indexes into ``TEST_CODES``, ``sexes`` indexes of
+    ``SEX_INDEX`` (0 where unknown) and ``ages`` in years (NaN where
+    unknown). Values that aren't numbers should be NaN.
+    """
+    tests = np.asarray(tests, dtype=np.intp)
+    values = np.asarray(values, dtype=np.float64)
+    size = len(values)
+    sexes = np.zeros(size, np.int8) if sexes is None else np.asarray(sexes)
+    ages = np.full(size, np.nan) if ages is None else np.asarray(ages, np.float64)
+
+    low = np.empty(size)
+    high = np.empty(size)
+    matched = np.zeros(size, dtype=bool)
+    for i in range(len(table.test)):
+        mask = ~matched & (tests == table.test[i])
+        if table.sex[i]:
+            mask &= sexes == table.sex[i]
+        # Comparisons with NaN are false: an unknown age only matches a range
+        # open on that side.
+        if table.min_age[i] != -np.inf:
+            mask &= ages >= table.min_age[i]
+        if table.max_age[i] != np.inf:
+            mask &= ages < table.max_age[i]
+        low[mask] = table.low[i]
+        high[mask] = table.high[i]
+        matched |= mask
+
+    flags = np.full(size, FLAG_NONE, dtype=np.int8)
+    measured = matched & ~np.isnan(values)
+    flags[measured] = FLAG_NORMAL
+    flags[measured & (values < low)] = FLAG_LOW
+    flags[measured & (values > high)] = FLAG_HIGH
+    return flags
+
+
+def flag_value(
+    test: str, value: Any, sex: str = SEX_ANY, age: Optional[float] = None
+) -> Optional[str]:
+    """Flag one value in plain Python; ``flag`` must agree with it."""
+    number = to_number(value)
+    if math.isnan(number):
+        return None
+    for r in REFERENCE_RANGES:
+        if r.test != test or (r.sex and r.sex != sex):
+            continue
+        if r.min_age is not None and (age is None or age < r.min_age):
+            continue
+        if r.max_age is not None and (age is None or age >= r.max_age):
+            continue
+        if r.low is not None and number < r.low:
+            return "L"
+        if r.high is not None and number > r.high:
+            return "H"
+        return "N"
+    return None
+
+
+def to_number(value: Any) -> float:
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        return math.nan
+    try:
+        return float(value)
+    except ValueError:
+        return math.nan
+
+
+def age_at(date_of_birth: Optional[datetime.date], when: datetime.datetime):
+    if date_of_birth is None:
+        return math.nan
+    return (when.date() - date_of_birth).days / 365.25
+
+
+def flag_results(
+    results: Sequence[Mapping[str, Any]],
+    sexes: Optional[Sequence[str]] = None,
+    ages: Optional[Sequence[float]] = None,
+) -> List[Flags]:
+    """Flag every known test in each ``{code: value}`` mapping of ``results``.
+
+    ``sexes`` and ``ages`` are per mapping, ``SEX_ANY`` and NaN where unknown.
+    """
+    rows, codes, tests, values = [], [], [], []
+    for row, mapping in enumerate(results):
+        for code, value in mapping.items():
+            if code in TEST_INDEX:
+                rows.append(row)
+                codes.append(code)
+                tests.append(TEST_INDEX[code])
+                values.append(to_number(value))
+
+    row_index = np.array(rows, dtype=np.intp)
+    value_sexes = value_ages = None
+    if sexes is not None:
+        value_sexes = np.array([SEX_INDEX[s or SEX_ANY] for s in sexes], np.int8)
+        value_sexes = value_sexes[row_index]
+    if ages is not None:
+        value_ages = np.array(ages, dtype=np.float64)[row_index]
+    flags = flag(np.array(tests, np.intp), np.array(values), value_sexes, value_ages)
+
+    flagged: List[Flags] = [{} for _ in results]
+    for row, code, value_flag in zip(rows, codes, flags.tolist()):
+        flagged[row][code] = FLAG_LABELS[value_flag]
+    return flagged
+
+
+def demographics(user_ids) -> Dict[int, tuple]:
+    """Return user id -> (sex, date of birth) in one query."""
+    return {
+        pk: (sex, date_of_birth)
+        for pk, sex, date_of_birth in User.objects.filter(
+            pk__in=set(user_ids)
+        ).values_list("pk", "sex", "date_of_birth")
+    }
+
+
+def flag_rows(rows: Sequence[tuple]) -> List[Flags]:
+    """Flag ``(user_id, timestamp, {code: value})`` rows."""
+    people = demographics(user_id for user_id, _, _ in rows)
+    sexes, ages = [], []
+    for user_id, timestamp, _ in rows:
+        sex, date_of_birth = people.get(user_id, (SEX_ANY, None))
+        sexes.append(sex)
+        ages.append(age_at(date_of_birth, timestamp))
+    return flag_results([values for _, _, values in rows], sexes, ages)
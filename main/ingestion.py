@@ -0,0 +1,259 @@
+"""Bulk ingestion of lab results from files.
+
+Labs send results as one of two flat formats, both read line by line so a
+file of any size is processed in constant memory:
+
+* CSV with a header and one analyte per row::
+
+      order_id,analyte,value
+      1234,HDL,87
+
+* HL7-like pipe-delimited segments, where an ``ORC`` (or ``OBR``) segment
+  starts an order (its second field is our order id) and each ``OBX``
+  segment carries one analyte code (third field) and value (fifth field).
+  Other segments (``MSH``, ``PID``, ...) are skipped::
+
+      ORC|NW|1234
+      OBX|1|NM|HDL||87|mg/dL
+
+Observations are gathered into batches of ``batch_size`` input lines. Each
+batch looks its orders up by id (once per shard), merges the values into
+their ``results``, marks them ready, flags them against the reference
+ranges (counting the abnormal values) and writes them back with
+``bulk_update``. Lines that can't be applied are counted by reason rather
+than failing the file. After each batch, ``IngestReport.line`` is the last
+input line fully applied, which ``ingest_results --resume`` restarts from.
+"""
+import csv
+import itertools
+import math
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import events, lab_stats, outbox, result_summaries
+from .constants.blood_tests import BLOOD_TEST_CHOICES
+from .exports import analyte_values
+from .models import BloodTestResults, Lab, Notification
+from .sharding import get_shards
+
+FORMAT_CSV = "csv"
+FORMAT_HL7 = "hl7"
+FORMATS = (FORMAT_CSV, FORMAT_HL7)
+
+ANALYTES = frozenset(code for code, _ in BLOOD_TEST_CHOICES)
+
+
+class Observation(NamedTuple):
+    line: int
+    order_id: int
+    analyte: str
+    value: object
+
+
+class Rejection(NamedTuple):
+    line: int
+    reason: str
+
+
+@dataclass
+class IngestReport:
+    line: int = 0
+    observations: int = 0
+    orders: int = 0
+    abnormal: int = 0
+    rejected: Counter = field(default_factory=Counter)
+    seconds: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.observations / self.seconds if self.seconds else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "line": self.line,
+            "observations": self.observations,
+            "orders": self.orders,
+            "abnormal": self.abnormal,
+            "rejected": dict(self.rejected),
+            "seconds": round(self.seconds, 3),
+            "rows_per_second": round(self.rows_per_second, 1),
+        }
+
+
+def parse_value(raw: str):
+    """Return a numeric value as a number, anything else as stripped text."""
+    raw = raw.strip()
+    try:
+        number = float(raw)
+    except ValueError:
+        return raw
+    if not math.isfinite(number):
+        return raw
+    return int(number) if number.is_integer() and "." not in raw else number
+
+
+def _observation(line: int, order_id: str, analyte: str, value: str):
+    try:
+        pk = int(order_id)
+    except (TypeError, ValueError):
+        return Rejection(line, "invalid order id")
+    analyte = analyte.strip().upper()
+    if analyte not in ANALYTES:
+        return Rejection(line, "unknown analyte")
+    if not value.strip():
+        return Rejection(line, "missing value")
+    return Observation(line, pk, analyte, parse_value(value))
+
+
+def parse_csv(lines: Iterable[str]) -> Iterator:
+    """Yield an ``Observation`` or ``Rejection`` per data row of a CSV file."""
+    reader = csv.reader(lines)
+    header = [column.strip().lower() for column in next(reader, [])]
+    try:
+        columns = [header.index(name) for name in ("order_id", "analyte", "value")]
+    except ValueError:
+        raise ValueError("CSV header must have order_id, analyte and value columns.")
+    for row in reader:
+        if not any(row):
+            continue
+        line = reader.line_num
+        try:
+            order_id, analyte, value = (row[i] for i in columns)
+        except IndexError:
+            yield Rejection(line, "missing columns")
+            continue
+        yield _observation(line, order_id, analyte, value)
+
+
+def parse_hl7(lines: Iterable[str]) -> Iterator:
+    """Yield an ``Observation`` or ``Rejection`` per ``OBX`` segment."""
+    order_id = None
+    for line, text in enumerate(lines, start=1):
+        fields = text.rstrip("\r\n").split("|")
+        segment = fields[0].strip().upper()
+        if segment in ("ORC", "OBR"):
+            order_id = fields[2] if len(fields) > 2 else None
+        elif segment == "OBX":
+            if order_id is None:
+                yield Rejection(line, "observation outside an order")
+            elif len(fields) < 6:
+                yield Rejection(line, "missing columns")
+            else:
+                yield _observation(line, order_id, fields[3], fields[5])
+
+
+PARSERS: Dict[str, Callable[[Iterable[str]], Iterator]] = {
+    FORMAT_CSV: parse_csv,
+    FORMAT_HL7: parse_hl7,
+}
+
+
+def _batches(records: Iterator, batch_size: int) -> Iterator[list]:
+    """Group records into batches spanning ``batch_size`` input lines each.
+
+    A batch never ends in the middle of a line, so the line of the last
+    record of a batch is a safe checkpoint.
+    """
+    batch: list = []
+    for record in records:
+        if batch and record.line - batch[0].line >= batch_size:
+            yield batch
+            batch = []
+        batch.append(record)
+    if batch:
+        yield batch
+
+
+def _count_abnormal(orders: List[BloodTestResults]) -> int:
+    from .flagging import flag_rows
+
+    flags = flag_rows(
+        [(o.user_id, o.timestamp, analyte_values(o.results)) for o in orders]
+    )
+    return sum(flag in ("L", "H") for row in flags for flag in row.values())
+
+
+def apply_batch(
+    observations: List[Observation], lab: Optional[Lab], report: IngestReport
+) -> None:
+    """Merge ``observations`` into their orders and mark the orders ready."""
+    by_order: Dict[int, List[Observation]] = defaultdict(list)
+    for observation in observations:
+        by_order[observation.order_id].append(observation)
+
+    found = set()
+    now = timezone.now()
+    for alias in get_shards():
+        with transaction.atomic(using=alias):
+            orders = BloodTestResults.objects.using(alias).in_bulk(by_order.keys())
+            updated, became_ready = [], []
+            for pk, order in orders.items():
+                found.add(pk)
+                if lab is not None and order.lab_id != lab.pk:
+                    report.rejected["order of another lab"] += len(by_order[pk])
+                    continue
+                results = dict(order.results or {})
+                results.update((o.analyte, o.value) for o in by_order[pk])
+                order.results = results
+                if lab_stats.mark_ready(order, now):
+                    became_ready.append(order)
+                order.claimed_by = None
+                order.claimed_until = None
+                updated.append(order)
+                report.observations += len(by_order[pk])
+            report.abnormal += _count_abnormal(updated)
+            BloodTestResults.objects.using(alias).bulk_update(
+                updated,
+                ["results", "ready", "ready_at", "claimed_by", "claimed_until"],
+                batch_size=500,
+            )
+            lab_stats.record_ready(became_ready)
+            # Orders that were ready already may have gained values too.
+            result_summaries.record_ready(became_ready, updated=updated)
+            outbox.enqueue(became_ready, Notification.KIND_RESULT_READY, using=alias)
+            events.publish(became_ready, events.EVENT_READY, using=alias)
+        report.orders += len(updated)
+    for pk in by_order.keys() - found:
+        report.rejected["unknown order"] += len(by_order[pk])
+
+
+def ingest(
+    lines: Iterable[str],
+    fmt: str,
+    lab: Optional[Lab] = None,
+    batch_size: int = 5000,
+    skip_lines: int = 0,
+    on_batch: Optional[Callable[[IngestReport], None]] = None,
+    report: Optional[IngestReport] = None,
+) -> IngestReport:
+    """Apply the results in ``lines``, a text file in format ``fmt``.
+
+    Lines up to ``skip_lines`` were applied by an earlier run and are only
+    parsed (an HL7 order may have started before the checkpoint). When
+    ``lab`` is given, only that lab's orders are updated. ``on_batch`` is
+    called with the running report after every batch.
+    """
+    report = report or IngestReport()
+    started = time.monotonic() - report.seconds
+    records = itertools.dropwhile(
+        lambda record: record.line <= skip_lines, PARSERS[fmt](lines)
+    )
+    for batch in _batches(records, batch_size):
+        observations = []
+        for record in batch:
+            if isinstance(record, Rejection):
+                report.rejected[record.reason] += 1
+            else:
+                observations.append(record)
+        apply_batch(observations, lab, report)
+        report.line = batch[-1].line
+        report.seconds = time.monotonic() - started
+        if on_batch is not None:
+            on_batch(report)
+    report.seconds = time.monotonic() - started
+    return report
@@ -1,3 +1,5 @@
+import random
+import time
 from typing import Dict
 from urllib.parse import urljoin
 
@@ -6,6 +8,8 @@ from django.conf import settings
 from requests.models import Response as RequestResponse
 from rest_framework import status
 
+from main import metrics, request_context, throttling
+
 
 def validate_response(
     response: RequestResponse, expected_status: int, method_name: str
@@ -32,10 +36,24 @@ class IpGeolocationClient:
         self,
         base_url=None,
         api_key=None,
+        max_retries=None,
+        backoff=None,
+        max_backoff=None,
     ):
         self.session = requests.Session()
         self.base_url = base_url or settings.IP_GEOLOCATION_BASE_URL
         self.api_key = api_key or settings.IP_GEOLOCATION_API_KEY
+        self.max_retries = (
+            settings.IP_GEOLOCATION_MAX_RETRIES if max_retries is None else max_retries
+        )
+        self.backoff = (
+            settings.IP_GEOLOCATION_BACKOFF_SECONDS if backoff is None else backoff
+        )
+        self.max_backoff = (
+            settings.IP_GEOLOCATION_MAX_BACKOFF_SECONDS
+            if max_backoff is None
+            else max_backoff
+        )
 
     def get_ip_geolocation(self, params: Dict[str, str] = None):
         """Get geolocation via IP Geolocation API which
@@ -44,12 +62,50 @@ class IpGeolocationClient:
         if params is None:
             params = dict()
         params["apiKey"] = self.api_key
-        response = requests.get(
+        response = self._get(
             urljoin(self.base_url, self.ENDPOINT_GET_GEOLOCATION), params=params
         )
-        validate_response(
-            response=response,
-            expected_status=status.HTTP_200_OK,
-            method_name=method_name,
-        )
+        try:
+            validate_response(
+                response=response,
+                expected_status=status.HTTP_200_OK,
+                method_name=method_name,
+            )
+        except Exception:
+            metrics.GEOLOCATION_ERRORS.labels(reason=response.status_code).inc()
+            raise
         return response.json()
+
+    def _delay(self, attempt: int) -> float:
+        """How long to wait before retry number ``attempt``: capped, with jitter."""
+        return random.uniform(
+            0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        )
+
+    def _get(self, url: str, params: Dict[str, str]) -> RequestResponse:
+        """GET ``url``, retrying connection errors and 5xx responses after a wait."""
+        attempt = 0
+        while True:
+            # Every attempt counts against the paid quota, retries included.
+            throttling.take_upstream("geolocation")
+            start = time.perf_counter()
+            try:
+                response = requests.get(url, params=params)
+            except requests.RequestException as exc:
+                elapsed = time.perf_counter() - start
+                request_context.add_upstream_time(elapsed)
+                metrics.GEOLOCATION_LATENCY.labels(outcome="error").observe(elapsed)
+                if attempt >= self.max_retries:
+                    metrics.GEOLOCATION_ERRORS.labels(reason=type(exc).__name__).inc()
+                    raise
+            else:
+                elapsed = time.perf_counter() - start
+                request_context.add_upstream_time(elapsed)
+                metrics.GEOLOCATION_LATENCY.labels(
+                    outcome=response.status_code
+                ).observe(elapsed)
+                if response.status_code < 500 or attempt >= self.max_retries:
+                    return response
+            attempt += 1
+            metrics.GEOLOCATION_RETRIES.inc()
+            time.sleep(self._delay(attempt))
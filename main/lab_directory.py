@@ -0,0 +1,232 @@
+"""The lab directory: cached lab lists and the bulk loader that feeds them.
+
+Labs send their directory as CSV with a header, or as NDJSON with one
+object per line, using the ``Lab`` field names as columns or keys::
+
+    name,address,address_2,city,post_code,country,email,number
+    Central Lab,1 Lab Street,,London,SW1 9RH,GB,lab@example.com,0795033954
+
+``load`` streams the file in batches of ``batch_size`` rows. Each row is
+checked with the model's own fields (so countries must be ones
+``CountryField`` knows and emails must pass ``EmailValidator``); a row that
+fails is counted by reason rather than failing the file. Valid rows are
+compared with the labs already stored under their ``name`` (one query per
+batch) and only new or changed ones are written, with one
+``INSERT ... ON CONFLICT (name) DO UPDATE`` per batch. Within a batch, the
+last row for a name wins.
+
+Cached lab lists are per country and city, so the loader notes the places
+whose labs it changed and deletes just those lists, once, after the last
+batch.
+"""
+import csv
+import itertools
+import json
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Iterator, NamedTuple, Set, Tuple
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from . import compression
+from .cache import Cache
+from .models import Lab
+
+# Lab lists change rarely and are the same for everyone.
+lab_lists: Cache[compression.Payload] = Cache(
+    "lab-lists", timeout=settings.LAB_LIST_CACHE_SECONDS
+)
+
+FORMAT_CSV = "csv"
+FORMAT_NDJSON = "ndjson"
+FORMATS = (FORMAT_CSV, FORMAT_NDJSON)
+
+FIELDS = (
+    "name",
+    "address",
+    "address_2",
+    "city",
+    "post_code",
+    "country",
+    "email",
+    "number",
+)
+UPDATE_FIELDS = [name for name in FIELDS if name != "name"]
+
+# (country, lower-cased city); a city of "" is the whole country's list.
+Place = Tuple[str, str]
+
+
+def lab_list_key(country: str, city: str = "") -> str:
+    return f"{country.upper()}:{quote(city.lower())}"
+
+
+def invalidate_lab_lists(places: Iterable[Place]) -> None:
+    """Drop the cached lists for ``places`` and their countries."""
+    keys = set()
+    for country, city in places:
+        keys.add(lab_list_key(country))
+        keys.add(lab_list_key(country, city))
+    if keys:
+        lab_lists.delete_many(keys)
+
+
+class Row(NamedTuple):
+    line: int
+    values: Dict[str, str]
+
+
+class Rejection(NamedTuple):
+    line: int
+    reason: str
+
+
+@dataclass
+class LoadReport:
+    line: int = 0
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    rejected: Counter = field(default_factory=Counter)
+    # Places whose cached lab lists are out of date.
+    places: Set[Place] = field(default_factory=set)
+    seconds: float = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "line": self.line,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "unchanged": self.unchanged,
+            "rejected": dict(self.rejected),
+            "seconds": round(self.seconds, 3),
+        }
+
+
+def _row(line: int, record: dict):
+    values = {}
+    for name in FIELDS:
+        value = record.get(name)
+        values[name] = "" if value is None else str(value).strip()
+    if not values["name"]:
+        return Rejection(line, "missing name")
+    values["country"] = values["country"].upper()
+    return Row(line, values)
+
+
+def parse_csv(lines: Iterable[str]) -> Iterator:
+    """Yield a ``Row`` or ``Rejection`` per data row of a CSV file."""
+    reader = csv.reader(lines)
+    header = [column.strip().lower() for column in next(reader, [])]
+    if "name" not in header:
+        raise ValueError("CSV header must have a name column.")
+    for row in reader:
+        if not any(row):
+            continue
+        if len(row) != len(header):
+            yield Rejection(reader.line_num, "wrong number of columns")
+            continue
+        yield _row(reader.line_num, dict(zip(header, row)))
+
+
+def parse_ndjson(lines: Iterable[str]) -> Iterator:
+    """Yield a ``Row`` or ``Rejection`` per line of an NDJSON file."""
+    for line, text in enumerate(lines, start=1):
+        if not text.strip():
+            continue
+        try:
+            record = json.loads(text)
+        except ValueError:
+            yield Rejection(line, "invalid JSON")
+            continue
+        if not isinstance(record, dict):
+            yield Rejection(line, "not an object")
+            continue
+        yield _row(line, record)
+
+
+PARSERS: Dict[str, Callable[[Iterable[str]], Iterator]] = {
+    FORMAT_CSV: parse_csv,
+    FORMAT_NDJSON: parse_ndjson,
+}
+
+_model_fields = [Lab._meta.get_field(name) for name in FIELDS]
+
+
+def validate(row: Row):
+    """Return ``row`` if the model would accept it, else a ``Rejection``."""
+    for model_field in _model_fields:
+        try:
+            model_field.clean(row.values[model_field.name], None)
+        except ValidationError:
+            return Rejection(row.line, f"invalid {model_field.name}")
+    return row
+
+
+def apply_batch(rows: Iterable[Row], report: LoadReport) -> None:
+    """Insert the new labs of ``rows`` and update the changed ones."""
+    latest = {row.values["name"]: row.values for row in rows}
+    if not latest:
+        return
+    existing = Lab.objects.in_bulk(list(latest), field_name="name")
+    labs = []
+    for name, values in latest.items():
+        lab = existing.get(name)
+        if lab is None:
+            report.inserted += 1
+        elif all(getattr(lab, key) == value for key, value in values.items()):
+            report.unchanged += 1
+            continue
+        else:
+            report.updated += 1
+            report.places.add((lab.country.code, lab.city.lower()))
+        report.places.add((values["country"], values["city"].lower()))
+        labs.append(Lab(**values))
+    if labs:
+        with transaction.atomic():
+            Lab.objects.bulk_create(
+                labs,
+                update_conflicts=True,
+                unique_fields=["name"],
+                update_fields=UPDATE_FIELDS,
+            )
+
+
+def load(
+    lines: Iterable[str],
+    fmt: str,
+    batch_size: int = 1000,
+    on_batch: Callable[[LoadReport], None] = None,
+) -> LoadReport:
+    """Upsert the labs in ``lines``, a text file in format ``fmt``."""
+    report = LoadReport()
+    started = time.monotonic()
+    records = PARSERS[fmt](lines)
+    try:
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if not batch:
+                break
+            rows = []
+            for record in batch:
+                if isinstance(record, Row):
+                    record = validate(record)
+                if isinstance(record, Rejection):
+                    report.rejected[record.reason] += 1
+                else:
+                    rows.append(record)
+            apply_batch(rows, report)
+            report.line = batch[-1].line
+            report.seconds = time.monotonic() - started
+            if on_batch is not None:
+                on_batch(report)
+    finally:
+        # Once for the whole file, and even if it stopped half way: the
+        # batches before the failure are committed.
+        invalidate_lab_lists(report.places)
+    report.seconds = time.monotonic() - started
+    return report
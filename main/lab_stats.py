@@ -0,0 +1,178 @@
+"""Per-lab, per-day order statistics, maintained as orders change.
+
+Every path that creates, readies or deletes orders calls ``record_created``,
+``record_ready`` or ``record_deleted`` with the orders concerned; the changes are summed per
+(lab, day the order was placed) and applied with one ``UPDATE ... SET
+x = x + n`` per row, so concurrent writers never lose each other's counts.
+Bulk paths pass whole batches. ``./manage.py rebuild_lab_stats`` recomputes
+the rows from the results table should they ever drift.
+"""
+import datetime
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import BloodTestResults, LabDailyStats
+from .sharding import get_shards
+
+COUNTERS = ("orders", "ready", "turnaround_seconds", "turnaround_count")
+
+Key = Tuple[int, datetime.date]
+Changes = Dict[Key, Dict[str, float]]
+
+
+def _key(order: BloodTestResults) -> Key:
+    return order.lab_id, timezone.localdate(order.timestamp)
+
+
+def apply(changes: Changes) -> None:
+    """Add ``changes`` to the summary rows, creating missing rows."""
+    if not changes:
+        return
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        LabDailyStats.objects.bulk_create(
+            [LabDailyStats(lab_id=lab_id, day=day) for lab_id, day in sorted(changes)],
+            ignore_conflicts=True,
+        )
+        # Rows are locked in a fixed order, so two writers can't deadlock.
+        for (lab_id, day), counters in sorted(changes.items()):
+            LabDailyStats.objects.filter(lab_id=lab_id, day=day).update(
+                **{name: F(name) + value for name, value in counters.items()}
+            )
+
+
+def record_created(orders: Iterable[BloodTestResults]) -> None:
+    changes: Changes = defaultdict(lambda: defaultdict(int))
+    for order in orders:
+        if order.lab_id is not None:
+            changes[_key(order)]["orders"] += 1
+    apply(changes)
+
+
+def record_ready(orders: Iterable[BloodTestResults], sign: int = 1) -> None:
+    """Count ``orders``, which have just turned ready, as done.
+
+    With ``sign=-1``, take back orders that are no longer ready, as they
+    were before the change.
+    """
+    changes: Changes = defaultdict(lambda: defaultdict(int))
+    for order in orders:
+        if order.lab_id is None:
+            continue
+        counters = changes[_key(order)]
+        counters["ready"] += sign
+        if order.ready_at is not None:
+            turnaround = order.ready_at - order.timestamp
+            counters["turnaround_seconds"] += sign * turnaround.total_seconds()
+            counters["turnaround_count"] += sign
+    apply(changes)
+
+
+def record_deleted(orders: Iterable[BloodTestResults]) -> None:
+    """Take back ``orders``, which have just been deleted, as they were."""
+    orders = list(orders)
+    changes: Changes = defaultdict(lambda: defaultdict(int))
+    for order in orders:
+        if order.lab_id is not None:
+            changes[_key(order)]["orders"] -= 1
+    apply(changes)
+    record_ready([order for order in orders if order.ready], sign=-1)
+
+
+def mark_ready(order: BloodTestResults, now: datetime.datetime) -> bool:
+    """Mark ``order`` ready, returning whether that's a change."""
+    if order.ready:
+        return False
+    order.ready = True
+    order.ready_at = now
+    return True
+
+
+def compute(
+    lab_id: Optional[int] = None, since: Optional[datetime.date] = None
+) -> Changes:
+    """Recompute the summary from the results on every shard."""
+    totals: Changes = defaultdict(lambda: defaultdict(int))
+    turnaround = ExpressionWrapper(
+        F("ready_at") - F("timestamp"), output_field=DurationField()
+    )
+    timed = Q(ready=True, ready_at__isnull=False)
+    for alias in get_shards():
+        queryset = BloodTestResults.objects.using(alias).filter(lab__isnull=False)
+        if lab_id is not None:
+            queryset = queryset.filter(lab_id=lab_id)
+        if since is not None:
+            start = datetime.datetime.combine(since, datetime.time())
+            queryset = queryset.filter(timestamp__gte=timezone.make_aware(start))
+        rows = (
+            queryset.annotate(day=TruncDate("timestamp"))
+            .values("lab_id", "day")
+            .annotate(
+                total=Count("pk"),
+                total_ready=Count("pk", filter=Q(ready=True)),
+                total_turnaround=Sum(turnaround, filter=timed),
+                total_timed=Count("pk", filter=timed),
+            )
+            .order_by()
+        )
+        for row in rows:
+            counters = totals[row["lab_id"], row["day"]]
+            counters["orders"] += row["total"]
+            counters["ready"] += row["total_ready"]
+            counters["turnaround_count"] += row["total_timed"]
+            if row["total_turnaround"] is not None:
+                seconds = row["total_turnaround"].total_seconds()
+                counters["turnaround_seconds"] += seconds
+    return totals
+
+
+def rebuild(lab_id: Optional[int] = None, since: Optional[datetime.date] = None):
+    """Replace the summary rows with ones recomputed from the results.
+
+    Only rows of ``lab_id`` and from ``since`` on, when given, are replaced:
+    pass the first day still in the database to keep the stats of archived
+    days.
+    """
+    totals = compute(lab_id, since)
+    existing = LabDailyStats.objects.all()
+    if lab_id is not None:
+        existing = existing.filter(lab_id=lab_id)
+    if since is not None:
+        existing = existing.filter(day__gte=since)
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        existing.delete()
+        LabDailyStats.objects.bulk_create(
+            [
+                LabDailyStats(lab_id=lab, day=day, **counters)
+                for (lab, day), counters in totals.items()
+            ],
+            batch_size=1000,
+        )
+    return len(totals)
+
+
+def summarize(stats: Iterable[LabDailyStats]) -> Dict[str, object]:
+    days: List[Dict[str, object]] = []
+    totals: Dict[str, float] = dict.fromkeys(COUNTERS, 0)
+    for row in stats:
+        days.append(_describe(row.day, {name: getattr(row, name) for name in COUNTERS}))
+        for name in COUNTERS:
+            totals[name] += getattr(row, name)
+    return {"days": days, "totals": _describe(None, totals)}
+
+
+def _describe(day: Optional[datetime.date], counters: Dict[str, float]):
+    count = counters["turnaround_count"]
+    return {
+        **({"day": day} if day is not None else {}),
+        "orders": int(counters["orders"]),
+        "ready": int(counters["ready"]),
+        "pending": int(counters["orders"] - counters["ready"]),
+        "average_turnaround_seconds": (
+            counters["turnaround_seconds"] / count if count else None
+        ),
+    }
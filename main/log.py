@@ -0,0 +1,163 @@
+"""Structured JSON logging written off the request thread.
+
+``BatchingQueueHandler`` only does the cheap part of emitting on the calling
+thread (attaching request fields and freezing the message) and hands the
+record to a bounded queue. A daemon thread drains the queue in batches,
+serialises each record to a JSON line and writes the whole batch to the stream
+with a single ``write``/``flush``.
+"""
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+from typing import Any, Dict, List, Optional
+
+from . import request_context
+
+POLICY_DROP = "drop"
+POLICY_BLOCK = "block"
+
+# Attributes every LogRecord has; anything else was passed through ``extra``.
+_RECORD_ATTRS = frozenset(
+    logging.LogRecord("", 0, "", 0, "", (), None).__dict__.keys()
+) | {"message", "asctime"}
+
+
+class RequestContextFilter(logging.Filter):
+    """Attach the current request's fields to records logged while serving it."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = request_context.get_current()
+        if context is not None:
+            record.request_context = context.as_log_fields()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Format a record as a single line of JSON."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload: Dict[str, Any] = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                payload[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            payload["exc_info"] = record.exc_text
+        return json.dumps(payload, default=str)
+
+
+class BatchingQueueHandler(logging.Handler):
+    """Queue records for a background thread that writes them in batches.
+
+    When the queue is full, ``policy="drop"`` discards the record (and counts
+    it in ``dropped``) while ``policy="block"`` waits for the writer.
+    """
+
+    def __init__(
+        self,
+        stream=None,
+        maxsize: int = 10000,
+        batch_size: int = 500,
+        policy: str = POLICY_DROP,
+    ):
+        if policy not in (POLICY_DROP, POLICY_BLOCK):
+            raise ValueError(f"Unknown log queue policy: {policy}")
+        super().__init__()
+        self.addFilter(RequestContextFilter())
+        self.stream = stream or sys.stderr
+        self.queue: "queue.Queue[Optional[logging.LogRecord]]" = queue.Queue(maxsize)
+        self.batch_size = batch_size
+        self.policy = policy
+        self.dropped = 0
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if self._pid != os.getpid():
+            self._after_fork()
+        try:
+            record = self.prepare(record)
+            if self.policy == POLICY_BLOCK:
+                self.queue.put(record)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        except Exception:
+            self.handleError(record)
+            return
+        if self._thread is None:
+            self._start()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Freeze the parts of ``record`` that may change after we return."""
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def _after_fork(self) -> None:
+        # The writer thread doesn't survive a fork (e.g. of a preloaded gunicorn
+        # master) and the queue's lock may have been held when it happened.
+        self._pid = os.getpid()
+        self.queue = queue.Queue(self.queue.maxsize)
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def _start(self) -> None:
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="log-writer", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            self._write([record for record in batch if record is not None])
+            if stop:
+                return
+
+    def _write(self, records: List[logging.LogRecord]) -> None:
+        if not records:
+            return
+        lines = []
+        for record in records:
+            try:
+                lines.append(self.format(record) + "\n")
+            except Exception:
+                self.handleError(record)
+        try:
+            self.stream.write("".join(lines))
+            self.stream.flush()
+        except Exception:
+            self.handleError(records[-1])
+
+    def close(self) -> None:
+        """Write out everything queued so far and stop the writer thread."""
+        with self._thread_lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self.queue.put(None)
+            thread.join()
+        super().close()
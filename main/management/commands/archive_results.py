@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from main import archive
+from main.sharding import get_shards
+
+
+class Command(BaseCommand):
+    help = "Move results older than RESULT_RETENTION_MONTHS to the archive."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=5000)
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="List the months that would be archived.",
+        )
+
+    def handle(self, *args, chunk_size, dry_run, **options):
+        cutoff = archive.retention_cutoff()
+        total = 0
+        for alias in get_shards():
+            for month in archive.months_to_archive(alias, cutoff):
+                if dry_run:
+                    self.stdout.write(f"{alias}: would archive {month:%Y-%m}")
+                    continue
+                count = archive.archive_month(alias, month, chunk_size=chunk_size)
+                total += count
+                self.stdout.write(
+                    f"{alias}: archived {count} results from {month:%Y-%m} to "
+                    f"{archive.archive_path(alias, month)}"
+                )
+        if not dry_run:
+            self.stdout.write(self.style.SUCCESS(f"Archived {total} results."))
@@ -0,0 +1,148 @@
+import copy
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.utils import load_backend
+
+from main import db_pool
+
+POOLED_ENGINE = "main.backends.pooled_postgresql"
+# Tags the benchmark's connections in pg_stat_activity.
+APPLICATION_NAME = "numan-benchmark-db-pool"
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare a connection per request, a persistent connection per thread "
+        "and a shared pool under concurrent requests against Postgres."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=32)
+        parser.add_argument(
+            "--requests", type=int, default=50, help="Requests per thread."
+        )
+        parser.add_argument(
+            "--queries", type=int, default=3, help="Queries per request."
+        )
+        parser.add_argument(
+            "--work-ms",
+            type=float,
+            default=5.0,
+            help="Time spent outside the database per request, e.g. rendering.",
+        )
+        parser.add_argument("--pool-size", type=int, default=8)
+        parser.add_argument("--max-overflow", type=int, default=4)
+        parser.add_argument("--alias", default="default")
+
+    def handle(self, *args, threads, requests, queries, work_ms, alias, **options):
+        base = connections[alias].settings_dict
+        if connections[alias].vendor != "postgresql":
+            raise CommandError(f"{alias} isn't a Postgres database.")
+        base = copy.deepcopy(base)
+        base["OPTIONS"] = {**base["OPTIONS"], "application_name": APPLICATION_NAME}
+        base.pop("POOL", None)
+        plain = {
+            **base,
+            "ENGINE": "django.db.backends.postgresql",
+            "CONN_HEALTH_CHECKS": False,
+        }
+        pool = {
+            "SIZE": options["pool_size"],
+            "MAX_OVERFLOW": options["max_overflow"],
+            "TIMEOUT": 30.0,
+            "PRE_PING": True,
+        }
+        modes = {
+            "per request": ({**plain, "CONN_MAX_AGE": 0}, True),
+            "per thread": ({**plain, "CONN_MAX_AGE": None}, False),
+            "pooled": (
+                {**base, "ENGINE": POOLED_ENGINE, "CONN_MAX_AGE": 0, "POOL": pool},
+                True,
+            ),
+        }
+
+        self.stdout.write(
+            f"{threads} threads x {requests} requests, {queries} queries and "
+            f"{work_ms:g}ms of other work each:\n"
+            f"{'mode':<12} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} "
+            f"{'checkout p99':>13} {'server conns':>13}"
+        )
+        for mode, (settings_dict, close) in modes.items():
+            latencies, checkouts, elapsed, peak = self.run(
+                alias, settings_dict, close, threads, requests, queries, work_ms
+            )
+            self.stdout.write(
+                f"{mode:<12} {len(latencies) / elapsed:>8.0f} "
+                f"{percentile(latencies, 0.5) * 1000:>8.1f} "
+                f"{percentile(latencies, 0.99) * 1000:>8.1f} "
+                f"{percentile(checkouts, 0.99) * 1000:>11.1f}ms {peak:>13}"
+            )
+        db_pool.close_pools(alias)
+
+    def run(self, alias, settings_dict, close, threads, requests, queries, work_ms):
+        backend = load_backend(settings_dict["ENGINE"])
+        latencies, checkouts = [], []
+        lock = threading.Lock()
+        start = threading.Barrier(threads + 1)
+
+        def worker():
+            # Each thread has its own wrapper, as Django gives each thread.
+            connection = backend.DatabaseWrapper(copy.deepcopy(settings_dict), alias)
+            start.wait()
+            mine, my_checkouts = [], []
+            for _ in range(requests):
+                started = time.perf_counter()
+                connection.close_if_unusable_or_obsolete()
+                connection.ensure_connection()
+                my_checkouts.append(time.perf_counter() - started)
+                with connection.cursor() as cursor:
+                    for _ in range(queries):
+                        cursor.execute("SELECT 1")
+                        cursor.fetchone()
+                time.sleep(work_ms / 1000)
+                if close:
+                    # What request_finished does with CONN_MAX_AGE = 0.
+                    connection.close()
+                mine.append(time.perf_counter() - started)
+            connection.close()
+            with lock:
+                latencies.extend(mine)
+                checkouts.extend(my_checkouts)
+
+        peak = 0
+        done = threading.Event()
+
+        def monitor():
+            nonlocal peak
+            with connections[alias].cursor() as cursor:
+                while not done.is_set():
+                    cursor.execute(
+                        "SELECT count(*) FROM pg_stat_activity "
+                        "WHERE application_name = %s",
+                        [APPLICATION_NAME],
+                    )
+                    peak = max(peak, cursor.fetchone()[0])
+                    done.wait(0.01)
+            connections[alias].close()
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        sampler = threading.Thread(target=monitor)
+        for thread in workers:
+            thread.start()
+        sampler.start()
+        start.wait()
+        started = time.perf_counter()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        done.set()
+        sampler.join()
+        return latencies, checkouts, elapsed, peak
@@ -0,0 +1,66 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from main import flagging
+from main.constants.blood_tests import SEX_ANY, SEX_FEMALE, SEX_MALE
+
+
+class Command(BaseCommand):
+    help = "Time reference-range flagging, vectorized and one value at a time."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--values", type=int, default=5_000_000)
+        parser.add_argument(
+            "--loop-values",
+            type=int,
+            default=200_000,
+            help="Values to flag one at a time, the baseline.",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, values, loop_values, seed, **options):
+        rng = np.random.default_rng(seed)
+        tests = rng.integers(0, len(flagging.TEST_CODES), values)
+        numbers = rng.normal(80, 40, values)
+        sexes = rng.integers(0, len(flagging.SEX_INDEX), values).astype(np.int8)
+        ages = rng.uniform(0, 90, values)
+        ages[rng.random(values) < 0.1] = np.nan
+
+        started = time.perf_counter()
+        flags = flagging.flag(tests, numbers, sexes, ages)
+        vectorized = time.perf_counter() - started
+
+        codes = flagging.TEST_CODES
+        sex_codes = [SEX_ANY, SEX_FEMALE, SEX_MALE]
+        sample = range(min(loop_values, values))
+        started = time.perf_counter()
+        looped = [
+            flagging.flag_value(
+                codes[tests[i]],
+                float(numbers[i]),
+                sex_codes[sexes[i]],
+                None if np.isnan(ages[i]) else float(ages[i]),
+            )
+            for i in sample
+        ]
+        baseline = time.perf_counter() - started
+
+        expected = [flagging.FLAG_LABELS[f] for f in flags[: len(looped)].tolist()]
+        if looped != expected:
+            self.stderr.write("The two implementations disagree!")
+
+        vectorized_rate = values / vectorized
+        baseline_rate = len(looped) / baseline
+        self.stdout.write(
+            f"vectorized: {values:,} values in {vectorized:.3f}s "
+            f"({vectorized_rate:,.0f}/s)"
+        )
+        self.stdout.write(
+            f"one at a time: {len(looped):,} values in {baseline:.3f}s "
+            f"({baseline_rate:,.0f}/s)"
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f"Speedup: {vectorized_rate / baseline_rate:.0f}x")
+        )
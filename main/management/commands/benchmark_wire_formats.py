@@ -0,0 +1,80 @@
+import json
+import time
+import zlib
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from main import renderers
+from main.models import BloodTestResults
+from main.serializers import BloodTestResultsModelSerializer
+
+FORMATS = {
+    "json": (JSONRenderer(), json.loads),
+    "msgpack": (
+        renderers.MessagePackRenderer(),
+        lambda data: renderers.msgpack.unpackb(data, raw=False),
+    ),
+    "cbor": (renderers.CBORRenderer(), renderers.cbor2.loads),
+}
+
+
+def best_of(repeat, function, *args):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+class Command(BaseCommand):
+    help = "Compare the size and speed of the JSON, MessagePack and CBOR renderers."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1000, help="Results per list.")
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, rows, repeat, **options):
+        now = timezone.now()
+        results = [
+            BloodTestResults(
+                pk=i + 1,
+                user_id=1,
+                lab_id=1,
+                timestamp=now,
+                ready=True,
+                ready_at=now,
+                results={"HDL": 40 + i % 40, "LDL": 90 + i % 60},
+            )
+            for i in range(rows)
+        ]
+        # What api/results/ renders for one user with that many results.
+        data = BloodTestResultsModelSerializer(instance=results, many=True).data
+
+        self.stdout.write(
+            f"{rows:,} results, best of {repeat}:\n"
+            f"{'format':<8} {'bytes':>10} {'gzipped':>10} "
+            f"{'encode ms':>10} {'decode ms':>10}"
+        )
+        baseline = None
+        for name, (renderer, decode) in FORMATS.items():
+            payload = renderer.render(data)
+            if decode(payload) != FORMATS["json"][1](FORMATS["json"][0].render(data)):
+                self.stderr.write(f"{name} doesn't round-trip like JSON!")
+            encode_time = best_of(repeat, renderer.render, data)
+            decode_time = best_of(repeat, decode, payload)
+            gzipped = len(zlib.compress(payload, 6))
+            self.stdout.write(
+                f"{name:<8} {len(payload):>10,} {gzipped:>10,} "
+                f"{encode_time * 1000:>10.2f} {decode_time * 1000:>10.2f}"
+            )
+            if baseline is None:
+                baseline = (len(payload), encode_time, decode_time)
+            else:
+                self.stdout.write(
+                    f"{'':<8} {len(payload) / baseline[0]:>10.0%} {'':>10} "
+                    f"{encode_time / baseline[1]:>10.0%} "
+                    f"{decode_time / baseline[2]:>10.0%}"
+                )
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from main import partitions
+from main.sharding import get_shards
+
+
+class Command(BaseCommand):
+    help = "Create the monthly partitions of the results table ahead of time."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--months-ahead",
+            type=int,
+            default=3,
+            help="Months after the current one to create partitions for.",
+        )
+        parser.add_argument(
+            "--months-back",
+            type=int,
+            default=0,
+            help="Months before the current one to create partitions for, "
+            "moving their rows out of the default partition.",
+        )
+
+    def handle(self, *args, months_ahead, months_back, **options):
+        aliases = [
+            alias
+            for alias in get_shards()
+            if partitions.is_partitioned(connections[alias])
+        ]
+        if not aliases:
+            raise CommandError(
+                "The results table is only partitioned on Postgres 11 or later."
+            )
+        this_month = partitions.month_start(timezone.now().date())
+        wanted = [
+            partitions.partition_for(partitions.add_months(this_month, offset))
+            for offset in range(-months_back, months_ahead + 1)
+        ]
+        for alias in aliases:
+            existing = set(partitions.monthly_partitions(alias))
+            for partition in wanted:
+                if partition in existing:
+                    continue
+                moved = partitions.create_partition(partition, using=alias)
+                self.stdout.write(
+                    f"{alias}: created {partition.name} ({moved} rows moved)"
+                )
+        self.stdout.write(self.style.SUCCESS("Partitions are up to date."))
@@ -0,0 +1,88 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from main import exports
+
+
+def _datetime(value):
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise CommandError(f"Invalid date and time: {value}")
+    return parsed
+
+
+def _bool(value):
+    if value.lower() not in ("true", "false"):
+        raise CommandError(f"Expected true or false, got: {value}")
+    return value.lower() == "true"
+
+
+class Command(BaseCommand):
+    help = "Export blood test results as compressed NDJSON, CSV or Parquet."
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="File to write the export to.")
+        parser.add_argument(
+            "--format", choices=exports.FORMATS, default=exports.FORMAT_NDJSON
+        )
+        parser.add_argument("--since", type=_datetime, help="Created at or after.")
+        parser.add_argument("--until", type=_datetime, help="Created before.")
+        parser.add_argument("--lab", type=int, help="Only this lab's results.")
+        parser.add_argument("--ready", type=_bool, help="true or false.")
+        parser.add_argument("--chunk-size", type=int, default=5000)
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Carry on from the checkpoint of an interrupted export.",
+        )
+
+    def handle(self, *args, output, format, since, until, lab, ready, **options):
+        checkpoint_path = f"{output}.checkpoint"
+        checkpoint = {"last_id": 0, "offset": 0, "rows": 0}
+        if options["resume"]:
+            if format == exports.FORMAT_PARQUET:
+                raise CommandError("Parquet exports can't be resumed, start over.")
+            if os.path.exists(checkpoint_path):
+                with open(checkpoint_path) as f:
+                    checkpoint = json.load(f)
+
+        queryset = exports.export_queryset(
+            since=since,
+            until=until,
+            lab=lab,
+            ready=ready,
+            after_id=checkpoint["last_id"],
+        )
+        chunks = exports.export(
+            queryset,
+            format,
+            chunk_size=options["chunk_size"],
+            header=checkpoint["offset"] == 0,
+        )
+
+        with open(output, "r+b" if checkpoint["offset"] else "wb") as f:
+            # Anything past the checkpoint is a partly written chunk.
+            f.truncate(checkpoint["offset"])
+            f.seek(checkpoint["offset"])
+            for chunk in chunks:
+                f.write(chunk.data)
+                f.flush()
+                checkpoint = {
+                    "last_id": chunk.last_id,
+                    "offset": f.tell(),
+                    "rows": checkpoint["rows"] + chunk.rows,
+                }
+                with open(checkpoint_path, "w") as cp:
+                    json.dump(checkpoint, cp)
+
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Exported {checkpoint['rows']} results "
+                f"(up to id {checkpoint['last_id']}) to {output}."
+            )
+        )
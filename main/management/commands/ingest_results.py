@@ -0,0 +1,83 @@
+import json
+import os
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main import ingestion
+from main.models import Lab
+
+
+class Command(BaseCommand):
+    help = "Apply a lab's CSV or HL7-like results file to the matching orders."
+
+    def add_arguments(self, parser):
+        parser.add_argument("input", help="Results file to read.")
+        parser.add_argument(
+            "--format", choices=ingestion.FORMATS, default=ingestion.FORMAT_CSV
+        )
+        parser.add_argument("--lab", type=int, help="Only update this lab's orders.")
+        parser.add_argument(
+            "--batch-size", type=int, default=5000, help="Input lines per batch."
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Carry on from the checkpoint of an interrupted run.",
+        )
+
+    def handle(self, *args, input, format, lab, batch_size, resume, **options):
+        if lab is not None:
+            try:
+                lab = Lab.objects.get(pk=lab)
+            except Lab.DoesNotExist:
+                raise CommandError(f"No lab with id {lab}.")
+        checkpoint_path = f"{input}.checkpoint"
+        report = ingestion.IngestReport()
+        if resume and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as f:
+                saved = json.load(f)
+            report = ingestion.IngestReport(
+                line=saved["line"],
+                observations=saved["observations"],
+                orders=saved["orders"],
+                abnormal=saved.get("abnormal", 0),
+                rejected=Counter(saved["rejected"]),
+                seconds=saved["seconds"],
+            )
+
+        def save_checkpoint(report):
+            with open(checkpoint_path, "w") as f:
+                json.dump(report.as_dict(), f)
+            self.stdout.write(
+                f"line {report.line}: {report.observations} results applied "
+                f"({report.rows_per_second:.0f}/s)"
+            )
+
+        with open(input, newline="") as f:
+            try:
+                report = ingestion.ingest(
+                    f,
+                    format,
+                    lab=lab,
+                    batch_size=batch_size,
+                    skip_lines=report.line,
+                    on_batch=save_checkpoint,
+                    report=report,
+                )
+            except ValueError as e:
+                raise CommandError(str(e))
+
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        rejected = ", ".join(
+            f"{count} {reason}" for reason, count in sorted(report.rejected.items())
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Applied {report.observations} results to {report.orders} orders "
+                f"({report.abnormal} out of range) "
+                f"in {report.seconds:.1f}s ({report.rows_per_second:.0f}/s); "
+                f"rejected: {rejected or 'none'}."
+            )
+        )
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main import lab_directory
+
+
+class Command(BaseCommand):
+    help = "Insert or update labs, matched by name, from a CSV or NDJSON directory."
+
+    def add_arguments(self, parser):
+        parser.add_argument("input", help="Lab directory file to read.")
+        parser.add_argument(
+            "--format",
+            choices=lab_directory.FORMATS,
+            help="File format (default: from the file extension, else CSV).",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=1000, help="Rows per batch."
+        )
+
+    def handle(self, *args, input, format, batch_size, **options):
+        if format is None:
+            format = (
+                lab_directory.FORMAT_NDJSON
+                if input.endswith((".ndjson", ".jsonl"))
+                else lab_directory.FORMAT_CSV
+            )
+
+        def progress(report):
+            self.stdout.write(
+                f"line {report.line}: {report.inserted} inserted, "
+                f"{report.updated} updated, {report.unchanged} unchanged"
+            )
+
+        with open(input, newline="") as f:
+            try:
+                report = lab_directory.load(
+                    f, format, batch_size=batch_size, on_batch=progress
+                )
+            except ValueError as e:
+                raise CommandError(str(e))
+
+        rejected = ", ".join(
+            f"{count} {reason}" for reason, count in sorted(report.rejected.items())
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{report.inserted} labs inserted, {report.updated} updated, "
+                f"{report.unchanged} unchanged in {report.seconds:.1f}s; "
+                f"rejected: {rejected or 'none'}."
+            )
+        )
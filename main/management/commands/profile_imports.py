@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+
+from main import startup
+
+
+class Command(BaseCommand):
+    help = (
+        "Start Django cold in a new process, serve one request and list the "
+        "modules whose imports cost the most."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--path", default=startup.PROBE_PATH, help="Request to serve."
+        )
+        parser.add_argument(
+            "--limit", type=int, default=30, help="How many modules to list."
+        )
+        parser.add_argument(
+            "--prefix",
+            default="",
+            help="Only list modules whose name starts with this, e.g. main.",
+        )
+        parser.add_argument(
+            "--top-level",
+            action="store_true",
+            help="Only list modules imported by the app or Django themselves.",
+        )
+
+    def handle(self, *args, path, limit, prefix, top_level, **options):
+        result = startup.cold_start(path, importtime=True)
+        imports = [
+            module
+            for module in result.imports
+            if module.name.startswith(prefix) and not (top_level and module.depth)
+        ]
+        imports.sort(key=lambda module: module.cumulative, reverse=True)
+
+        self.stdout.write(f"{'cumulative':>12} {'self':>9}  module")
+        for module in imports[:limit]:
+            self.stdout.write(
+                f"{module.cumulative / 1000:10.1f}ms {module.own / 1000:7.1f}ms  "
+                f"{'  ' * module.depth}{module.name}"
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{len(result.imports)} modules imported; django.setup() took "
+                f"{result.setup * 1000:.0f}ms and the first request (GET {path}, "
+                f"{result.status}) was served after {result.total * 1000:.0f}ms, "
+                "with -X importtime overhead."
+            )
+        )
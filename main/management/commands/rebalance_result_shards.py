@@ -0,0 +1,98 @@
+from typing import Optional
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from main.models import BloodTestResults
+from main.sharding import get_shards, shard_for_user
+
+
+def same_row(row: BloodTestResults, copy: Optional[BloodTestResults]) -> bool:
+    return copy is not None and all(
+        getattr(row, field.attname) == getattr(copy, field.attname)
+        for field in BloodTestResults._meta.concrete_fields
+    )
+
+
+class Command(BaseCommand):
+    help = "Move blood test results whose user now hashes to another shard."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Rows moved per transaction.",
+        )
+        parser.add_argument(
+            "--user",
+            type=int,
+            action="append",
+            dest="users",
+            help="Only rebalance this user id (repeatable).",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report what would move without moving it.",
+        )
+
+    def handle(self, *args, chunk_size, users, dry_run, **options):
+        total = 0
+        for source in get_shards():
+            user_ids = (
+                BloodTestResults.objects.using(source)
+                .values_list("user_id", flat=True)
+                .distinct()
+            )
+            if users:
+                user_ids = user_ids.filter(user_id__in=users)
+            for user_id in user_ids.iterator():
+                target = shard_for_user(user_id)
+                if target == source:
+                    continue
+                if dry_run:
+                    count = (
+                        BloodTestResults.objects.using(source)
+                        .filter(user_id=user_id)
+                        .count()
+                    )
+                else:
+                    count = self.move_user(user_id, source, target, chunk_size)
+                total += count
+                self.stdout.write(f"user {user_id}: {count} rows {source} -> {target}")
+        verb = "Would move" if dry_run else "Moved"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {total} rows."))
+
+    def move_user(self, user_id: int, source: str, target: str, chunk_size: int) -> int:
+        """Copy ``user_id``'s rows to ``target`` then delete them from ``source``.
+
+        Each chunk is inserted before it is deleted, and inserts skip rows that
+        are already there, so an interrupted run can simply be repeated. A row
+        is only deleted once its copy has been read back from ``target``; when
+        another row there holds its primary key, the move stops and leaves it
+        on ``source``.
+        """
+        moved = 0
+        rows = BloodTestResults.objects.using(source).filter(user_id=user_id)
+        while True:
+            chunk = list(rows.order_by("pk")[:chunk_size])
+            if not chunk:
+                return moved
+            with transaction.atomic(using=target):
+                BloodTestResults.objects.using(target).bulk_create(
+                    chunk, ignore_conflicts=True
+                )
+            copies = BloodTestResults.objects.using(target).in_bulk(
+                [row.pk for row in chunk]
+            )
+            copied = [row.pk for row in chunk if same_row(row, copies.get(row.pk))]
+            with transaction.atomic(using=source):
+                BloodTestResults.objects.using(source).filter(pk__in=copied).delete()
+            moved += len(copied)
+            if len(copied) < len(chunk):
+                conflicts = sorted({row.pk for row in chunk} - set(copied))
+                raise CommandError(
+                    f"user {user_id}: rows {conflicts} collide with other rows "
+                    f"on {target} and were left on {source} ({moved} rows moved)."
+                )
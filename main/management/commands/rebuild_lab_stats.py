@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from main import lab_stats, partitions
+
+
+class Command(BaseCommand):
+    help = "Recompute the per-lab daily stats from the blood test results."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lab", type=int, help="Only rebuild this lab's stats.")
+        parser.add_argument(
+            "--since",
+            type=parse_date,
+            help="First day to rebuild (YYYY-MM-DD). Defaults to the oldest "
+            "day not yet archived; earlier days are left as they are.",
+        )
+
+    def handle(self, *args, lab, since, **options):
+        if since is None:
+            since = partitions.add_months(
+                partitions.month_start(timezone.localdate()),
+                -settings.RESULT_RETENTION_MONTHS,
+            )
+        rows = lab_stats.rebuild(lab_id=lab, since=since)
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt {rows} lab daily stats rows from {since}.")
+        )
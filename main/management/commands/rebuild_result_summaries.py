@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from main import result_summaries
+
+
+class Command(BaseCommand):
+    help = "Recompute the patients' latest-results snapshots from their results."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user",
+            type=int,
+            action="append",
+            dest="users",
+            help="Only rebuild this patient's snapshot; may be repeated.",
+        )
+
+    def handle(self, *args, users, **options):
+        rows = result_summaries.rebuild(user_ids=users)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} result summaries."))
@@ -0,0 +1,44 @@
+import datetime
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from main import outbox
+
+
+class Command(BaseCommand):
+    help = "Send the patient notifications waiting in the outbox."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, help="Emails per batch.")
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the outbox is drained instead of polling it.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=5,
+            help="Seconds to wait between polls of an empty outbox.",
+        )
+
+    def handle(self, *args, batch_size, once, interval, **options):
+        purged_at = None
+        while True:
+            report = outbox.drain(batch_size)
+            if report.sent or report.skipped or report.retried or report.given_up:
+                self.stdout.write(
+                    f"Sent {report.sent}, skipped {report.skipped}, "
+                    f"retrying {report.retried}, gave up on {report.given_up}."
+                )
+            now = timezone.now()
+            if purged_at is None or now - purged_at > datetime.timedelta(hours=1):
+                keep = datetime.timedelta(days=settings.OUTBOX_KEEP_DAYS)
+                outbox.purge(now - keep)
+                purged_at = now
+            if once:
+                return
+            time.sleep(interval)
@@ -0,0 +1,129 @@
+"""Prometheus metrics for the service.
+
+Metric objects are module level so updating them in the request path is a
+plain attribute lookup plus an increment. When ``PROMETHEUS_MULTIPROC_DIR`` is
+set (as it must be under gunicorn with several workers) prometheus_client
+keeps every value in a per-process mmap'd file and the ``/metrics`` view
+merges them on scrape, so nothing is shared between workers at write time.
+"""
+import os
+from typing import Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+NAMESPACE = "numan"
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time spent serving a request, by view and response status.",
+    ["view", "method", "status"],
+    namespace=NAMESPACE,
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "Requests currently being served.",
+    ["method"],
+    namespace=NAMESPACE,
+    multiprocess_mode="livesum",
+)
+DB_QUERIES = Histogram(
+    "db_queries_per_request",
+    "Number of database queries issued while serving a request.",
+    ["view"],
+    namespace=NAMESPACE,
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, float("inf")),
+)
+
+GEOLOCATION_LATENCY = Histogram(
+    "ip_geolocation_request_duration_seconds",
+    "Latency of calls to the IP geolocation API.",
+    ["outcome"],
+    namespace=NAMESPACE,
+)
+GEOLOCATION_ERRORS = Counter(
+    "ip_geolocation_errors",
+    "Failed calls to the IP geolocation API.",
+    ["reason"],
+    namespace=NAMESPACE,
+)
+GEOLOCATION_RETRIES = Counter(
+    "ip_geolocation_retries",
+    "Retried calls to the IP geolocation API.",
+    namespace=NAMESPACE,
+)
+
+CACHE_REQUESTS = Counter(
+    "cache_requests",
+    "Cache lookups by cache name and result (hit or miss).",
+    ["cache", "result"],
+    namespace=NAMESPACE,
+)
+
+THROTTLED = Counter(
+    "throttled_requests",
+    "Requests refused by a rate limit, by bucket scope.",
+    ["scope"],
+    namespace=NAMESPACE,
+)
+
+ADMISSION_DECISIONS = Counter(
+    "admission_decisions",
+    "Requests admitted, admitted after queueing or shed (queue_full, timed_out).",
+    ["endpoint", "decision"],
+    namespace=NAMESPACE,
+)
+ADMISSION_LIMIT = Gauge(
+    "admission_limit",
+    "Current adaptive concurrency limit, by endpoint class.",
+    ["endpoint"],
+    namespace=NAMESPACE,
+    multiprocess_mode="livesum",
+)
+
+DB_POOL_WAIT = Histogram(
+    "db_pool_wait_seconds",
+    "Time taken to get a connection from a pool, connecting included.",
+    ["database"],
+    namespace=NAMESPACE,
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+DB_POOL_CONNECTIONS = Gauge(
+    "db_pool_connections",
+    "Pooled database connections, idle or in use.",
+    ["database", "state"],
+    namespace=NAMESPACE,
+    multiprocess_mode="livesum",
+)
+DB_POOL_TIMEOUTS = Counter(
+    "db_pool_timeouts",
+    "Requests for a pooled connection that gave up waiting.",
+    ["database"],
+    namespace=NAMESPACE,
+)
+
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.labels(cache=cache, result="hit" if hit else "miss").inc()
+
+
+def get_registry():
+    """Return the registry to expose, merging worker files in multiprocess mode."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def render_latest() -> Tuple[bytes, str]:
+    """Return the current values in the text format, and its content type."""
+    return generate_latest(get_registry()), CONTENT_TYPE_LATEST
@@ -0,0 +1,119 @@
+import logging
+import time
+from contextlib import ExitStack
+
+from django.db import connections
+from django.utils.functional import empty
+
+from . import metrics, request_context
+
+access_logger = logging.getLogger("main.access")
+
+
+class QueryCounter:
+    """Database execute wrapper adding each query to the request context."""
+
+    def __init__(self, context: request_context.RequestContext):
+        self.context = context
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.context.db_time += time.perf_counter() - start
+            self.context.db_queries += 1
+
+
+def get_view_name(request) -> str:
+    resolver_match = getattr(request, "resolver_match", None)
+    if resolver_match is None:
+        return "<unresolved>"
+    return resolver_match.view_name
+
+
+class RequestContextMiddleware:
+    """Track the current request's view, user, DB and upstream time.
+
+    This must be the outermost middleware so everything below it, including
+    logging, sees the context.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        context = request_context.RequestContext(
+            method=request.method, path=request.path
+        )
+        token = request_context.activate(context)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(QueryCounter(context))
+                    )
+                response = self.get_response(request)
+        finally:
+            request_context.deactivate(token)
+        return response
+
+
+def _finish_context(request) -> request_context.RequestContext:
+    context = request_context.get_current() or request_context.RequestContext(
+        method=request.method, path=request.path
+    )
+    context.view = get_view_name(request)
+    user = getattr(request, "user", None)
+    if getattr(user, "_wrapped", None) is empty:
+        # Never loaded during the request; don't hit the session just to log it.
+        return context
+    if user is not None and user.is_authenticated:
+        context.user_id = user.pk
+    return context
+
+
+class AccessLogMiddleware:
+    """Emit one structured access log record per request."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        response = self.get_response(request)
+        _finish_context(request)
+        access_logger.info(
+            "%s %s %s",
+            request.method,
+            request.path,
+            response.status_code,
+            extra={
+                "status": response.status_code,
+                "duration_ms": round((time.perf_counter() - start) * 1000, 3),
+            },
+        )
+        return response
+
+
+class MetricsMiddleware:
+    """Record latency, in-flight requests and query counts for each request."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        in_progress = metrics.REQUESTS_IN_PROGRESS.labels(method=request.method)
+        start = time.perf_counter()
+        in_progress.inc()
+        try:
+            response = self.get_response(request)
+        finally:
+            in_progress.dec()
+
+        context = _finish_context(request)
+        metrics.REQUEST_LATENCY.labels(
+            view=context.view, method=request.method, status=response.status_code
+        ).observe(time.perf_counter() - start)
+        metrics.DB_QUERIES.labels(view=context.view).observe(context.db_queries)
+        return response
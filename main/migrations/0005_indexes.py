@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-19 14:47
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0004_customtoken"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="bloodtestresults",
+            index=models.Index(
+                fields=["user", "timestamp"], name="results_user_timestamp_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="bloodtestresults",
+            index=models.Index(
+                condition=models.Q(("ready", False)),
+                fields=["lab", "timestamp"],
+                name="results_pending_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="lab",
+            index=models.Index(
+                models.F("country"),
+                django.db.models.functions.text.Lower("city"),
+                name="lab_country_city_idx",
+            ),
+        ),
+    ]
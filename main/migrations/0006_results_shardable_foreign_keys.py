@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-19 14:52
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0005_indexes"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="bloodtestresults",
+            name="lab",
+            field=models.ForeignKey(
+                blank=True,
+                db_constraint=False,
+                null=True,
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                to="main.lab",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="bloodtestresults",
+            name="user",
+            field=models.ForeignKey(
+                db_constraint=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+    ]
@@ -0,0 +1,135 @@
+# Partition main_bloodtestresults by month of "timestamp" on Postgres 11+.
+# Other databases keep the plain table; see main/partitions.py.
+#
+# The existing table is attached as the DEFAULT partition rather than copied,
+# so migrating costs building its new (id, "timestamp") primary key, not a
+# rewrite of every row in one long transaction; writes wait for that index
+# build only. ./manage.py create_result_partitions --months-back N then moves
+# recent months out of DEFAULT one at a time. Reversing copies the rows back
+# into a plain table.
+
+from django.db import migrations
+
+TABLE = "main_bloodtestresults"
+OLD_TABLE = f"{TABLE}_old"
+DEFAULT_PARTITION = f"{TABLE}_default"
+# Identity columns can't be used on partitioned tables before Postgres 17.
+SEQUENCE = f"{TABLE}_pid_seq"
+
+
+def _supported(connection):
+    return connection.vendor == "postgresql" and connection.pg_version >= 110000
+
+
+def _prepare(cursor):
+    """Rename the table out of the way, returning its max id and indexes.
+
+    Indexes come as (name, definition) pairs. The replacement is created with
+    LIKE without INCLUDING DEFAULTS, so it never shares the old table's id
+    sequence.
+    """
+    cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {TABLE}")
+    (max_id,) = cursor.fetchone()
+    cursor.execute(
+        "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s"
+        " AND indexname NOT IN (SELECT conname FROM pg_constraint"
+        " WHERE conrelid = %s::regclass AND contype = 'p')",
+        [TABLE, TABLE],
+    )
+    indexes = [
+        (name, indexdef.replace(" ON ONLY ", " ON "))
+        for name, indexdef in cursor.fetchall()
+    ]
+    cursor.execute(f"ALTER TABLE {TABLE} RENAME TO {OLD_TABLE}")
+    return max_id, indexes
+
+
+def _create_indexes(cursor, indexes):
+    for _, indexdef in indexes:
+        cursor.execute(indexdef)
+
+
+def _attach_as_default(cursor, indexes):
+    """Make the old table the DEFAULT partition, keeping its rows and indexes."""
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [OLD_TABLE])
+    (sequence,) = cursor.fetchone()
+    cursor.execute(f"ALTER TABLE {OLD_TABLE} ALTER COLUMN id DROP IDENTITY IF EXISTS")
+    cursor.execute(f"ALTER TABLE {OLD_TABLE} ALTER COLUMN id DROP DEFAULT")
+    if sequence:
+        # Tables from before identity columns own a serial sequence instead.
+        cursor.execute(f"DROP SEQUENCE IF EXISTS {sequence}")
+    # Attaching gives the partition the parent's (id, "timestamp") key.
+    cursor.execute(
+        "SELECT conname FROM pg_constraint"
+        " WHERE conrelid = %s::regclass AND contype = 'p'",
+        [OLD_TABLE],
+    )
+    for (constraint,) in cursor.fetchall():
+        cursor.execute(f'ALTER TABLE {OLD_TABLE} DROP CONSTRAINT "{constraint}"')
+    # Free the names for the parent's indexes, which adopt these as they are
+    # created instead of building new ones.
+    for i, (name, _) in enumerate(indexes):
+        cursor.execute(f'ALTER INDEX "{name}" RENAME TO {DEFAULT_PARTITION}_{i}_idx')
+    cursor.execute(f"ALTER TABLE {OLD_TABLE} RENAME TO {DEFAULT_PARTITION}")
+    cursor.execute(f"ALTER TABLE {TABLE} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT")
+    _create_indexes(cursor, indexes)
+
+
+def _copy_back(cursor, indexes):
+    cursor.execute(
+        "SELECT string_agg(quote_ident(column_name), ', ' ORDER BY ordinal_position)"
+        " FROM information_schema.columns WHERE table_name = %s",
+        [TABLE],
+    )
+    (columns,) = cursor.fetchone()
+    cursor.execute(f"INSERT INTO {TABLE} ({columns}) SELECT {columns} FROM {OLD_TABLE}")
+    cursor.execute(f"DROP TABLE {OLD_TABLE}")
+    _create_indexes(cursor, indexes)
+
+
+def partition(apps, schema_editor):
+    if not _supported(schema_editor.connection):
+        return
+    with schema_editor.connection.cursor() as cursor:
+        max_id, indexes = _prepare(cursor)
+        cursor.execute(
+            f"CREATE TABLE {TABLE} (LIKE {OLD_TABLE})"
+            ' PARTITION BY RANGE ("timestamp")'
+        )
+        # The partition key has to be part of the primary key.
+        cursor.execute(f'ALTER TABLE {TABLE} ADD PRIMARY KEY (id, "timestamp")')
+        cursor.execute(f"CREATE SEQUENCE {SEQUENCE} OWNED BY {TABLE}.id")
+        cursor.execute(
+            "SELECT setval(%s, %s, %s)", [SEQUENCE, max(max_id, 1), max_id > 0]
+        )
+        cursor.execute(
+            f"ALTER TABLE {TABLE} ALTER COLUMN id SET DEFAULT nextval('{SEQUENCE}')"
+        )
+        _attach_as_default(cursor, indexes)
+
+
+def unpartition(apps, schema_editor):
+    if not _supported(schema_editor.connection):
+        return
+    with schema_editor.connection.cursor() as cursor:
+        max_id, indexes = _prepare(cursor)
+        cursor.execute(f"CREATE TABLE {TABLE} (LIKE {OLD_TABLE})")
+        cursor.execute(f"ALTER TABLE {TABLE} ADD PRIMARY KEY (id)")
+        cursor.execute(
+            f"ALTER TABLE {TABLE} ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY"
+        )
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence('{TABLE}', 'id'), %s, %s)",
+            [max(max_id, 1), max_id > 0],
+        )
+        _copy_back(cursor, indexes)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0006_results_shardable_foreign_keys"),
+    ]
+
+    operations = [
+        migrations.RunPython(partition, unpartition),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.30 on 2026-10-19 15:04
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0007_partition_bloodtestresults"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="bloodtestresults",
+            name="claimed_by",
+            field=models.ForeignKey(
+                blank=True,
+                db_constraint=False,
+                help_text="The lab worker currently processing this order.",
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddField(
+            model_name="bloodtestresults",
+            name="claimed_until",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="When the claim lapses and the order goes back on the worklist.",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="lab",
+            field=models.ForeignKey(
+                blank=True,
+                help_text="The lab this user works for, letting them work its worklist.",
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="staff",
+                to="main.lab",
+            ),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-19 15:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0008_worklist"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="date_of_birth",
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="sex",
+            field=models.CharField(
+                blank=True,
+                choices=[("F", "Female"), ("M", "Male")],
+                help_text="Picks the reference ranges results are flagged against.",
+                max_length=1,
+            ),
+        ),
+    ]
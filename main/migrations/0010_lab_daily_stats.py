@@ -0,0 +1,53 @@
+# Generated by Django 4.2.30 on 2026-10-19 15:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0009_user_demographics"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="bloodtestresults",
+            name="ready_at",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="When the results came back from the lab.",
+                null=True,
+            ),
+        ),
+        migrations.CreateModel(
+            name="LabDailyStats",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("orders", models.PositiveIntegerField(default=0)),
+                ("ready", models.PositiveIntegerField(default=0)),
+                ("turnaround_seconds", models.FloatField(default=0)),
+                ("turnaround_count", models.PositiveIntegerField(default=0)),
+                (
+                    "lab",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="daily_stats",
+                        to="main.lab",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "Lab daily stats",
+                "unique_together": {("lab", "day")},
+            },
+        ),
+    ]
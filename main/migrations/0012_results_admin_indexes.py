@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-19 15:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0011_notification_outbox"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="bloodtestresults",
+            index=models.Index(fields=["timestamp"], name="results_timestamp_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="bloodtestresults",
+            index=models.Index(
+                fields=["ready", "timestamp"], name="results_ready_timestamp_idx"
+            ),
+        ),
+    ]
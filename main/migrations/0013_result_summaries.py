@@ -0,0 +1,48 @@
+# Generated by Django 4.2.30 on 2026-10-19 15:44
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0012_results_admin_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ResultSummary",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="result_summary",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "latest",
+                    models.JSONField(
+                        blank=True,
+                        default=dict,
+                        help_text="Analyte -> value, result id and timestamp of the newest ready result carrying it.",
+                    ),
+                ),
+                (
+                    "pending",
+                    models.PositiveIntegerField(
+                        default=0, help_text="Orders not back from the lab yet."
+                    ),
+                ),
+                ("updated_at", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                "verbose_name_plural": "Result summaries",
+            },
+        ),
+    ]
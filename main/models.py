@@ -3,15 +3,34 @@ from typing import Any, Dict
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import EmailValidator
 from django.db import models
+from django.db.models.functions import Lower
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django_countries.fields import CountryField
 from rest_framework.authtoken.models import Token
 
+from .constants.blood_tests import SEX_CHOICES
+
 
 class User(AbstractUser):
     """The user."""
 
-    pass
+    sex = models.CharField(
+        max_length=1,
+        choices=SEX_CHOICES,
+        blank=True,
+        help_text="Picks the reference ranges results are flagged against.",
+    )
+    date_of_birth = models.DateField(null=True, blank=True)
+
+    lab = models.ForeignKey(
+        "Lab",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="staff",
+        help_text="The lab this user works for, letting them work its worklist.",
+    )
 
 
 class CustomToken(Token):
@@ -34,7 +53,9 @@ class CustomToken(Token):
 class BloodTestResults(models.Model):
     """A blood test the user ordered, possibly carrying results from the lab."""
 
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # No database constraints on the foreign keys: results may live on a
+    # different shard from users and labs (see main/sharding.py).
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
     timestamp = models.DateTimeField(
         auto_now_add=True,
         help_text="The date and time this result was created.",
@@ -48,16 +69,54 @@ class BloodTestResults(models.Model):
         default=False,
         help_text="Whether the results have come back from the lab yet.",
     )
+    ready_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="When the results came back from the lab.",
+    )
 
     lab = models.ForeignKey(
         "Lab",
         null=True,
         blank=True,
         on_delete=models.DO_NOTHING,
+        db_constraint=False,
+    )
+    claimed_by = models.ForeignKey(
+        User,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        db_constraint=False,
+        related_name="+",
+        help_text="The lab worker currently processing this order.",
+    )
+    claimed_until = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="When the claim lapses and the order goes back on the worklist.",
     )
 
     class Meta:
         verbose_name_plural = "Blood test results"
+        indexes = [
+            # A user's results, in the order the results endpoint lists them.
+            models.Index(
+                fields=["user", "timestamp"], name="results_user_timestamp_idx"
+            ),
+            # The admin's listing, newest first, and its date and readiness
+            # filters.
+            models.Index(fields=["timestamp"], name="results_timestamp_idx"),
+            models.Index(
+                fields=["ready", "timestamp"], name="results_ready_timestamp_idx"
+            ),
+            # Orders still waiting on a lab; a small slice of the table.
+            models.Index(
+                fields=["lab", "timestamp"],
+                condition=models.Q(ready=False),
+                name="results_pending_idx",
+            ),
+        ]
 
     def __str__(self) -> str:
         return self.user.username
@@ -77,13 +136,120 @@ class Lab(models.Model):
     address_2 = models.CharField(max_length=256, blank=True)
     city = models.CharField(max_length=256)
     post_code = models.CharField(max_length=8)
-    country = CountryField(default="GB", blank_label="(select country)")
+    # An explicit max_length keeps CountryField from building its country
+    # table (to measure the longest code) when the model is imported.
+    country = CountryField(default="GB", max_length=2, blank_label="(select country)")
     email = models.CharField(max_length=254, validators=[EmailValidator()])
     number = models.CharField(max_length=15)
 
+    class Meta:
+        indexes = [
+            # Labs by country, optionally narrowed to a case-insensitive city.
+            models.Index("country", Lower("city"), name="lab_country_city_idx"),
+        ]
+
     def __str__(self):
         return self.name
 
     @property
     def country_name(self) -> str:
         return self.country.name
+
+
+class Notification(models.Model):
+    """An email to send a patient, written with the change it announces.
+
+    Rows live on the same shard as the result, in the same transaction as
+    its ``ready`` change, and ``./manage.py send_notifications`` sends them
+    later (see main/outbox.py).
+    """
+
+    KIND_RESULT_READY = "result_ready"
+    KIND_CHOICES = [(KIND_RESULT_READY, "Results ready")]
+
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, db_constraint=False, related_name="+"
+    )
+    result = models.ForeignKey(
+        BloodTestResults,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name="+",
+    )
+    kind = models.CharField(max_length=32, choices=KIND_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+    next_attempt_at = models.DateTimeField(
+        default=timezone.now,
+        help_text="When the sender may next pick this notification up.",
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            # The sender's queue: unsent notifications by when they're due.
+            models.Index(
+                fields=["next_attempt_at"],
+                condition=models.Q(sent_at__isnull=True),
+                name="notification_due_idx",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.kind} {self.result_id}"
+
+
+class LabDailyStats(models.Model):
+    """Running totals of one lab's orders placed on one day.
+
+    Kept up to date as orders are created and come back ready (see
+    main/lab_stats.py), so dashboards never have to scan the results table.
+    """
+
+    lab = models.ForeignKey(Lab, on_delete=models.CASCADE, related_name="daily_stats")
+    day = models.DateField()
+    orders = models.PositiveIntegerField(default=0)
+    ready = models.PositiveIntegerField(default=0)
+    # Time from order to results, over the ready orders whose ready_at is known.
+    turnaround_seconds = models.FloatField(default=0)
+    turnaround_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = "Lab daily stats"
+        unique_together = (("lab", "day"),)
+
+    def __str__(self) -> str:
+        return f"{self.lab_id} {self.day}"
+
+
+class ResultSummary(models.Model):
+    """A patient's newest value of every analyte and their pending orders.
+
+    Kept up to date as their orders are created and come back ready (see
+    main/result_summaries.py), so the app's home screen is one primary key
+    read instead of the whole results history.
+    """
+
+    user = models.OneToOneField(
+        User,
+        primary_key=True,
+        on_delete=models.CASCADE,
+        related_name="result_summary",
+    )
+    latest = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="Analyte -> value, result id and timestamp of the newest "
+        "ready result carrying it.",
+    )
+    pending = models.PositiveIntegerField(
+        default=0, help_text="Orders not back from the lab yet."
+    )
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name_plural = "Result summaries"
+
+    def __str__(self) -> str:
+        return f"{self.user_id}"
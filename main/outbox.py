@@ -0,0 +1,175 @@
+"""The outbox of patient notifications, and the sender draining it.
+
+Code that turns results ready calls ``enqueue`` inside the same transaction,
+on the same shard, so a notification exists exactly when the change it
+announces was committed and writing it costs one INSERT, never an SMTP round
+trip. ``./manage.py send_notifications`` then ``drain``s the outbox:
+
+* due rows are leased in batches with ``SELECT ... FOR UPDATE SKIP LOCKED``
+  and pushed ``OUTBOX_LEASE_SECONDS`` into the future, so several senders
+  can run side by side and a crashed one's batch is picked up again later;
+* a batch goes out over one SMTP connection, kept open across batches;
+* failures are retried with exponential backoff, and given up on after
+  ``OUTBOX_MAX_ATTEMPTS`` (the row keeps its ``last_error``).
+
+Delivery is at least once: a sender dying between sending and recording it
+sends that email again.
+"""
+import datetime
+from dataclasses import dataclass
+from typing import Iterable, List, Optional
+
+from django.conf import settings
+from django.core import mail
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import BloodTestResults, Notification, User
+from .sharding import get_shards
+
+
+@dataclass
+class DrainReport:
+    sent: int = 0
+    # Patients without an email address.
+    skipped: int = 0
+    retried: int = 0
+    given_up: int = 0
+
+
+def enqueue(orders: Iterable[BloodTestResults], kind: str, using: str) -> None:
+    """Add a ``kind`` notification per order; call in the orders' transaction."""
+    Notification.objects.using(using).bulk_create(
+        [
+            Notification(user_id=order.user_id, result_id=order.pk, kind=kind)
+            for order in orders
+        ]
+    )
+
+
+def backoff(attempts: int) -> datetime.timedelta:
+    """How long to wait before the attempt after ``attempts`` failed ones."""
+    seconds = settings.OUTBOX_BACKOFF_SECONDS * 2 ** (attempts - 1)
+    return datetime.timedelta(seconds=min(seconds, settings.OUTBOX_MAX_BACKOFF_SECONDS))
+
+
+def lease(alias: str, limit: int, now: datetime.datetime) -> List[Notification]:
+    """Take up to ``limit`` due notifications off ``alias``'s outbox."""
+    with transaction.atomic(using=alias):
+        batch = list(
+            Notification.objects.using(alias)
+            .select_for_update(skip_locked=True)
+            .filter(
+                sent_at__isnull=True,
+                next_attempt_at__lte=now,
+                attempts__lt=settings.OUTBOX_MAX_ATTEMPTS,
+            )
+            .order_by("next_attempt_at")[:limit]
+        )
+        Notification.objects.using(alias).filter(
+            pk__in=[notification.pk for notification in batch]
+        ).update(
+            next_attempt_at=now
+            + datetime.timedelta(seconds=settings.OUTBOX_LEASE_SECONDS)
+        )
+    return batch
+
+
+def build_message(
+    notification: Notification, user: User, result: Optional[BloodTestResults]
+) -> mail.EmailMessage:
+    context = {"user": user, "notification": notification, "result": result}
+    return mail.EmailMessage(
+        subject="Your blood test results are ready",
+        body=render_to_string(f"emails/{notification.kind}.txt", context),
+        to=[user.email],
+    )
+
+
+class Sender:
+    """Sends messages over one connection, reopened only after errors."""
+
+    def __init__(self):
+        self.connection = None
+
+    def send(self, message: mail.EmailMessage) -> None:
+        if self.connection is None:
+            self.connection = mail.get_connection(fail_silently=False)
+            self.connection.open()
+        try:
+            # One message per call: send_messages can't tell which of a
+            # failed batch went out. The connection is shared all the same.
+            self.connection.send_messages([message])
+        except Exception:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+
+def send_batch(
+    alias: str, batch: List[Notification], sender: Sender, report: DrainReport
+) -> None:
+    users = User.objects.in_bulk({notification.user_id for notification in batch})
+    results = BloodTestResults.objects.using(alias).in_bulk(
+        {notification.result_id for notification in batch}
+    )
+    now = timezone.now()
+    for notification in batch:
+        user = users.get(notification.user_id)
+        notification.attempts += 1
+        try:
+            if user is None or not user.email:
+                notification.last_error = "No email address."
+                report.skipped += 1
+            else:
+                result = results.get(notification.result_id)
+                sender.send(build_message(notification, user, result))
+                notification.last_error = ""
+                report.sent += 1
+            notification.sent_at = now
+        except Exception as exc:
+            notification.last_error = f"{type(exc).__name__}: {exc}"
+            notification.next_attempt_at = now + backoff(notification.attempts)
+            if notification.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+                report.given_up += 1
+            else:
+                report.retried += 1
+    Notification.objects.using(alias).bulk_update(
+        batch, ["attempts", "sent_at", "last_error", "next_attempt_at"]
+    )
+
+
+def drain(batch_size: int = None, sender: Sender = None) -> DrainReport:
+    """Send every notification due now, a batch at a time, on every shard."""
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    own_sender = sender is None
+    sender = sender or Sender()
+    report = DrainReport()
+    try:
+        for alias in get_shards():
+            while True:
+                batch = lease(alias, batch_size, timezone.now())
+                if not batch:
+                    break
+                send_batch(alias, batch, sender, report)
+    finally:
+        if own_sender:
+            sender.close()
+    return report
+
+
+def purge(before: datetime.datetime) -> int:
+    """Delete notifications sent before ``before``."""
+    deleted = 0
+    for alias in get_shards():
+        count, _ = Notification.objects.using(alias).filter(sent_at__lt=before).delete()
+        deleted += count
+    return deleted
@@ -0,0 +1,115 @@
+"""Monthly range partitions of the results table on Postgres.
+
+Migration 0007 turns ``main_bloodtestresults`` into a table partitioned by
+``timestamp`` with a DEFAULT partition catching rows no monthly partition
+covers. ``./manage.py create_result_partitions`` creates the monthly
+partitions ahead of time, moving any rows the DEFAULT partition already holds
+for that month. Needs Postgres 11 or later; on other databases the table is
+left as it is.
+"""
+import datetime
+from typing import List, NamedTuple
+
+from django.db import connections, transaction
+
+from .models import BloodTestResults
+
+TABLE = BloodTestResults._meta.db_table
+DEFAULT_PARTITION = f"{TABLE}_default"
+MIN_POSTGRES_VERSION = 110000
+
+
+class Partition(NamedTuple):
+    name: str
+    start: datetime.date
+    end: datetime.date
+
+
+def supports_partitioning(connection) -> bool:
+    return (
+        connection.vendor == "postgresql"
+        and connection.pg_version >= MIN_POSTGRES_VERSION
+    )
+
+
+def is_partitioned(connection) -> bool:
+    if not supports_partitioning(connection):
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table p"
+            " JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = %s",
+            [TABLE],
+        )
+        return cursor.fetchone() is not None
+
+
+def month_start(day: datetime.date) -> datetime.date:
+    return day.replace(day=1)
+
+
+def add_months(day: datetime.date, months: int) -> datetime.date:
+    month = day.month - 1 + months
+    return day.replace(year=day.year + month // 12, month=month % 12 + 1, day=1)
+
+
+def partition_for(month: datetime.date) -> Partition:
+    start = month_start(month)
+    return Partition(f"{TABLE}_p{start:%Y%m}", start, add_months(start, 1))
+
+
+def monthly_partitions(using: str) -> List[Partition]:
+    """Return the monthly partitions attached to the results table, oldest first."""
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i"
+            " JOIN pg_class c ON c.oid = i.inhrelid"
+            " JOIN pg_class p ON p.oid = i.inhparent"
+            " WHERE p.relname = %s AND c.relname <> %s ORDER BY c.relname",
+            [TABLE, DEFAULT_PARTITION],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    return [
+        partition_for(datetime.datetime.strptime(name[-6:], "%Y%m").date())
+        for name in names
+    ]
+
+
+def create_partition(partition: Partition, using: str) -> int:
+    """Create and attach ``partition``, moving its rows out of DEFAULT.
+
+    Returns the number of rows moved.
+    """
+    quote = connections[using].ops.quote_name
+    table, default, name = quote(TABLE), quote(DEFAULT_PARTITION), quote(partition.name)
+    in_range = '"timestamp" >= %s AND "timestamp" < %s'
+    bounds = [partition.start, partition.end]
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        cursor.execute(
+            f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        )
+        cursor.execute(
+            f"WITH moved AS (DELETE FROM {default} WHERE {in_range} RETURNING *)"
+            f" INSERT INTO {name} SELECT * FROM moved",
+            bounds,
+        )
+        moved = cursor.rowcount
+        cursor.execute(
+            f"ALTER TABLE {table} ATTACH PARTITION {name}"
+            " FOR VALUES FROM (%s) TO (%s)",
+            bounds,
+        )
+    return moved
+
+
+def detach_partition(partition: Partition, using: str) -> None:
+    quote = connections[using].ops.quote_name
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f"ALTER TABLE {quote(TABLE)} DETACH PARTITION {quote(partition.name)}"
+        )
+
+
+def drop_table(name: str, using: str) -> None:
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"DROP TABLE {connections[using].ops.quote_name(name)}")
@@ -0,0 +1,89 @@
+"""MessagePack and CBOR renderers and parsers.
+
+Clients pick them like JSON, with ``Accept`` and ``Content-Type`` (or
+``?format=msgpack`` / ``?format=cbor``). Values are the ones the JSON
+renderer would produce: anything that isn't a string, number, boolean,
+None, list or mapping goes through DRF's JSON encoder first, so datetimes
+are ISO 8601 strings, decimals follow ``COERCE_DECIMAL_TO_STRING`` and so
+on, whichever format a client asked for.
+
+Parsers accept native binary types too: a MessagePack timestamp or a CBOR
+datetime tag arrives as a ``datetime``, which DRF's date fields accept.
+"""
+from typing import Any
+
+import cbor2
+import msgpack
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+_json_default = JSONEncoder().default
+
+_PLAIN = frozenset([str, int, float, bool, type(None)])
+
+
+def as_json_values(data: Any) -> Any:
+    """Convert ``data`` to what ``json.loads`` of its JSON rendering gives."""
+    # Leaves are checked inline: this runs over every value of a response.
+    if isinstance(data, dict):
+        return {
+            key: value if type(value) in _PLAIN else as_json_values(value)
+            for key, value in data.items()
+        }
+    if isinstance(data, (list, tuple)):
+        return [
+            value if type(value) in _PLAIN else as_json_values(value) for value in data
+        ]
+    if isinstance(data, (str, int, float, bool, type(None))):
+        return data
+    return as_json_values(_json_default(data))
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        # msgpack calls ``default`` for anything it can't pack, so the walk
+        # in as_json_values is only needed for CBOR.
+        return msgpack.packb(data, default=_json_default, use_bin_type=True)
+
+
+class CBORRenderer(BaseRenderer):
+    media_type = "application/cbor"
+    format = "cbor"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        # cbor2 has native encodings for datetimes and decimals that JSON
+        # clients never see, so convert those first.
+        return cbor2.dumps(as_json_values(data))
+
+
+class MessagePackParser(BaseParser):
+    media_type = "application/msgpack"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False, timestamp=3)
+        except (ValueError, msgpack.UnpackException) as exc:
+            raise ParseError(f"MessagePack parse error - {exc}")
+
+
+class CBORParser(BaseParser):
+    media_type = "application/cbor"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return cbor2.loads(stream.read())
+        except (ValueError, cbor2.CBORDecodeError) as exc:
+            raise ParseError(f"CBOR parse error - {exc}")
@@ -0,0 +1,51 @@
+"""Per-request state shared by middleware, logging and integrations."""
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+
+@dataclass
+class RequestContext:
+    """What we know about the request currently being served."""
+
+    method: str
+    path: str
+    view: str = ""
+    user_id: Optional[int] = None
+    db_queries: int = 0
+    db_time: float = 0.0
+    upstream_time: float = 0.0
+
+    def as_log_fields(self) -> Dict[str, Any]:
+        return {
+            "method": self.method,
+            "path": self.path,
+            "view": self.view,
+            "user_id": self.user_id,
+            "db_queries": self.db_queries,
+            "db_time_ms": round(self.db_time * 1000, 3),
+            "upstream_time_ms": round(self.upstream_time * 1000, 3),
+        }
+
+
+_current: ContextVar[Optional[RequestContext]] = ContextVar(
+    "request_context", default=None
+)
+
+
+def get_current() -> Optional[RequestContext]:
+    return _current.get()
+
+
+def activate(context: RequestContext):
+    return _current.set(context)
+
+
+def deactivate(token) -> None:
+    _current.reset(token)
+
+
+def add_upstream_time(seconds: float) -> None:
+    context = _current.get()
+    if context is not None:
+        context.upstream_time += seconds
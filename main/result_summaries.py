@@ -0,0 +1,262 @@
+"""Per-patient snapshots of their latest results, maintained as orders change.
+
+Every path that creates orders, turns them ready, deletes or archives them
+calls ``record_created``, ``record_ready``, ``record_deleted`` or
+``record_archived`` with the orders concerned, inside the transaction that
+writes them (the same one, unless results are sharded away from "default").
+The changes are gathered per patient and applied under a row lock, so
+concurrent writers never lose each other's updates: pending counts are
+adjusted, and each analyte keeps the value of the newest ready result
+carrying it, newest by order timestamp then id. ``./manage.py
+rebuild_result_summaries`` recomputes the rows from the results, archived
+ones included, should they ever drift, or after edits and deletes that take
+values back.
+"""
+from collections import defaultdict
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Dict, Iterable, List, Optional
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import archive
+from .constants.blood_tests import BLOOD_TEST_CHOICES
+from .exports import analyte_values
+from .models import BloodTestResults, ResultSummary
+from .sharding import get_shards
+
+ANALYTES = [code for code, _ in BLOOD_TEST_CHOICES]
+
+Latest = Dict[str, dict]
+
+
+@dataclass
+class Change:
+    pending: int = 0
+    latest: Latest = field(default_factory=dict)
+
+
+Changes = Dict[int, Change]
+
+
+def _newer(entry: dict, than: Optional[dict]) -> bool:
+    if than is None:
+        return True
+    # The same result again carries its latest values.
+    return (parse_datetime(entry["timestamp"]), entry["result"]) >= (
+        parse_datetime(than["timestamp"]),
+        than["result"],
+    )
+
+
+def merge(latest: Latest, order: BloodTestResults) -> None:
+    """Fold ``order``'s values into ``latest`` where it's the newest result."""
+    timestamp = order.timestamp.isoformat()
+    for analyte, value in analyte_values(order.results).items():
+        if analyte not in ANALYTES or value is None:
+            continue
+        entry = {"value": value, "result": order.pk, "timestamp": timestamp}
+        if _newer(entry, latest.get(analyte)):
+            latest[analyte] = entry
+
+
+def apply(changes: Changes) -> None:
+    """Apply ``changes`` to the patients' rows, creating missing rows."""
+    if not changes:
+        return
+    now = timezone.now()
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        ResultSummary.objects.bulk_create(
+            [ResultSummary(user_id=user_id) for user_id in changes],
+            ignore_conflicts=True,
+        )
+        # Locked in a fixed order, so two writers can't deadlock.
+        rows = list(
+            ResultSummary.objects.select_for_update()
+            .filter(pk__in=changes.keys())
+            .order_by("pk")
+        )
+        for row in rows:
+            change = changes[row.pk]
+            row.pending = max(0, row.pending + change.pending)
+            for analyte, entry in change.latest.items():
+                if _newer(entry, row.latest.get(analyte)):
+                    row.latest[analyte] = entry
+            row.updated_at = now
+        ResultSummary.objects.bulk_update(rows, ["pending", "latest", "updated_at"])
+
+
+def record_created(orders: Iterable[BloodTestResults]) -> None:
+    """Count ``orders`` as pending.
+
+    Paths creating orders that are ready already report them ready too.
+    """
+    changes: Changes = defaultdict(Change)
+    for order in orders:
+        changes[order.user_id].pending += 1
+    apply(changes)
+
+
+def record_ready(
+    orders: Iterable[BloodTestResults], updated: Iterable[BloodTestResults] = ()
+) -> None:
+    """Record the values of ``orders``, which have just turned ready.
+
+    ``updated`` are ready orders whose values changed without them turning
+    ready just now; their values are recorded too, but they were never
+    pending.
+    """
+    changes: Changes = defaultdict(Change)
+    for order in orders:
+        changes[order.user_id].pending -= 1
+        merge(changes[order.user_id].latest, order)
+    for order in updated:
+        merge(changes[order.user_id].latest, order)
+    apply(changes)
+
+
+def record_deleted(orders: Iterable[BloodTestResults]) -> None:
+    """Take ``orders``, just deleted, out of their patients' snapshots.
+
+    Patients who lost a ready order are recomputed, as it may have held their
+    latest values.
+    """
+    changes: Changes = defaultdict(Change)
+    recompute = set()
+    for order in orders:
+        if order.ready:
+            recompute.add(order.user_id)
+        else:
+            changes[order.user_id].pending -= 1
+    if recompute:
+        rebuild(user_ids=recompute)
+    apply({user_id: c for user_id, c in changes.items() if user_id not in recompute})
+
+
+def record_archived(orders: Iterable[BloodTestResults]) -> None:
+    """Stop counting ``orders``, just archived, as pending.
+
+    The values of archived results stay in the snapshots: they're still the
+    patient's latest.
+    """
+    changes: Changes = defaultdict(Change)
+    for order in orders:
+        if not order.ready:
+            changes[order.user_id].pending -= 1
+    apply(changes)
+
+
+def compute(user_ids: Optional[Iterable[int]] = None) -> Dict[int, ResultSummary]:
+    """Recompute the snapshots from the results on every shard.
+
+    With ``user_ids``, their archived results' values count too.
+    """
+    if user_ids is not None:
+        user_ids = list(user_ids)
+    summaries: Dict[int, ResultSummary] = {}
+
+    def summary(user_id: int) -> ResultSummary:
+        if user_id not in summaries:
+            summaries[user_id] = ResultSummary(user_id=user_id, latest={})
+        return summaries[user_id]
+
+    for alias in get_shards():
+        queryset = BloodTestResults.objects.using(alias)
+        if user_ids is not None:
+            queryset = queryset.filter(user_id__in=user_ids)
+        pending = (
+            queryset.filter(ready=False)
+            .values("user_id")
+            .annotate(total=Count("pk"))
+            .order_by()
+        )
+        for row in pending:
+            summary(row["user_id"]).pending += row["total"]
+        ready = (
+            queryset.filter(ready=True)
+            .only("pk", "user_id", "timestamp", "results")
+            .order_by()
+            .iterator(chunk_size=2000)
+        )
+        for order in ready:
+            merge(summary(order.user_id).latest, order)
+    for user_id in user_ids or ():
+        for row in archive.archived_results(user_id):
+            if row["ready"]:
+                merge(summary(user_id).latest, _archived_order(row))
+    return summaries
+
+
+def _archived_order(row: dict) -> BloodTestResults:
+    return BloodTestResults(
+        pk=row["id"],
+        user_id=row["user"],
+        timestamp=parse_datetime(row["timestamp"]),
+        results=row["results"],
+    )
+
+
+def _rebuild(user_ids: List[int]) -> int:
+    """Recompute the rows of ``user_ids``; returns how many have results."""
+    now = timezone.now()
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        ResultSummary.objects.bulk_create(
+            [ResultSummary(user_id=user_id) for user_id in user_ids],
+            ignore_conflicts=True,
+        )
+        # Locked before reading the results: a writer that got there first
+        # has committed its orders by now, and one coming later waits and
+        # applies its change on top of ours.
+        rows = list(
+            ResultSummary.objects.select_for_update()
+            .filter(pk__in=user_ids)
+            .order_by("pk")
+        )
+        summaries = compute(user_ids)
+        for row in rows:
+            summary = summaries.get(row.pk) or ResultSummary(latest={})
+            row.pending = summary.pending
+            row.latest = summary.latest
+            row.updated_at = now
+        ResultSummary.objects.bulk_update(rows, ["pending", "latest", "updated_at"])
+        # Patients without any results left have no snapshot.
+        ResultSummary.objects.filter(pk__in=set(user_ids) - set(summaries)).delete()
+    return len(summaries)
+
+
+def rebuild(user_ids: Optional[Iterable[int]] = None, batch_size: int = 1000) -> int:
+    """Replace the snapshots with ones recomputed from the results.
+
+    Only the rows of ``user_ids`` are replaced, when given, and otherwise
+    every patient's, ``batch_size`` patients per transaction.
+    """
+    if user_ids is None:
+        everyone = set(ResultSummary.objects.values_list("pk", flat=True))
+        for alias in get_shards():
+            everyone.update(
+                BloodTestResults.objects.using(alias)
+                .values_list("user_id", flat=True)
+                .distinct()
+                .order_by()
+            )
+        user_ids = everyone
+    remaining = iter(sorted(set(user_ids)))
+    rebuilt = 0
+    while True:
+        batch = list(islice(remaining, batch_size))
+        if not batch:
+            return rebuilt
+        rebuilt += _rebuild(batch)
+
+
+def describe(summary: Optional[ResultSummary]) -> Dict[str, object]:
+    """What api/results/summary/ returns: every analyte, with or without a value."""
+    latest = summary.latest if summary is not None else {}
+    return {
+        "pending": summary.pending if summary is not None else 0,
+        "latest": {analyte: latest.get(analyte) for analyte in ANALYTES},
+        "updated_at": summary.updated_at if summary is not None else None,
+    }
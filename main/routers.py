@@ -0,0 +1,145 @@
+"""Database routing.
+
+``ShardRouter`` places BloodTestResults rows, and the notifications written
+with them, on their user's shard (see main/sharding.py) and keeps every other
+model off the shards.
+
+Reads only go to a replica inside ``replica_reads()``, which views opt into
+with ``@reads_from_replica``; everything else, including all writes, stays on
+"default". A replica is picked once per block, weighted by
+``REPLICA_DATABASES`` among the replicas whose last health check passed.
+After a user writes, ``pin_to_primary`` keeps their reads on "default" for
+``REPLICA_READ_YOUR_WRITES_SECONDS`` so they never read stale data.
+"""
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+from . import sharding
+from .cache import Cache
+
+logger = logging.getLogger(__name__)
+
+_replica: ContextVar[Optional[str]] = ContextVar("replica", default=None)
+
+# alias -> (healthy, time.monotonic() of the check)
+_health: Dict[str, Tuple[bool, float]] = {}
+
+
+def check_replica(alias: str) -> bool:
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute("SELECT 1")
+    except DatabaseError:
+        logger.warning("Replica %s failed its health check", alias, exc_info=True)
+        return False
+    return True
+
+
+def is_healthy(alias: str) -> bool:
+    healthy, checked_at = _health.get(alias, (True, float("-inf")))
+    if time.monotonic() - checked_at >= settings.REPLICA_HEALTH_CHECK_INTERVAL:
+        healthy = check_replica(alias)
+        _health[alias] = (healthy, time.monotonic())
+    return healthy
+
+
+def choose_replica() -> Optional[str]:
+    """Pick a healthy replica by weight, or None if there is none."""
+    replicas = [
+        (alias, weight)
+        for alias, weight in settings.REPLICA_DATABASES.items()
+        if weight > 0 and is_healthy(alias)
+    ]
+    if not replicas:
+        return None
+    aliases, weights = zip(*replicas)
+    return random.choices(aliases, weights)[0]
+
+
+pins: Cache[bool] = Cache("replica-pin", stale_grace=0)
+
+
+def pin_to_primary(user_id) -> None:
+    """Send ``user_id``'s reads to the primary for a while after a write."""
+    pins.set(str(user_id), True, settings.REPLICA_READ_YOUR_WRITES_SECONDS)
+
+
+def is_pinned(user_id) -> bool:
+    return pins.get(str(user_id), False)
+
+
+@contextmanager
+def replica_reads(user_id=None):
+    """Route reads inside the block to a replica, unless ``user_id`` is pinned."""
+    alias = None
+    if settings.REPLICA_DATABASES and not (user_id and is_pinned(user_id)):
+        alias = choose_replica()
+    token = _replica.set(alias)
+    try:
+        yield alias
+    finally:
+        _replica.reset(token)
+
+
+def reads_from_replica(method):
+    """Serve a viewset action's reads from a replica."""
+
+    @wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        with replica_reads(request.user.pk):
+            return method(self, request, *args, **kwargs)
+
+    return wrapper
+
+
+SHARDED_MODELS = {"main.bloodtestresults", "main.notification"}
+
+
+class ShardRouter:
+    def _db_for_instance(self, model, hints):
+        instance = hints.get("instance")
+        if (
+            model._meta.label_lower in SHARDED_MODELS
+            and sharding.is_sharded()
+            and isinstance(instance, model)
+            and instance.user_id is not None
+        ):
+            return sharding.shard_for_user(instance.user_id)
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._db_for_instance(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db_for_instance(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Results on a shard still point at users and labs on "default".
+        return True
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        # Falling through would read related objects (e.g. a result's user)
+        # from whichever database the instance came from, which may be a shard.
+        return _replica.get() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.REPLICA_DATABASES:
+            return False
+        return None
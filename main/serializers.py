@@ -1,6 +1,14 @@
+from importlib.util import find_spec
+
+from django.conf import settings
+from django.db.models import Manager
+from django.utils.dateparse import parse_datetime
 from rest_framework import serializers
 
 from main.constants.blood_tests import BLOOD_TEST_CHOICES
+from main.exports import FORMAT_NDJSON, FORMAT_PARQUET, FORMATS, analyte_values
+from main.ingestion import FORMAT_CSV
+from main.ingestion import FORMATS as INGEST_FORMATS
 from main.models import BloodTestResults
 
 
@@ -25,7 +33,149 @@ class CreateBloodTestSerializer(serializers.Serializer):
     blood_test = serializers.MultipleChoiceField(choices=BLOOD_TEST_CHOICES)
 
 
+def _flag(rows, keys):
+    # Imported on first use: flagging needs NumPy, which is slow to import.
+    from main.flagging import flag_rows
+
+    for row, row_flags in zip(rows, flag_rows(keys)):
+        row["flags"] = row_flags
+    return rows
+
+
+def add_flags(rows, instances):
+    """Add each result's reference-range flags, computed for all of them at once."""
+    return _flag(
+        rows, [(i.user_id, i.timestamp, analyte_values(i.results)) for i in instances]
+    )
+
+
+def add_archived_flags(rows):
+    """Add flags to archived rows, which are kept without them.
+
+    They're flagged when read, so they follow the current reference ranges
+    like live results do.
+    """
+    return _flag(
+        rows,
+        [
+            (
+                row["user"],
+                parse_datetime(row["timestamp"]),
+                analyte_values(row["results"]),
+            )
+            for row in rows
+        ],
+    )
+
+
+class FlaggedResultsListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        instances = list(data.all() if isinstance(data, Manager) else data)
+        return add_flags(super().to_representation(instances), instances)
+
+
 class BloodTestResultsModelSerializer(serializers.ModelSerializer):
     class Meta:
         model = BloodTestResults
-        fields = "__all__"
+        # What patients see, in the API and the archive; the worklist's
+        # bookkeeping (claims, when an order turned ready) stays internal.
+        fields = ["id", "user", "timestamp", "results", "ready", "lab"]
+        list_serializer_class = FlaggedResultsListSerializer
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if self.parent is None:
+            add_flags([data], [instance])
+        return data
+
+
+class ArchivedResultSerializer(serializers.ModelSerializer):
+    """A result as the archive keeps it: the patient's fields, without flags."""
+
+    class Meta:
+        model = BloodTestResults
+        fields = BloodTestResultsModelSerializer.Meta.fields
+
+
+class PanelResultSerializer(BloodTestResultsModelSerializer):
+    lab_name = serializers.CharField(source="lab.name", read_only=True, allow_null=True)
+
+    class Meta(BloodTestResultsModelSerializer.Meta):
+        fields = BloodTestResultsModelSerializer.Meta.fields + ["lab_name"]
+
+
+class ResultsBatchSerializer(serializers.Serializer):
+    user_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.RESULTS_BATCH_MAX_USERS,
+    )
+
+    def validate_user_ids(self, value):
+        # Once each, in the order asked for.
+        return list(dict.fromkeys(value))
+
+
+class ResultsExportSerializer(serializers.Serializer):
+    # Not "format", which DRF reserves for picking a renderer.
+    file_format = serializers.ChoiceField(choices=FORMATS, default=FORMAT_NDJSON)
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+    lab = serializers.IntegerField(required=False)
+    ready = serializers.BooleanField(required=False, allow_null=True, default=None)
+    after_id = serializers.IntegerField(required=False, default=0, min_value=0)
+
+    def validate_file_format(self, value):
+        if value == FORMAT_PARQUET and find_spec("pyarrow") is None:
+            raise serializers.ValidationError("Parquet exports need pyarrow installed.")
+        return value
+
+
+class WorklistClaimSerializer(serializers.Serializer):
+    limit = serializers.IntegerField(
+        default=10, min_value=1, max_value=settings.WORKLIST_MAX_CLAIM
+    )
+    lease_seconds = serializers.IntegerField(required=False, min_value=1)
+
+
+class WorklistOrderSerializer(serializers.ModelSerializer):
+    tests = serializers.SerializerMethodField()
+
+    class Meta:
+        model = BloodTestResults
+        fields = ["id", "timestamp", "tests", "claimed_until"]
+
+    def get_tests(self, instance):
+        return sorted(instance.results)
+
+
+class CompletedOrderSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    results = serializers.DictField()
+
+    def validate_results(self, value):
+        unknown = set(value) - {code for code, _ in BLOOD_TEST_CHOICES}
+        if unknown:
+            raise serializers.ValidationError(
+                f"Unknown blood tests: {', '.join(sorted(unknown))}"
+            )
+        return value
+
+
+class WorklistCompleteSerializer(serializers.Serializer):
+    orders = CompletedOrderSerializer(many=True, allow_empty=False)
+
+    def validate_orders(self, value):
+        if len({order["id"] for order in value}) != len(value):
+            raise serializers.ValidationError("Each order may only appear once.")
+        return value
+
+
+class ResultsIngestSerializer(serializers.Serializer):
+    file = serializers.FileField()
+    file_format = serializers.ChoiceField(choices=INGEST_FORMATS, default=FORMAT_CSV)
+
+
+class LabStatsQuerySerializer(serializers.Serializer):
+    since = serializers.DateField(required=False)
+    until = serializers.DateField(required=False)
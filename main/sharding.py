@@ -0,0 +1,102 @@
+"""Spreading BloodTestResults across databases by user.
+
+Every result lives on the shard ``shard_for_user(user_id)`` picks from
+``RESULT_SHARDS``; everything else, users and labs included, stays on
+"default". The router can only place a query when it has an instance to look
+at, so code reading or creating results for a user goes through
+``results_for_user``. Shards are migrated like "default" (their other tables
+just stay empty). After changing ``RESULT_SHARDS``, run
+``./manage.py rebalance_result_shards`` to move rows to their new shard.
+"""
+import hashlib
+import heapq
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Prefetch, QuerySet, prefetch_related_objects
+
+from .models import BloodTestResults, Lab
+
+
+def get_shards() -> List[str]:
+    return list(settings.RESULT_SHARDS)
+
+
+def is_sharded() -> bool:
+    return len(settings.RESULT_SHARDS) > 1
+
+
+def shard_for_user(user_id: int) -> str:
+    shards = settings.RESULT_SHARDS
+    # Not hash(): placement has to agree across processes and restarts.
+    digest = hashlib.blake2b(str(user_id).encode(), digest_size=8).digest()
+    return shards[int.from_bytes(digest, "big") % len(shards)]
+
+
+def results_for_user(user_id: int) -> QuerySet:
+    """Return the queryset holding ``user_id``'s results, on the right shard."""
+    queryset = BloodTestResults.objects.all()
+    if is_sharded():
+        queryset = queryset.using(shard_for_user(user_id))
+    return queryset.filter(user_id=user_id)
+
+
+def results_for_users(user_ids: Iterable[int]) -> List[BloodTestResults]:
+    """Return the results of all ``user_ids`` with their labs loaded.
+
+    Results come ordered by user, then timestamp, from one ``user_id IN``
+    query per shard holding any of the users (served by
+    results_user_timestamp_idx). Labs are joined in on a single database, and
+    fetched with one more query when results are spread across shards.
+    """
+    user_ids = list(user_ids)
+    if not is_sharded():
+        return list(
+            BloodTestResults.objects.filter(user_id__in=user_ids)
+            .select_related("lab")
+            .order_by("user_id", "timestamp")
+        )
+    per_shard: Dict[str, List[int]] = defaultdict(list)
+    for user_id in user_ids:
+        per_shard[shard_for_user(user_id)].append(user_id)
+    results: List[BloodTestResults] = []
+    for alias, ids in per_shard.items():
+        results += (
+            BloodTestResults.objects.using(alias)
+            .filter(user_id__in=ids)
+            .order_by("user_id", "timestamp")
+        )
+    # Labs live on "default" and can't be joined from a shard.
+    prefetch_related_objects(
+        results, Prefetch("lab", queryset=Lab.objects.using(DEFAULT_DB_ALIAS))
+    )
+    return results
+
+
+def _run_on_shard(build: Callable[[], QuerySet], alias: str) -> list:
+    try:
+        return list(build().using(alias))
+    finally:
+        # Worker threads get their own connections; don't leak them.
+        connections[alias].close()
+
+
+def scatter_gather(
+    build: Callable[[], QuerySet], key: Callable, reverse: bool = False
+) -> Iterable:
+    """Run ``build()`` on every shard in parallel and merge the sorted results.
+
+    ``build`` must return a queryset already ordered consistently with ``key``
+    (and ``reverse``), and sliced if only the first rows are wanted.
+    """
+    shards = get_shards()
+    if len(shards) == 1:
+        return list(build().using(shards[0]))
+    with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        per_shard = list(
+            executor.map(lambda alias: _run_on_shard(build, alias), shards)
+        )
+    return heapq.merge(*per_shard, key=key, reverse=reverse)
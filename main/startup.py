@@ -0,0 +1,116 @@
+"""Measuring what a cold process pays before it serves its first request.
+
+``cold_start`` runs a fresh interpreter that sets Django up and serves one
+API request through the whole middleware stack, the way a new pod does
+before it turns ready. With ``importtime`` it also collects Python's
+``-X importtime`` report, which ``./manage.py profile_imports`` sorts into
+the modules that cost the most, counting what each one imports.
+
+The probe never touches the database: like ``main.warmup.prime_site_cache``
+it fills the sites cache up front (without the query), and the request is
+refused by authentication before any view code runs. Module imports, URL
+resolution, DRF's settings and rendering are all paid as on a real start.
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from typing import List, NamedTuple, Set
+
+from django.conf import settings
+
+PROBE_PATH = "/api/lab/GB/"
+
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import django
+django.setup()
+setup = time.perf_counter() - started
+
+from django.conf import settings
+from django.contrib.sites.models import SITE_CACHE, Site
+from django.test import Client
+
+SITE_CACHE[settings.SITE_ID] = Site(pk=settings.SITE_ID, domain="testserver")
+status = Client().get(sys.argv[1]).status_code
+with open(sys.argv[2], "w") as f:
+    json.dump(
+        {
+            "setup": setup,
+            "total": time.perf_counter() - started,
+            "status": status,
+            "modules": sorted(sys.modules),
+        },
+        f,
+    )
+"""
+
+
+class ModuleTime(NamedTuple):
+    name: str
+    # Microseconds spent in the module itself, and with everything it imported.
+    own: int
+    cumulative: int
+    # How deeply nested the import was; 0 for top-level imports.
+    depth: int
+
+
+class ColdStart(NamedTuple):
+    # Seconds for django.setup(), and to the end of the first request.
+    setup: float
+    total: float
+    status: int
+    modules: Set[str]
+    imports: List[ModuleTime]
+
+
+def parse_importtime(report: str) -> List[ModuleTime]:
+    """Parse the ``-X importtime`` lines of ``report``, in import order."""
+    imports = []
+    for line in report.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        own, cumulative, name = line.partition(":")[2].split("|")
+        if not own.strip().isdigit():
+            # The column headings.
+            continue
+        stripped = name.lstrip()
+        depth = (len(name) - len(stripped) - 1) // 2
+        imports.append(ModuleTime(stripped, int(own), int(cumulative), depth))
+    return imports
+
+
+def cold_start(path: str = PROBE_PATH, importtime: bool = False) -> ColdStart:
+    """Start Django in a new interpreter and serve ``path`` once."""
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    # The result goes to a file of its own: the access log writes to stdout.
+    handle, result_path = tempfile.mkstemp(suffix=".json")
+    os.close(handle)
+    command += ["-c", _PROBE, path, result_path]
+    env = {
+        **os.environ,
+        "DJANGO_SETTINGS_MODULE": os.environ.get(
+            "DJANGO_SETTINGS_MODULE", settings.SETTINGS_MODULE
+        ),
+    }
+    try:
+        process = subprocess.run(
+            command, cwd=settings.BASE_DIR, env=env, capture_output=True, text=True
+        )
+        if process.returncode:
+            raise RuntimeError(f"The cold start failed:\n{process.stderr}")
+        with open(result_path) as f:
+            result = json.load(f)
+    finally:
+        os.remove(result_path)
+    return ColdStart(
+        result["setup"],
+        result["total"],
+        result["status"],
+        set(result["modules"]),
+        parse_importtime(process.stderr) if importtime else [],
+    )
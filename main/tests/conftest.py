@@ -0,0 +1,10 @@
+import pytest
+from django.core.cache import cache
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # API responses are cached now; don't let one test's data leak into the next.
+    cache.clear()
+    yield
+    cache.clear()
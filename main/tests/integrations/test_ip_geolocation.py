@@ -110,3 +110,28 @@ class TestIpGeolocationClientClient:
             with expected_exception:
                 resp = client.get_ip_geolocation(param)
                 assert resp == expected_response
+
+    @override_settings(
+        IP_GEOLOCATION_BASE_URL="https://fakeipgeolocation.com",
+        IP_GEOLOCATION_BACKOFF_SECONDS=0.5,
+        IP_GEOLOCATION_MAX_BACKOFF_SECONDS=1.5,
+    )
+    def test_retries_back_off(self, mocker):
+        failure, success = Mock(status_code=503, reason="Unavailable"), Mock()
+        success.status_code = status.HTTP_200_OK
+        success.json.return_value = {"city": "London"}
+        mocker.patch(
+            "main.integrations.ip_geolocation.requests.get",
+            side_effect=[failure, failure, failure, success],
+        )
+        # The longest wait the jitter allows.
+        mocker.patch(
+            "main.integrations.ip_geolocation.random.uniform",
+            side_effect=lambda low, high: high,
+        )
+        sleep = mocker.patch("main.integrations.ip_geolocation.time.sleep")
+
+        data = IpGeolocationClient(max_retries=3).get_ip_geolocation({"ip": "8.8.8.8"})
+
+        assert data == {"city": "London"}
+        assert [call.args[0] for call in sleep.call_args_list] == [0.5, 1.0, 1.5]
@@ -0,0 +1,96 @@
+import csv
+import gzip
+import io
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from main import paginators
+from main.models import BloodTestResults
+
+from .factories import BloodTestResultsFactory, UserFactory
+
+CHANGELIST = "admin:main_bloodtestresults_changelist"
+
+
+@pytest.fixture()
+def admin_client(client):
+    client.force_login(UserFactory(is_staff=True, is_superuser=True))
+    return client
+
+
+def changelist_queries(client, **params):
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(reverse(CHANGELIST), params)
+    assert response.status_code == 200
+    return response, len(queries)
+
+
+@pytest.mark.django_db
+class TestBloodTestResultAdmin:
+    def test_page_cost_does_not_grow_with_rows(self, admin_client):
+        BloodTestResultsFactory.create_batch(2)
+        changelist_queries(admin_client)  # Warms per-process caches.
+        _, few = changelist_queries(admin_client)
+        BloodTestResultsFactory.create_batch(20)
+        response, many = changelist_queries(admin_client)
+
+        assert many == few
+        assert len(response.context["cl"].result_list) == 22
+
+    def test_filters_and_summary(self, admin_client):
+        BloodTestResultsFactory(ready=True, results={"HDL": 50, "LDL": "x" * 100})
+        BloodTestResultsFactory(ready=False)
+
+        response, _ = changelist_queries(admin_client, ready__exact=1)
+
+        [row] = response.context["cl"].result_list
+        assert row.ready
+        content = response.content.decode()
+        assert "HDL: 50, LDL: " in content
+        assert "x" * 100 not in content
+
+    def test_export_csv_action(self, admin_client):
+        results = BloodTestResultsFactory.create_batch(3, results={"HDL": 40})
+
+        response = admin_client.post(
+            reverse(CHANGELIST),
+            {
+                "action": "export_csv",
+                "_selected_action": [results[0].pk, results[2].pk],
+            },
+        )
+
+        body = gzip.decompress(b"".join(response.streaming_content)).decode()
+        rows = list(csv.DictReader(io.StringIO(body)))
+        assert [int(row["id"]) for row in rows] == [results[0].pk, results[2].pk]
+        assert rows[0]["result_HDL"] == "40"
+
+
+@pytest.mark.django_db
+class TestEstimatedCountPaginator:
+    def test_exact_count_off_postgres(self, mocker):
+        mocker.patch.object(connection, "vendor", "sqlite")
+        estimate = mocker.patch.object(paginators, "estimate_count")
+        BloodTestResultsFactory.create_batch(3)
+
+        paginator = paginators.EstimatedCountPaginator(
+            BloodTestResults.objects.order_by("pk"), 2
+        )
+
+        assert paginator.count == 3
+        estimate.assert_not_called()
+
+    @pytest.mark.parametrize("estimate, expected", [(5, 3), (50_000, 50_000)])
+    def test_estimate_on_postgres(self, mocker, estimate, expected):
+        mocker.patch.object(connection, "vendor", "postgresql")
+        mocker.patch.object(paginators, "estimate_count", return_value=estimate)
+        BloodTestResultsFactory.create_batch(3)
+
+        paginator = paginators.EstimatedCountPaginator(
+            BloodTestResults.objects.order_by("pk"), 2
+        )
+
+        assert paginator.count == expected
@@ -0,0 +1,164 @@
+import threading
+
+import pytest
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from main import admission, metrics
+from main.models import CustomToken
+
+from .factories import UserFactory
+
+CONFIG = admission.LimitConfig(
+    limit=2,
+    min_limit=1,
+    max_limit=4,
+    queue=1,
+    queue_timeout=0.05,
+    latency_target=1.0,
+)
+
+
+@pytest.fixture(autouse=True)
+def limiters():
+    admission.reset()
+    yield
+    admission.reset()
+
+
+class TestLimiter:
+    def test_admits_up_to_the_limit_then_queues_then_sheds(self):
+        limiter = admission.Limiter("test", CONFIG._replace(queue=0))
+        assert [limiter.acquire() for _ in range(3)] == [
+            admission.ADMITTED,
+            admission.ADMITTED,
+            admission.QUEUE_FULL,
+        ]
+        assert limiter.in_flight == 2
+
+    def test_queue_times_out(self):
+        limiter = admission.Limiter("test", CONFIG._replace(limit=1))
+        limiter.acquire()
+        assert limiter.acquire() == admission.TIMED_OUT
+        assert (limiter.in_flight, limiter.waiting) == (1, 0)
+
+    def test_queued_request_gets_a_released_slot(self):
+        limiter = admission.Limiter("test", CONFIG._replace(limit=1, queue_timeout=5))
+        limiter.acquire()
+        decisions = []
+        waiter = threading.Thread(target=lambda: decisions.append(limiter.acquire()))
+        waiter.start()
+        while not limiter.waiting:
+            pass
+        # A full queue: the next one is refused straight away.
+        assert limiter.acquire() == admission.QUEUE_FULL
+        limiter.release(0.01)
+        waiter.join()
+        assert decisions == [admission.QUEUED]
+        assert limiter.in_flight == 1
+
+    def test_additive_increase(self):
+        limiter = admission.Limiter("test", CONFIG)
+        for _ in range(4):
+            limiter.acquire()
+            limiter.release(0.1)
+        # +1/2, then +1/2.5, ...: about one per round of `limit` requests.
+        assert 3 < limiter.limit < 4
+        for _ in range(20):
+            limiter.acquire()
+            limiter.release(0.1)
+        assert limiter.limit == CONFIG.max_limit
+
+    def test_multiplicative_decrease_once_per_target(self, mocker):
+        clock = mocker.patch("main.admission.time.monotonic", return_value=100.0)
+        limiter = admission.Limiter("test", CONFIG._replace(limit=4))
+        for _ in range(3):
+            limiter.acquire()
+            limiter.release(2.0)
+        assert limiter.limit == pytest.approx(3.6)
+
+        clock.return_value = 101.0
+        limiter.acquire()
+        limiter.release(0.1, failed=True)
+        assert limiter.limit == pytest.approx(3.24)
+        assert limiter.retry_after() == 2
+
+    def test_never_below_the_minimum(self, mocker):
+        clock = mocker.patch("main.admission.time.monotonic", return_value=100.0)
+        limiter = admission.Limiter("test", CONFIG)
+        for _ in range(20):
+            clock.return_value += 1
+            limiter.acquire()
+            limiter.release(5.0)
+        assert limiter.limit == CONFIG.min_limit
+
+
+@pytest.mark.django_db
+class TestMiddleware:
+    @pytest.fixture()
+    def client(self):
+        client = APIClient()
+        token = CustomToken.objects.create(user=UserFactory())
+        client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        return client
+
+    @pytest.fixture()
+    def upstream(self, settings):
+        settings.ADMISSION_LIMITS = {
+            **settings.ADMISSION_LIMITS,
+            "upstream": CONFIG._replace(limit=1, queue=0)._asdict(),
+        }
+        return admission.get_limiter("upstream")
+
+    def shed(self, decision):
+        return metrics.ADMISSION_DECISIONS.labels(
+            endpoint="upstream", decision=decision
+        )._value.get()
+
+    def test_sheds_a_busy_class_only(self, client, upstream):
+        before = self.shed(admission.QUEUE_FULL)
+        # A slow upstream call holds the only slot.
+        upstream.acquire()
+
+        response = client.get(reverse("main:api-geolocation"), {"ip": "8.8.8.8"})
+
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert response["Retry-After"] == "1"
+        assert self.shed(admission.QUEUE_FULL) == before + 1
+        assert client.get(reverse("main:api-results")).status_code == 200
+
+    def test_releases_the_slot_with_the_response(self, client, mocker, upstream):
+        mocker.patch(
+            "main.integrations.ip_geolocation.IpGeolocationClient.get_ip_geolocation",
+            return_value={"city": "London", "country_name": "United Kingdom"},
+        )
+        url = reverse("main:api-geolocation")
+
+        for _ in range(2):
+            assert client.get(url, {"ip": "8.8.8.8"}).status_code == 200
+        assert upstream.in_flight == 0
+
+    def test_server_errors_cut_the_limit(self, client, mocker, upstream):
+        upstream.limit = 2.0
+        mocker.patch(
+            "main.integrations.ip_geolocation.IpGeolocationClient.get_ip_geolocation",
+            side_effect=Exception("upstream down"),
+        )
+        client.raise_request_exception = False
+
+        response = client.get(reverse("main:api-geolocation"), {"ip": "8.8.8.8"})
+
+        assert response.status_code == 500
+        assert upstream.limit == pytest.approx(1.8)
+        assert upstream.in_flight == 0
+
+    def test_unlimited_views(self, client, settings):
+        settings.ADMISSION_LIMITS = {
+            **settings.ADMISSION_LIMITS,
+            "default": CONFIG._replace(limit=1, queue=0)._asdict(),
+        }
+        admission.get_limiter("default").acquire()
+
+        assert client.get(reverse("main:api-results")).status_code == 503
+        assert client.get(reverse("main:metrics")).status_code == 200
@@ -0,0 +1,270 @@
+import datetime
+import gzip
+import json
+from importlib import import_module
+
+import pytest
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.migrations.state import ProjectState
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from main import archive, partitions
+from main.models import BloodTestResults, CustomToken
+
+from .factories import BloodTestResultsFactory, UserFactory
+
+
+@pytest.fixture(autouse=True)
+def archive_dir(settings, tmp_path):
+    settings.RESULT_ARCHIVE_DIR = str(tmp_path)
+    settings.RESULT_RETENTION_MONTHS = 24
+    return tmp_path
+
+
+def at(year, month, day=15):
+    return datetime.datetime(year, month, day, 12, tzinfo=datetime.timezone.utc)
+
+
+def make_result(user, timestamp, **kwargs):
+    result = BloodTestResultsFactory(user=user, **kwargs)
+    # timestamp is auto_now_add, so backdate it afterwards.
+    BloodTestResults.objects.filter(pk=result.pk).update(timestamp=timestamp)
+    result.refresh_from_db()
+    return result
+
+
+class TestMonths:
+    def test_add_months(self):
+        assert partitions.add_months(datetime.date(2023, 11, 1), 3) == datetime.date(
+            2024, 2, 1
+        )
+        assert partitions.add_months(datetime.date(2023, 1, 1), -1) == datetime.date(
+            2022, 12, 1
+        )
+
+    def test_partition_for(self):
+        partition = partitions.partition_for(datetime.date(2024, 2, 17))
+        assert partition == partitions.Partition(
+            "main_bloodtestresults_p202402",
+            datetime.date(2024, 2, 1),
+            datetime.date(2024, 3, 1),
+        )
+
+    def test_retention_cutoff(self):
+        assert archive.retention_cutoff(datetime.date(2024, 5, 20)) == datetime.date(
+            2022, 5, 1
+        )
+
+
+@pytest.mark.django_db
+class TestArchive:
+    @pytest.fixture()
+    def history(self):
+        now = timezone.now()
+        alice, bob = UserFactory(), UserFactory()
+        return {
+            "alice": alice,
+            "bob": bob,
+            "old": [
+                make_result(alice, at(2019, 3), results={"HDL": 1}),
+                make_result(bob, at(2019, 3, 20)),
+                make_result(alice, at(2019, 5), results={"HDL": 2}),
+            ],
+            "recent": [make_result(alice, now - datetime.timedelta(days=3))],
+        }
+
+    def test_months_to_archive(self, history):
+        months = archive.months_to_archive("default", datetime.date(2019, 6, 1))
+        assert months == [
+            datetime.date(2019, 3, 1),
+            datetime.date(2019, 5, 1),
+        ]
+
+    def test_archive_results_moves_old_months(self, history, archive_dir):
+        call_command("archive_results")
+
+        assert list(BloodTestResults.objects.all()) == history["recent"]
+        names = sorted(path.name for path in archive_dir.iterdir())
+        assert names == [
+            "results-default-2019-03.index.json",
+            "results-default-2019-03.ndjson.gz",
+            "results-default-2019-05.index.json",
+            "results-default-2019-05.ndjson.gz",
+        ]
+        # Concatenated gzip members make up a plain .ndjson.gz file.
+        rows = [
+            json.loads(line)
+            for line in gzip.decompress(
+                (archive_dir / "results-default-2019-03.ndjson.gz").read_bytes()
+            ).splitlines()
+        ]
+        assert sorted(row["id"] for row in rows) == sorted(
+            r.pk for r in history["old"][:2]
+        )
+        # Flagged when read, against the reference ranges of the day.
+        assert not any("flags" in row for row in rows)
+
+    def test_archived_results(self, history):
+        call_command("archive_results")
+
+        rows = archive.archived_results(history["alice"].pk)
+        assert [row["id"] for row in rows] == [
+            history["old"][0].pk,
+            history["old"][2].pk,
+        ]
+        assert rows[0]["results"] == {"HDL": 1}
+        assert rows[0]["user"] == history["alice"].pk
+        assert archive.archived_results(UserFactory().pk) == []
+
+    def test_archiving_twice_appends(self, history):
+        call_command("archive_results")
+        late = make_result(history["alice"], at(2019, 3, 30))
+
+        call_command("archive_results")
+
+        assert [row["id"] for row in archive.archived_results(history["alice"].pk)] == [
+            history["old"][0].pk,
+            late.pk,
+            history["old"][2].pk,
+        ]
+
+    def test_retrying_after_a_failed_delete_writes_nothing_twice(
+        self, history, archive_dir, mocker
+    ):
+        alice = history["alice"]
+        failing = mocker.patch.object(
+            archive.result_summaries, "record_archived", side_effect=RuntimeError
+        )
+        with pytest.raises(RuntimeError):
+            call_command("archive_results")
+        assert BloodTestResults.objects.filter(timestamp__lt=at(2019, 4)).count() == 2
+        failing.side_effect = None
+
+        call_command("archive_results")
+
+        assert list(BloodTestResults.objects.all()) == history["recent"]
+        assert [row["id"] for row in archive.archived_results(alice.pk)] == [
+            history["old"][0].pk,
+            history["old"][2].pk,
+        ]
+        lines = gzip.decompress(
+            (archive_dir / "results-default-2019-03.ndjson.gz").read_bytes()
+        ).splitlines()
+        assert len(lines) == 2
+
+    def test_archives_a_chunk_at_a_time(self, history):
+        alice = history["alice"]
+        third = make_result(alice, at(2019, 3, 25))
+
+        assert archive.archive_month("default", datetime.date(2019, 3, 1), 1) == 3
+
+        assert not BloodTestResults.objects.filter(timestamp__lt=at(2019, 4)).exists()
+        index = archive._load_index(
+            archive.index_path("default", datetime.date(2019, 3, 1))
+        )
+        # One gzip member per chunk.
+        assert len(index[str(alice.pk)]) == 2
+        assert [row["id"] for row in archive.archived_results(alice.pk)] == [
+            history["old"][0].pk,
+            third.pk,
+        ]
+
+    def test_archives_whole_partitions(self, history):
+        if not partitions.is_partitioned(connection):
+            pytest.skip("Needs the results table partitioned, on Postgres 11+.")
+        partition = partitions.partition_for(datetime.date(2019, 3, 1))
+        partitions.create_partition(partition, using="default")
+
+        call_command("archive_results")
+
+        assert partition not in partitions.monthly_partitions("default")
+        assert [row["id"] for row in archive.archived_results(history["bob"].pk)] == [
+            history["old"][1].pk
+        ]
+
+    def test_dry_run(self, history):
+        call_command("archive_results", dry_run=True)
+        assert BloodTestResults.objects.count() == 4
+
+    def test_list_includes_archived_on_request(self, history):
+        call_command("archive_results")
+        client = APIClient()
+        token = CustomToken.objects.create(key="a" * 32, user=history["alice"])
+        client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+
+        response = client.get(reverse("main:api-results"))
+        assert [row["id"] for row in response.json()] == [history["recent"][0].pk]
+
+        response = client.get(reverse("main:api-results"), {"include_archived": "true"})
+        assert [row["id"] for row in response.json()] == [
+            history["old"][0].pk,
+            history["old"][2].pk,
+            history["recent"][0].pk,
+        ]
+        assert all("flags" in row for row in response.json())
+
+    def test_create_result_partitions_needs_postgres(self):
+        if partitions.is_partitioned(connection):
+            pytest.skip("The results table is partitioned here.")
+        with pytest.raises(CommandError, match="Postgres 11"):
+            call_command("create_result_partitions")
+
+
+@pytest.mark.django_db
+class TestPartitionMigration:
+    migration = import_module("main.migrations.0007_partition_bloodtestresults")
+
+    @pytest.fixture(autouse=True)
+    def partitioned(self):
+        if not partitions.is_partitioned(connection):
+            pytest.skip("Needs the results table partitioned, on Postgres 11+.")
+
+    def migrate(self, operation):
+        with connection.schema_editor() as editor:
+            operation(ProjectState().apps, editor)
+
+    def partition_of(self, pk):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT tableoid::regclass::text FROM main_bloodtestresults"
+                " WHERE id = %s",
+                [pk],
+            )
+            return cursor.fetchone()[0]
+
+    def test_round_trip_keeps_rows_and_indexes(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT indexname FROM pg_indexes WHERE tablename = %s",
+                [partitions.TABLE],
+            )
+            indexes = {row[0] for row in cursor.fetchall()}
+        results = [BloodTestResultsFactory() for _ in range(3)]
+
+        self.migrate(self.migration.unpartition)
+        assert not partitions.is_partitioned(connection)
+        assert BloodTestResults.objects.count() == 3
+        self.migrate(self.migration.partition)
+
+        assert partitions.is_partitioned(connection)
+        # The old table became the DEFAULT partition, rows and all.
+        assert self.partition_of(results[0].pk) == partitions.DEFAULT_PARTITION
+        assert sorted(BloodTestResults.objects.values_list("pk", flat=True)) == [
+            r.pk for r in results
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT indexname FROM pg_indexes WHERE tablename = %s",
+                [partitions.TABLE],
+            )
+            assert {row[0] for row in cursor.fetchall()} == indexes
+            # Each of the parent's indexes adopted one of the partition's.
+            cursor.execute(
+                "SELECT count(*) FROM pg_indexes WHERE tablename = %s",
+                [partitions.DEFAULT_PARTITION],
+            )
+            assert cursor.fetchone()[0] == len(indexes)
+        assert BloodTestResultsFactory().pk > results[-1].pk
@@ -0,0 +1,105 @@
+import threading
+import time
+
+import pytest
+from django.core.cache import cache as django_cache
+
+from main import metrics
+from main.cache import Cache
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    django_cache.clear()
+    yield
+    django_cache.clear()
+
+
+def hits(namespace, result):
+    return (
+        metrics.get_registry().get_sample_value(
+            "numan_cache_requests_total", {"cache": namespace, "result": result}
+        )
+        or 0
+    )
+
+
+class TestCache:
+    def test_namespaced_and_versioned(self):
+        v1 = Cache("labs")
+        v2 = Cache("labs", version=2)
+        other = Cache("users")
+        v1.set("GB", ["lab"])
+
+        assert v1.get("GB") == ["lab"]
+        assert v2.get("GB") is None
+        assert other.get("GB") is None
+
+    def test_expiry(self, mocker):
+        cache = Cache("expiring", timeout=10)
+        cache.set("key", 1)
+        mocker.patch("main.cache.time.time", return_value=time.time() + 11)
+
+        assert cache.get("key", "gone") == "gone"
+
+    def test_bulk(self):
+        cache = Cache("bulk")
+        cache.set_many({"a": 1, "b": 2})
+
+        assert cache.get_many(["a", "b", "c"]) == {"a": 1, "b": 2}
+        cache.delete_many(["a"])
+        assert cache.get_many(["a", "b"]) == {"b": 2}
+
+    def test_hit_ratio_metrics(self):
+        cache = Cache("counted")
+        hit, miss = hits("counted", "hit"), hits("counted", "miss")
+
+        cache.get("key")
+        cache.set("key", 1)
+        cache.get("key")
+
+        assert hits("counted", "hit") == hit + 1
+        assert hits("counted", "miss") == miss + 1
+
+
+class TestGetOrSet:
+    def test_computes_once_on_concurrent_miss(self):
+        cache = Cache("stampede")
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return "value"
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(
+                    cache.get_or_set("key", compute, poll_interval=0.01)
+                )
+            )
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert results == ["value"] * 8
+        assert len(calls) == 1
+
+    def test_stale_value_served_while_refreshing(self, mocker):
+        cache = Cache("stale", timeout=10, stale_grace=60)
+        cache.set("key", "old")
+        now = time.time() + 11
+        mocker.patch("main.cache.time.time", return_value=now)
+
+        # Another caller holds the refresh lock: we get the stale value.
+        assert cache._acquire("key")
+        assert cache.get_or_set("key", lambda: "new") == "old"
+        cache._release("key")
+
+        # Nobody is refreshing: we refresh it.
+        assert cache.get_or_set("key", lambda: "new") == "new"
+        assert cache.get("key") == "new"
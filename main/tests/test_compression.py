@@ -0,0 +1,110 @@
+import gzip
+
+import brotli
+import pytest
+import zstandard
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from main import compression
+from main.models import CustomToken
+
+from .factories import BloodTestResultsFactory, LabFactory, UserFactory
+
+DECOMPRESS = {
+    compression.GZIP: gzip.decompress,
+    compression.BROTLI: brotli.decompress,
+    compression.ZSTD: lambda data: zstandard.ZstdDecompressor()
+    .decompressobj()
+    .decompress(data),
+}
+
+
+@pytest.fixture()
+def client():
+    user = UserFactory()
+    client = APIClient()
+    token = CustomToken.objects.create(key="c" * 32, user=user)
+    client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+    client.user = user
+    return client
+
+
+class TestNegotiate:
+    @pytest.mark.parametrize(
+        "header, expected",
+        [
+            ("", None),
+            ("gzip", "gzip"),
+            ("gzip, deflate, br", "br"),
+            ("gzip, br, zstd", "zstd"),
+            ("gzip;q=1, br;q=0.5", "gzip"),
+            ("br;q=0, *", "zstd"),
+            ("*;q=0.1, gzip;q=0", "zstd"),
+            ("identity", None),
+        ],
+    )
+    def test_negotiate(self, header, expected):
+        assert compression.negotiate(header) == expected
+
+    @pytest.mark.parametrize("encoding", compression.ENCODINGS)
+    def test_stream_flushes_every_chunk(self, encoding):
+        chunks = [f"chunk {i}\n".encode() * 50 for i in range(5)]
+
+        compressed = list(compression.compress_stream(chunks, encoding))
+
+        assert all(compressed[:5])
+        assert DECOMPRESS[encoding](b"".join(compressed)) == b"".join(chunks)
+
+
+@pytest.mark.django_db
+class TestCompressionMiddleware:
+    @pytest.mark.parametrize("encoding", compression.ENCODINGS)
+    def test_compresses_results(self, client, encoding):
+        BloodTestResultsFactory.create_batch(20, user=client.user)
+        plain = client.get(reverse("main:api-results"))
+
+        response = client.get(
+            reverse("main:api-results"), HTTP_ACCEPT_ENCODING=encoding
+        )
+
+        assert response["Content-Encoding"] == encoding
+        assert "Accept-Encoding" in response["Vary"]
+        assert int(response["Content-Length"]) < len(plain.content)
+        assert DECOMPRESS[encoding](response.content) == plain.content
+
+    @pytest.mark.parametrize("media_type", ["application/msgpack", "application/cbor"])
+    def test_compresses_binary_formats(self, client, media_type):
+        BloodTestResultsFactory.create_batch(20, user=client.user)
+        plain = client.get(reverse("main:api-results"), HTTP_ACCEPT=media_type)
+
+        response = client.get(
+            reverse("main:api-results"),
+            HTTP_ACCEPT=media_type,
+            HTTP_ACCEPT_ENCODING=compression.GZIP,
+        )
+
+        assert response["Content-Type"] == plain["Content-Type"]
+        assert response["Content-Encoding"] == compression.GZIP
+        assert gzip.decompress(response.content) == plain.content
+
+    def test_small_responses_are_left_alone(self, client):
+        response = client.get(reverse("main:api-results"), HTTP_ACCEPT_ENCODING="gzip")
+
+        assert response.content == b"[]"
+        assert not response.has_header("Content-Encoding")
+
+    def test_lab_list_served_precompressed(self, client, mocker):
+        LabFactory.create_batch(10, country="GB")
+        url = reverse("main:api-lab", kwargs={"country": "GB"})
+        first = client.get(url, HTTP_ACCEPT_ENCODING="br")
+        compress = mocker.spy(compression, "compress")
+
+        again = client.get(url, HTTP_ACCEPT_ENCODING="br")
+        plain = client.get(url)
+
+        compress.assert_not_called()
+        assert again["Content-Encoding"] == "br"
+        assert again.content == first.content
+        assert brotli.decompress(again.content) == plain.content
+        assert len(plain.json()) == 10
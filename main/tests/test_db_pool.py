@@ -0,0 +1,236 @@
+import threading
+
+import pytest
+from django.db import OperationalError, connection
+
+from main import db_pool, metrics
+
+
+class FakeConnection:
+    def __init__(self):
+        self.healthy = True
+        self.in_transaction = False
+        self.closed = False
+
+    def rollback(self):
+        self.in_transaction = False
+
+
+def reset(connection):
+    if not connection.healthy:
+        raise Exception("connection lost")
+    connection.rollback()
+    return True
+
+
+def close(connection):
+    connection.closed = True
+
+
+def make_pool(**options):
+    return db_pool.ConnectionPool(
+        "test",
+        check=lambda connection: connection.healthy,
+        reset=reset,
+        close=close,
+        **{"size": 1, "max_overflow": 1, "timeout": 0.05, **options},
+    )
+
+
+class TestConnectionPool:
+    def test_reuses_returned_connections(self):
+        pool = make_pool()
+        first = pool.acquire(FakeConnection)
+        first.in_transaction = True
+        pool.release(first)
+
+        assert pool.acquire(FakeConnection) is first
+        assert not first.in_transaction
+
+    def test_overflow_closed_when_returned(self):
+        pool = make_pool()
+        first, overflow = pool.acquire(FakeConnection), pool.acquire(FakeConnection)
+
+        pool.release(overflow)
+        pool.release(first)
+
+        assert overflow.closed and not first.closed
+        assert pool.acquire(FakeConnection) is first
+
+    def test_times_out_when_exhausted(self):
+        pool = make_pool()
+        timeouts = metrics.DB_POOL_TIMEOUTS.labels(database="test")
+        before = timeouts._value.get()
+        pool.acquire(FakeConnection)
+        pool.acquire(FakeConnection)
+
+        with pytest.raises(db_pool.PoolTimeout):
+            pool.acquire(FakeConnection)
+        assert timeouts._value.get() == before + 1
+
+    def test_waiter_gets_a_returned_connection(self):
+        pool = make_pool(max_overflow=0, timeout=5)
+        first = pool.acquire(FakeConnection)
+        acquired = []
+        waiter = threading.Thread(
+            target=lambda: acquired.append(pool.acquire(FakeConnection))
+        )
+        waiter.start()
+
+        pool.release(first)
+        waiter.join()
+
+        assert acquired == [first]
+
+    def test_replaces_connections_the_server_dropped(self):
+        pool = make_pool()
+        first = pool.acquire(FakeConnection)
+        pool.release(first)
+        first.healthy = False
+
+        second = pool.acquire(FakeConnection)
+
+        assert second is not first and first.closed
+        assert pool._open == 1
+
+    def test_no_check_without_pre_ping(self):
+        pool = make_pool(pre_ping=False)
+        first = pool.acquire(FakeConnection)
+        pool.release(first)
+        first.healthy = False
+
+        assert pool.acquire(FakeConnection) is first
+
+    def test_recycles_old_connections(self, mocker):
+        clock = mocker.patch("main.db_pool.time.monotonic", return_value=100.0)
+        pool = make_pool(recycle=60)
+        first = pool.acquire(FakeConnection)
+        pool.release(first)
+
+        clock.return_value = 161.0
+        second = pool.acquire(FakeConnection)
+
+        assert second is not first and first.closed
+
+    def test_discards_connections_that_fail_to_reset(self):
+        pool = make_pool()
+        first = pool.acquire(FakeConnection)
+        first.healthy = False
+
+        pool.release(first)
+
+        assert first.closed
+        assert pool._open == 0
+
+    def test_failed_connect_frees_its_slot(self):
+        pool = make_pool(max_overflow=0)
+
+        def connect():
+            raise OSError("connection refused")
+
+        with pytest.raises(OSError):
+            pool.acquire(connect)
+        assert pool.acquire(FakeConnection)
+
+    def test_pools_are_shared_per_key(self):
+        options = {"check": bool, "reset": bool, "close": close}
+        pool = db_pool.get_pool("test:a", "test", **options)
+        assert db_pool.get_pool("test:a", "test", **options) is pool
+        assert db_pool.get_pool("test:b", "test", **options) is not pool
+
+        db_pool.close_pools("test")
+
+        assert db_pool.get_pool("test:a", "test", **options) is not pool
+        db_pool.close_pools("test")
+
+
+# Lets the wrappers connect; they connect to a mock, not the test database.
+@pytest.mark.django_db
+class TestPooledBackend:
+    @pytest.fixture()
+    def wrapper(self, mocker):
+        from django.db.utils import load_backend
+        from psycopg2 import extensions
+
+        def connect(conn_params):
+            connection = mocker.MagicMock(closed=0)
+            connection.info.server_version = 150000
+            connection.info.transaction_status = extensions.TRANSACTION_STATUS_INTRANS
+            return connection
+
+        mocker.patch(
+            "django.db.backends.postgresql.base.DatabaseWrapper.get_new_connection",
+            side_effect=connect,
+        )
+        settings_dict = {
+            "ENGINE": "main.backends.pooled_postgresql",
+            "NAME": "numan",
+            "USER": "numan",
+            "PASSWORD": "",
+            "HOST": "db",
+            "PORT": 5432,
+            "OPTIONS": {},
+            "TIME_ZONE": None,
+            "CONN_MAX_AGE": 0,
+            "CONN_HEALTH_CHECKS": False,
+            "AUTOCOMMIT": True,
+            "ATOMIC_REQUESTS": False,
+            "POOL": {"SIZE": 1, "MAX_OVERFLOW": 0, "TIMEOUT": 0.05},
+        }
+        backend = load_backend(settings_dict["ENGINE"])
+        yield lambda: backend.DatabaseWrapper(dict(settings_dict), "pooled")
+        db_pool.close_pools("pooled")
+
+    def test_connections_go_back_to_the_pool(self, wrapper):
+        first, second = wrapper(), wrapper()
+        first.ensure_connection()
+        raw = first.connection
+
+        with pytest.raises(OperationalError, match="No connection to pooled free"):
+            second.ensure_connection()
+        first.close()
+        raw.rollback.assert_called_once()
+        second.ensure_connection()
+
+        assert second.connection is raw
+
+
+@pytest.mark.django_db
+class TestPooledBackendOnPostgres:
+    @pytest.fixture()
+    def wrapper(self):
+        if connection.vendor != "postgresql":
+            pytest.skip("Needs the tests to run on Postgres.")
+        from django.db.utils import load_backend
+
+        settings_dict = {
+            **connection.settings_dict,
+            "ENGINE": "main.backends.pooled_postgresql",
+            "CONN_MAX_AGE": 0,
+            "CONN_HEALTH_CHECKS": False,
+            "POOL": {"SIZE": 1, "MAX_OVERFLOW": 0, "TIMEOUT": 0.05},
+        }
+        backend = load_backend(settings_dict["ENGINE"])
+        yield lambda: backend.DatabaseWrapper(dict(settings_dict), "pooled_pg")
+        db_pool.close_pools("pooled_pg")
+
+    def backend_pid(self, wrapper):
+        with wrapper.cursor() as cursor:
+            cursor.execute("SELECT pg_backend_pid()")
+            return cursor.fetchone()[0]
+
+    def test_reuses_the_server_connection(self, wrapper):
+        first = wrapper()
+        pid = self.backend_pid(first)
+        # Left in the middle of a transaction, which the pool rolls back.
+        first.set_autocommit(False)
+        with first.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        first.close()
+
+        second = wrapper()
+        assert self.backend_pid(second) == pid
+        assert second.get_autocommit()
+        with pytest.raises(OperationalError, match="No connection to pooled_pg"):
+            wrapper().ensure_connection()
+        second.close()
@@ -0,0 +1,209 @@
+import asyncio
+import threading
+
+import fakeredis
+import pytest
+from asgiref.sync import async_to_sync, sync_to_async
+from django.db import transaction
+from django.test import AsyncClient
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from main import events, viewsets
+from main.models import CustomToken
+
+from .factories import BloodTestResultsFactory, LabFactory, UserFactory
+
+
+def event(user_id, pk, event_type=events.EVENT_READY):
+    return events.Event("", user_id, event_type, {"id": pk})
+
+
+async def read(stream, count):
+    return [await asyncio.wait_for(stream.__anext__(), 1) for _ in range(count)]
+
+
+class TestEvents:
+    def test_encode(self):
+        assert events.Event("1", 7, "result.ready", {"id": 3}).encode() == (
+            'id: 1\nevent: result.ready\ndata: {"id": 3}\n\n'
+        )
+
+    def test_missed_returns_events_after_last_id(self):
+        first, second, other = events.send([event(1, 10), event(1, 11), event(2, 12)])
+
+        assert first.id < second.id < other.id
+        assert events.missed(1, first.id) == [second]
+        assert events.missed(1, "garbage") == [first, second]
+
+    def test_replay_buffer_is_bounded(self, settings):
+        settings.EVENTS_REPLAY_SIZE = 2
+        sent = [events.send([event(1, pk)])[0] for pk in range(3)]
+
+        assert events.missed(1, "0") == sent[1:]
+
+    def test_stream_replays_then_follows_live_events(self):
+        [missed] = events.send([event(1, 10)])
+
+        async def scenario():
+            stream = events.stream(1, last_event_id="0", heartbeat=0.05, duration=5)
+            retry, replayed = await read(stream, 2)
+            assert events.hub.subscribers(1) == 1
+            # Published while the replay was read, so it's queued too.
+            events.hub.dispatch(missed)
+            # Neither that repeat nor another user's event.
+            [_, live] = events.send([event(2, 12), event(1, 11)])
+            assert await read(stream, 1) == [live.encode()]
+            assert await read(stream, 1) == [": keep-alive\n\n"]
+            await stream.aclose()
+            return retry, replayed
+
+        retry, replayed = async_to_sync(scenario)()
+
+        assert retry.startswith("retry: ")
+        assert replayed == missed.encode()
+        assert events.hub.subscribers(1) == 0
+
+    def test_stream_ends_after_duration(self):
+        async def scenario():
+            return [chunk async for chunk in events.stream(1, duration=0.05)]
+
+        assert len(async_to_sync(scenario)()) == 1
+
+
+class TestRedisReplay:
+    @pytest.fixture()
+    def client(self, mocker):
+        broker = events.RedisBroker("redis://cache:6379/1")
+        broker._client = fakeredis.FakeRedis()
+        mocker.patch.object(events, "_broker", broker)
+        return broker._client
+
+    def test_replay_from_redis(self, client, settings):
+        settings.EVENTS_REPLAY_SIZE = 2
+        sent = events.send([event(1, 0)])
+        sent += events.send([event(1, 1), event(1, 2), event(2, 9)])[:2]
+
+        assert [item.id for item in sent] == [f"{n:020d}" for n in (1, 2, 3)]
+        assert events.missed(1, "0") == sent[1:]
+        assert events.missed(1, sent[1].id) == sent[2:]
+        assert (
+            0
+            < client.ttl(events.REPLAY_KEY.format(1))
+            <= (settings.EVENTS_REPLAY_SECONDS)
+        )
+
+    def test_concurrent_publishers_keep_every_event(self, client):
+        sent = []
+        threads = [
+            threading.Thread(
+                target=lambda pk=pk: [
+                    sent.extend(events.send([event(1, pk * 10 + i)])) for i in range(5)
+                ]
+            )
+            for pk in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        buffered = events.missed(1, "0")
+        assert sorted(buffered) == sorted(sent) and len(sent) == 40
+        # Buffered in id order, whichever publisher got there first.
+        assert [item.id for item in buffered] == sorted(item.id for item in sent)
+
+
+@pytest.mark.django_db
+class TestPublish:
+    def test_published_on_commit_only(self, django_capture_on_commit_callbacks):
+        order = BloodTestResultsFactory(ready=True)
+        with django_capture_on_commit_callbacks(execute=True):
+            with transaction.atomic():
+                events.publish([order], events.EVENT_READY)
+                assert events.missed(order.user_id, "0") == []
+
+        [published] = events.missed(order.user_id, "0")
+        assert published.type == events.EVENT_READY
+        assert published.data == {"id": order.pk, "ready": True}
+
+    def test_events_committed_out_of_order_are_all_streamed(
+        self, django_capture_on_commit_callbacks
+    ):
+        first, second = BloodTestResultsFactory(), BloodTestResultsFactory()
+        user_id = first.user_id
+        second.user_id = user_id
+        # Two transactions: the one that published first commits last.
+        with django_capture_on_commit_callbacks() as callbacks:
+            events.publish([first], events.EVENT_READY)
+            events.publish([second], events.EVENT_READY)
+
+        async def scenario():
+            stream = events.stream(user_id, heartbeat=5, duration=5)
+            await read(stream, 1)
+            for callback in reversed(callbacks):
+                await sync_to_async(callback)()
+            chunks = await read(stream, 2)
+            await stream.aclose()
+            return chunks
+
+        chunks = async_to_sync(scenario)()
+
+        delivered = events.missed(user_id, "0")
+        assert chunks == [item.encode() for item in delivered]
+        assert [item.data["id"] for item in delivered] == [second.pk, first.pk]
+        # A client that saw only the first one to commit gets the other.
+        assert events.missed(user_id, delivered[0].id) == delivered[1:]
+
+    def test_create_endpoint_publishes(self, django_capture_on_commit_callbacks):
+        user = UserFactory()
+        client = APIClient()
+        token = CustomToken.objects.create(key="e" * 32, user=user)
+        client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+
+        with django_capture_on_commit_callbacks(execute=True):
+            response = client.post(
+                reverse("main:api-results"),
+                {"lab": LabFactory().pk, "blood_test": ["HDL"]},
+                format="json",
+            )
+
+        [created] = events.missed(user.pk, "0")
+        assert created.type == events.EVENT_CREATED
+        assert created.data["id"] == response.json()["id"]
+
+
+@pytest.mark.django_db
+class TestResultEventsView:
+    def test_streams_missed_events(self, settings, mocker):
+        settings.EVENTS_STREAM_SECONDS = 0.05
+        user = UserFactory()
+        token = CustomToken.objects.create(key="f" * 32, user=user)
+        [missed] = events.send([event(user.pk, 10)])
+        close_all = mocker.spy(viewsets.connections, "close_all")
+
+        async def fetch():
+            response = await AsyncClient().get(
+                reverse("main:api-results-events"),
+                {"token": token.key},
+                headers={"Last-Event-ID": "0"},
+            )
+            body = [chunk async for chunk in response.streaming_content]
+            return response, b"".join(body).decode()
+
+        response, body = async_to_sync(fetch)()
+
+        assert response["Content-Type"] == "text/event-stream"
+        assert response["Cache-Control"] == "no-cache"
+        assert missed.encode() in body
+        # Given back once the user is known, not when the stream ends.
+        close_all.assert_called_once()
+
+    def test_requires_a_token(self):
+        async def fetch():
+            return await AsyncClient().get(
+                reverse("main:api-results-events"), {"token": "nope"}
+            )
+
+        response = async_to_sync(fetch)()
+        assert response.status_code == 401
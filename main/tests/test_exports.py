@@ -0,0 +1,145 @@
+import csv
+import gzip
+import io
+import json
+
+import pytest
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from main import exports
+
+from .factories import BloodTestResultsFactory, LabFactory, UserFactory
+
+
+@pytest.fixture()
+def results():
+    lab = LabFactory()
+    return [
+        BloodTestResultsFactory(results={"HDL": 50 + i, "LDL": 20}, ready=True, lab=lab)
+        for i in range(5)
+    ] + [
+        BloodTestResultsFactory(results={"values": {"CBC": 7}}, ready=False, lab=lab),
+        BloodTestResultsFactory(results={}, ready=False),
+    ]
+
+
+def ndjson_rows(data: bytes):
+    return [json.loads(line) for line in gzip.decompress(data).splitlines()]
+
+
+@pytest.mark.django_db
+class TestExport:
+    def test_flattens_results(self, results):
+        data = b"".join(
+            chunk.data
+            for chunk in exports.export(
+                exports.export_queryset(), exports.FORMAT_NDJSON, chunk_size=2
+            )
+        )
+        rows = ndjson_rows(data)
+
+        assert [row["id"] for row in rows] == [r.pk for r in results]
+        assert rows[0]["result_HDL"] == 50
+        assert rows[0]["result_CBC"] is None
+        assert rows[0]["flag_HDL"] == "N"
+        assert rows[0]["flag_CBC"] is None
+        assert rows[5]["result_CBC"] == 7
+
+    def test_filters(self, results):
+        queryset = exports.export_queryset(
+            lab=results[0].lab_id, ready=False, since=timezone.now().replace(year=2000)
+        )
+        assert [row[0] for row in queryset] == [results[5].pk]
+
+    def test_csv(self, results):
+        data = b"".join(
+            chunk.data
+            for chunk in exports.export(
+                exports.export_queryset(), exports.FORMAT_CSV, chunk_size=3
+            )
+        )
+        rows = list(csv.DictReader(io.StringIO(gzip.decompress(data).decode())))
+
+        assert len(rows) == len(results)
+        assert rows[1]["result_HDL"] == "51"
+
+    def test_parquet(self, results):
+        pq = pytest.importorskip("pyarrow.parquet")
+        data = b"".join(
+            chunk.data
+            for chunk in exports.export(
+                exports.export_queryset(), exports.FORMAT_PARQUET, chunk_size=3
+            )
+        )
+        table = pq.read_table(io.BytesIO(data))
+
+        assert table.num_rows == len(results)
+        assert table.column("result_HDL").to_pylist()[:2] == [50.0, 51.0]
+        assert pq.ParquetFile(io.BytesIO(data)).num_row_groups == 3
+
+    def test_parquet_without_header(self):
+        with pytest.raises(ValueError, match="can't continue"):
+            exports.export(
+                exports.export_queryset(), exports.FORMAT_PARQUET, header=False
+            )
+
+
+@pytest.mark.django_db
+class TestExportCommand:
+    def test_resume_from_checkpoint(self, results, tmp_path, mocker):
+        output = str(tmp_path / "results.ndjson.gz")
+        # Interrupt the export after the first chunk has been checkpointed.
+        real_export = exports.export
+
+        def interrupted(*args, **kwargs):
+            chunks = real_export(*args, **kwargs)
+            yield next(chunks)
+            raise KeyboardInterrupt
+
+        mocker.patch("main.exports.export", side_effect=interrupted)
+        with pytest.raises(KeyboardInterrupt):
+            call_command("export_results", output, "--chunk-size", "3")
+        mocker.stopall()
+
+        call_command("export_results", output, "--chunk-size", "3", "--resume")
+
+        with open(output, "rb") as f:
+            rows = ndjson_rows(f.read())
+        assert [row["id"] for row in rows] == [r.pk for r in results]
+        assert not (tmp_path / "results.ndjson.gz.checkpoint").exists()
+
+
+@pytest.mark.django_db
+class TestExportEndpoint:
+    def test_admin_only(self):
+        client = APIClient()
+        client.force_authenticate(user=UserFactory())
+        response = client.get(reverse("main:api-results-export"))
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    def test_streams_export(self, results):
+        client = APIClient()
+        client.force_authenticate(user=UserFactory(is_staff=True))
+
+        response = client.get(
+            reverse("main:api-results-export"),
+            {"file_format": "ndjson", "ready": "true"},
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.streaming
+        assert "results.ndjson.gz" in response["Content-Disposition"]
+        rows = ndjson_rows(b"".join(response.streaming_content))
+        assert [row["id"] for row in rows] == [r.pk for r in results[:5]]
+
+    def test_invalid_format(self):
+        client = APIClient()
+        client.force_authenticate(user=UserFactory(is_staff=True))
+        response = client.get(
+            reverse("main:api-results-export"), {"file_format": "xls"}
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
@@ -0,0 +1,86 @@
+import datetime
+import io
+
+import numpy as np
+import pytest
+from django.core.management import call_command
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from main import flagging
+from main.constants.blood_tests import SEX_ANY, SEX_FEMALE, SEX_MALE
+from main.models import CustomToken
+
+from .factories import BloodTestResultsFactory, UserFactory
+
+
+class TestFlag:
+    @pytest.mark.parametrize(
+        "test, value, sex, age, expected",
+        [
+            ("LDL", 90, SEX_ANY, None, "N"),
+            ("LDL", 131, SEX_ANY, None, "H"),
+            ("LDL", 120, SEX_ANY, 15, "H"),
+            ("HDL", 45, SEX_FEMALE, 40, "L"),
+            ("HDL", 45, SEX_MALE, 40, "N"),
+            ("HDL", 42, SEX_ANY, None, "N"),
+            ("HDL", 42, SEX_MALE, 10, "L"),
+            ("HDL", "not a number", SEX_ANY, None, None),
+            ("CBC", 7, SEX_ANY, None, None),
+        ],
+    )
+    def test_flag_value(self, test, value, sex, age, expected):
+        assert flagging.flag_value(test, value, sex, age) == expected
+
+    def test_vectorized_agrees_with_flag_value(self):
+        rng = np.random.default_rng(1)
+        size = 5000
+        tests = rng.integers(0, len(flagging.TEST_CODES), size)
+        values = rng.normal(80, 40, size)
+        values[::17] = np.nan
+        sexes = rng.integers(0, 3, size).astype(np.int8)
+        ages = rng.uniform(0, 90, size)
+        ages[::11] = np.nan
+        sex_codes = [SEX_ANY, SEX_FEMALE, SEX_MALE]
+
+        flags = flagging.flag(tests, values, sexes, ages)
+
+        assert [flagging.FLAG_LABELS[f] for f in flags.tolist()] == [
+            flagging.flag_value(
+                flagging.TEST_CODES[tests[i]],
+                float(values[i]),
+                sex_codes[sexes[i]],
+                None if np.isnan(ages[i]) else float(ages[i]),
+            )
+            for i in range(size)
+        ]
+
+    def test_flag_results(self):
+        assert flagging.flag_results(
+            [{"HDL": 30, "LDL": 200, "XYZ": 1}, {}, {"HDL": "60"}],
+            sexes=[SEX_MALE, SEX_ANY, SEX_FEMALE],
+            ages=[50, np.nan, 50],
+        ) == [{"HDL": "L", "LDL": "H"}, {}, {"HDL": "N"}]
+
+
+@pytest.mark.django_db
+class TestFlaggedResults:
+    def test_results_list_carries_flags(self):
+        user = UserFactory(sex=SEX_FEMALE, date_of_birth=datetime.date(1980, 1, 1))
+        BloodTestResultsFactory(user=user, results={"HDL": 45, "LDL": 100})
+        BloodTestResultsFactory(user=user, results={"HDL": None})
+        client = APIClient()
+        token = CustomToken.objects.create(key="d" * 32, user=user)
+        client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+
+        response = client.get(reverse("main:api-results"))
+
+        assert [row["flags"] for row in response.json()] == [
+            {"HDL": "L", "LDL": "N"},
+            {"HDL": None},
+        ]
+
+    def test_benchmark_command(self):
+        out = io.StringIO()
+        call_command("benchmark_flagging", values=10_000, loop_values=1000, stdout=out)
+        assert "Speedup" in out.getvalue()
@@ -0,0 +1,188 @@
+import io
+import json
+
+import pytest
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from main import ingestion
+from main.models import CustomToken
+
+from .factories import BloodTestResultsFactory, LabFactory, UserFactory
+
+
+@pytest.fixture()
+def lab():
+    return LabFactory()
+
+
+@pytest.fixture()
+def orders(lab):
+    return [
+        BloodTestResultsFactory(lab=lab, results={"HDL": None, "LDL": None})
+        for _ in range(3)
+    ]
+
+
+def csv_file(rows):
+    return "order_id,analyte,value\n" + "".join(
+        f"{order_id},{analyte},{value}\n" for order_id, analyte, value in rows
+    )
+
+
+class TestParse:
+    def test_csv(self):
+        records = list(
+            ingestion.parse_csv(
+                io.StringIO(csv_file([(1, "HDL", "87"), (1, "ldl", "2.5")]))
+            )
+        )
+        assert records == [
+            ingestion.Observation(2, 1, "HDL", 87),
+            ingestion.Observation(3, 1, "LDL", 2.5),
+        ]
+
+    def test_csv_rejections(self):
+        records = list(
+            ingestion.parse_csv(
+                io.StringIO(
+                    csv_file([("x", "HDL", "1"), (1, "NOPE", "1"), (1, "HDL", "")])
+                )
+            )
+        )
+        assert records == [
+            ingestion.Rejection(2, "invalid order id"),
+            ingestion.Rejection(3, "unknown analyte"),
+            ingestion.Rejection(4, "missing value"),
+        ]
+
+    def test_csv_needs_header(self):
+        with pytest.raises(ValueError):
+            list(ingestion.parse_csv(io.StringIO("1,HDL,87\n")))
+
+    def test_hl7(self):
+        lines = io.StringIO(
+            "MSH|^~\\&|LAB\r\n"
+            "OBX|1|NM|HDL||87|mg/dL\r\n"
+            "ORC|NW|12\r\n"
+            "OBX|1|NM|HDL||87|mg/dL\r\n"
+            "OBX|2|ST|CBC||normal\r\n"
+            "OBX|3|NM|LDL\r\n"
+        )
+        assert list(ingestion.parse_hl7(lines)) == [
+            ingestion.Rejection(2, "observation outside an order"),
+            ingestion.Observation(4, 12, "HDL", 87),
+            ingestion.Observation(5, 12, "CBC", "normal"),
+            ingestion.Rejection(6, "missing columns"),
+        ]
+
+
+@pytest.mark.django_db
+class TestIngest:
+    def test_applies_results_in_batches(self, orders):
+        rows = [(order.pk, "HDL", 50 + i) for i, order in enumerate(orders)]
+        rows += [(order.pk, "LDL", 90) for order in orders] + [(999999, "HDL", 1)]
+        batches = []
+
+        report = ingestion.ingest(
+            io.StringIO(csv_file(rows)),
+            ingestion.FORMAT_CSV,
+            batch_size=2,
+            on_batch=lambda report: batches.append(report.line),
+        )
+
+        assert batches == [3, 5, 7, 8]
+        assert report.observations == 6
+        assert report.rejected == {"unknown order": 1}
+        orders[1].refresh_from_db()
+        assert orders[1].ready
+        assert orders[1].results == {"HDL": 51, "LDL": 90}
+
+    def test_only_the_labs_orders(self, lab, orders):
+        other = BloodTestResultsFactory(lab=LabFactory())
+        report = ingestion.ingest(
+            io.StringIO(csv_file([(orders[0].pk, "HDL", 1), (other.pk, "HDL", 1)])),
+            ingestion.FORMAT_CSV,
+            lab=lab,
+        )
+        assert report.observations == 1
+        assert report.rejected == {"order of another lab": 1}
+
+    def test_skips_lines_already_applied(self, orders):
+        rows = [(orders[0].pk, "HDL", 1), (orders[1].pk, "HDL", 2)]
+        report = ingestion.ingest(
+            io.StringIO(csv_file(rows)), ingestion.FORMAT_CSV, skip_lines=2
+        )
+        assert report.observations == 1
+        orders[0].refresh_from_db()
+        assert not orders[0].ready
+
+
+@pytest.mark.django_db
+class TestIngestCommand:
+    def test_resumes_from_checkpoint(self, orders, tmp_path):
+        path = tmp_path / "results.csv"
+        path.write_text(
+            csv_file(
+                [(order.pk, "HDL", 1) for order in orders] + [(orders[0].pk, "LDL", 5)]
+            )
+        )
+        checkpoint = tmp_path / "results.csv.checkpoint"
+        checkpoint.write_text(
+            json.dumps(
+                {
+                    "line": 3,
+                    "observations": 2,
+                    "orders": 2,
+                    "rejected": {"unknown analyte": 1},
+                    "seconds": 1.0,
+                }
+            )
+        )
+        out = io.StringIO()
+
+        call_command("ingest_results", str(path), resume=True, stdout=out)
+
+        assert not checkpoint.exists()
+        assert "Applied 4 results" in out.getvalue()
+        assert "1 unknown analyte" in out.getvalue()
+        orders[0].refresh_from_db()
+        assert orders[0].results == {"HDL": None, "LDL": 5}
+        orders[2].refresh_from_db()
+        assert orders[2].results["HDL"] == 1
+
+
+@pytest.mark.django_db
+class TestLabResultsIngestViewSet:
+    def test_upload(self, lab, orders):
+        client = APIClient()
+        token = CustomToken.objects.create(key="b" * 32, user=UserFactory(lab=lab))
+        client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+        upload = SimpleUploadedFile(
+            "results.hl7", f"ORC|NW|{orders[0].pk}\nOBX|1|NM|HDL||87|mg/dL\n".encode()
+        )
+
+        response = client.post(
+            reverse("main:api-lab-results"),
+            {"file": upload, "file_format": "hl7"},
+            format="multipart",
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["observations"] == 1
+        orders[0].refresh_from_db()
+        assert orders[0].results["HDL"] == 87
+
+    def test_bad_csv_header(self, lab):
+        client = APIClient()
+        token = CustomToken.objects.create(key="c" * 32, user=UserFactory(lab=lab))
+        client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+        response = client.post(
+            reverse("main:api-lab-results"),
+            {"file": SimpleUploadedFile("r.csv", b"a,b\n")},
+            format="multipart",
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
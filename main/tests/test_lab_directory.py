@@ -0,0 +1,208 @@
+import io
+import json
+
+import pytest
+from django.core.management import call_command
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from main import lab_directory
+from main.models import CustomToken, Lab
+
+from .factories import LabFactory, UserFactory
+
+HEADER = "name,address,address_2,city,post_code,country,email,number\n"
+
+
+def csv_file(*rows):
+    return io.StringIO(HEADER + "".join(",".join(row) + "\n" for row in rows))
+
+
+def lab_row(name, city="London", country="GB", email=None, number="0795033954"):
+    return (
+        name,
+        "1 Lab Street",
+        "",
+        city,
+        "SW1 9RH",
+        country,
+        email or f"{name.lower()}@example.com",
+        number,
+    )
+
+
+class TestParse:
+    def test_csv(self):
+        records = list(lab_directory.parse_csv(csv_file(lab_row("A", country="gb"))))
+        assert records == [
+            lab_directory.Row(
+                2,
+                {
+                    "name": "A",
+                    "address": "1 Lab Street",
+                    "address_2": "",
+                    "city": "London",
+                    "post_code": "SW1 9RH",
+                    "country": "GB",
+                    "email": "a@example.com",
+                    "number": "0795033954",
+                },
+            )
+        ]
+
+    def test_csv_needs_a_name_column(self):
+        with pytest.raises(ValueError):
+            list(lab_directory.parse_csv(io.StringIO("city\nLondon\n")))
+
+    def test_csv_rejections(self):
+        records = list(
+            lab_directory.parse_csv(
+                io.StringIO(HEADER + "A,street\n" + ",street,,,,,,\n")
+            )
+        )
+        assert records == [
+            lab_directory.Rejection(2, "wrong number of columns"),
+            lab_directory.Rejection(3, "missing name"),
+        ]
+
+    def test_ndjson(self):
+        lines = io.StringIO(
+            json.dumps({"name": "A", "city": "Leeds", "number": 123})
+            + "\n\nnot json\n[1]\n"
+        )
+        records = list(lab_directory.parse_ndjson(lines))
+        assert records[0].line == 1
+        assert records[0].values["city"] == "Leeds"
+        assert records[0].values["number"] == "123"
+        assert records[0].values["address_2"] == ""
+        assert records[1:] == [
+            lab_directory.Rejection(3, "invalid JSON"),
+            lab_directory.Rejection(4, "not an object"),
+        ]
+
+
+@pytest.mark.django_db
+class TestLoad:
+    def test_inserts_updates_and_skips_unchanged(self, django_assert_max_num_queries):
+        LabFactory(name="Same", email="same@example.com", city="London")
+        LabFactory(name="Moved", email="moved@example.com", city="London")
+
+        rows = csv_file(lab_row("Same"), lab_row("Moved", city="Leeds"), lab_row("New"))
+        # One lookup and one upsert (in a savepoint) for the batch.
+        with django_assert_max_num_queries(4):
+            report = lab_directory.load(rows, lab_directory.FORMAT_CSV)
+
+        assert (report.inserted, report.updated, report.unchanged) == (1, 1, 1)
+        assert Lab.objects.get(name="Moved").city == "Leeds"
+        assert Lab.objects.get(name="New").email == "new@example.com"
+        assert Lab.objects.count() == 3
+
+    def test_rejects_invalid_rows(self):
+        report = lab_directory.load(
+            csv_file(
+                lab_row("Country", country="XX"),
+                lab_row("Email", email="not-an-email"),
+                lab_row("Number", number="0" * 16),
+                lab_row("Good"),
+            ),
+            lab_directory.FORMAT_CSV,
+        )
+        assert report.inserted == 1
+        assert report.rejected == {
+            "invalid country": 1,
+            "invalid email": 1,
+            "invalid number": 1,
+        }
+        assert list(Lab.objects.values_list("name", flat=True)) == ["Good"]
+
+    def test_last_row_of_a_batch_wins(self):
+        report = lab_directory.load(
+            csv_file(lab_row("A", city="Leeds"), lab_row("A", city="York")),
+            lab_directory.FORMAT_CSV,
+        )
+        assert report.inserted == 1
+        assert Lab.objects.get(name="A").city == "York"
+
+    def test_batches(self):
+        batches = []
+        report = lab_directory.load(
+            csv_file(*(lab_row(f"Lab{i}") for i in range(5))),
+            lab_directory.FORMAT_CSV,
+            batch_size=2,
+            on_batch=lambda report: batches.append(report.line),
+        )
+        assert batches == [3, 5, 6]
+        assert report.inserted == 5
+
+    def test_ndjson(self):
+        lines = io.StringIO(
+            "\n".join(
+                json.dumps(dict(zip(lab_directory.FIELDS, lab_row(name))))
+                for name in "AB"
+            )
+        )
+        report = lab_directory.load(lines, lab_directory.FORMAT_NDJSON)
+        assert report.inserted == 2
+
+
+@pytest.mark.django_db
+class TestInvalidation:
+    @pytest.fixture()
+    def client(self):
+        user = UserFactory()
+        client = APIClient()
+        client.credentials(
+            HTTP_AUTHORIZATION=f"Token {CustomToken.objects.create(user=user).key}"
+        )
+        return client
+
+    def names(self, client, country, city=None):
+        url = reverse("main:api-lab", kwargs={"country": country})
+        response = client.get(url, {"city": city} if city else {})
+        assert response.status_code == status.HTTP_200_OK
+        return sorted(lab["name"] for lab in response.json())
+
+    def test_changed_places_are_invalidated_once(self, client, mocker):
+        LabFactory(name="Moved", city="London")
+        LabFactory(name="Paris lab", city="Paris", country="FR")
+        assert self.names(client, "GB", "london") == ["Moved"]
+        assert self.names(client, "GB") == ["Moved"]
+        assert self.names(client, "FR") == ["Paris lab"]
+
+        delete_many = mocker.spy(lab_directory.lab_lists, "delete_many")
+        lab_directory.load(
+            csv_file(lab_row("Moved", city="Leeds"), lab_row("New", city="Leeds")),
+            lab_directory.FORMAT_CSV,
+            batch_size=1,
+        )
+
+        delete_many.assert_called_once()
+        assert set(delete_many.call_args.args[0]) == {"GB:", "GB:london", "GB:leeds"}
+        assert self.names(client, "GB", "london") == []
+        assert self.names(client, "GB", "leeds") == ["Moved", "New"]
+        assert self.names(client, "GB") == ["Moved", "New"]
+
+    def test_nothing_changed(self, client, mocker):
+        LabFactory(name="Same", email="same@example.com")
+        delete_many = mocker.spy(lab_directory.lab_lists, "delete_many")
+        lab_directory.load(csv_file(lab_row("Same")), lab_directory.FORMAT_CSV)
+        delete_many.assert_not_called()
+
+
+@pytest.mark.django_db
+def test_command(tmp_path):
+    LabFactory(name="Same", email="same@example.com")
+    path = tmp_path / "labs.ndjson"
+    path.write_text(
+        "\n".join(
+            json.dumps(dict(zip(lab_directory.FIELDS, row)))
+            for row in (lab_row("Same"), lab_row("New"), lab_row("Bad", country="XX"))
+        )
+    )
+    out = io.StringIO()
+    call_command("load_labs", str(path), stdout=out)
+    assert (
+        "1 labs inserted, 0 updated, 1 unchanged" in out.getvalue()
+        and "1 invalid country" in out.getvalue()
+    )
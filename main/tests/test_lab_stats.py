@@ -0,0 +1,146 @@
+import datetime
+import io
+
+import pytest
+from django.contrib.admin.sites import site
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from main import ingestion, lab_stats, worklist
+from main.models import BloodTestResults, CustomToken, LabDailyStats
+
+from .factories import BloodTestResultsFactory, LabFactory, UserFactory
+
+
+@pytest.fixture()
+def lab():
+    return LabFactory()
+
+
+def client_for(user):
+    client = APIClient()
+    token = CustomToken.objects.create(key=f"s{user.pk:031d}", user=user)
+    client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+    return client
+
+
+def stats(lab):
+    return {
+        row.day: (row.orders, row.ready, row.turnaround_count)
+        for row in LabDailyStats.objects.filter(lab=lab)
+    }
+
+
+@pytest.mark.django_db
+class TestLabStats:
+    def test_create_endpoint_counts_orders(self, lab):
+        client_for(UserFactory()).post(
+            reverse("main:api-results"),
+            {"lab": lab.pk, "blood_test": ["HDL"]},
+            format="json",
+        )
+        assert stats(lab) == {timezone.localdate(): (1, 0, 0)}
+
+    def test_worklist_and_ingestion_count_ready_orders(self, lab):
+        worker = UserFactory(lab=lab)
+        orders = [BloodTestResultsFactory(lab=lab) for _ in range(3)]
+        lab_stats.record_created(orders)
+
+        worklist.claim(lab, worker, limit=1)
+        worklist.complete(lab, worker, {orders[0].pk: {"HDL": 50}})
+        ingestion.ingest(
+            io.StringIO(
+                "order_id,analyte,value\n"
+                f"{orders[0].pk},LDL,90\n{orders[1].pk},HDL,60\n"
+            ),
+            ingestion.FORMAT_CSV,
+        )
+
+        # orders[0] was already ready when ingestion touched it again.
+        assert stats(lab) == {timezone.localdate(): (3, 2, 2)}
+        assert BloodTestResults.objects.get(pk=orders[1].pk).ready_at is not None
+
+    def test_admin_deletes_take_orders_back(self, lab, rf, admin_user):
+        worker = UserFactory(lab=lab)
+        orders = [BloodTestResultsFactory(lab=lab) for _ in range(3)]
+        lab_stats.record_created(orders)
+        worklist.claim(lab, worker, limit=2)
+        worklist.complete(lab, worker, {order.pk: {"HDL": 50} for order in orders[:2]})
+        admin = site._registry[BloodTestResults]
+        request = rf.post("/")
+        request.user = admin_user
+
+        admin.delete_model(request, BloodTestResults.objects.get(pk=orders[2].pk))
+        assert stats(lab) == {timezone.localdate(): (2, 2, 2)}
+
+        admin.delete_queryset(request, BloodTestResults.objects.filter(lab=lab))
+        assert stats(lab) == {timezone.localdate(): (0, 0, 0)}
+        assert LabDailyStats.objects.get(lab=lab).turnaround_seconds == 0
+
+    def test_rebuild_matches_incremental_updates(self, lab):
+        orders = [BloodTestResultsFactory(lab=lab) for _ in range(4)]
+        day = timezone.now() - datetime.timedelta(days=2)
+        BloodTestResults.objects.filter(pk=orders[0].pk).update(timestamp=day)
+        BloodTestResults.objects.filter(pk__in=[orders[1].pk, orders[2].pk]).update(
+            ready=True, ready_at=timezone.now()
+        )
+        LabDailyStats.objects.create(lab=lab, day=timezone.localdate(), orders=99)
+
+        call_command("rebuild_lab_stats", stdout=io.StringIO())
+
+        assert stats(lab) == {
+            timezone.localdate(day): (1, 0, 0),
+            timezone.localdate(): (3, 2, 2),
+        }
+
+    def test_rebuild_keeps_days_before_since(self, lab):
+        old = datetime.date(2001, 1, 1)
+        LabDailyStats.objects.create(lab=lab, day=old, orders=5)
+
+        lab_stats.rebuild(since=datetime.date(2002, 1, 1))
+
+        assert stats(lab) == {old: (5, 0, 0)}
+
+
+@pytest.mark.django_db
+class TestLabStatsViewSet:
+    def test_reads_summary_rows(self, lab):
+        today = timezone.localdate()
+        LabDailyStats.objects.create(
+            lab=lab,
+            day=today,
+            orders=4,
+            ready=3,
+            turnaround_seconds=3600,
+            turnaround_count=2,
+        )
+        LabDailyStats.objects.create(
+            lab=lab, day=today - datetime.timedelta(days=1), orders=2
+        )
+        client = client_for(UserFactory(lab=lab))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(reverse("main:api-lab-stats", args=[lab.pk]))
+
+        assert response.status_code == status.HTTP_200_OK
+        assert not [q for q in queries if "main_bloodtestresults" in q["sql"]]
+        body = response.json()
+        assert [day["orders"] for day in body["days"]] == [2, 4]
+        assert body["days"][1]["pending"] == 1
+        assert body["days"][1]["average_turnaround_seconds"] == 1800
+        assert body["totals"] == {
+            "orders": 6,
+            "ready": 3,
+            "pending": 3,
+            "average_turnaround_seconds": 1800,
+        }
+
+    def test_other_labs_staff_are_refused(self, lab):
+        client = client_for(UserFactory(lab=LabFactory()))
+        response = client.get(reverse("main:api-lab-stats", args=[lab.pk]))
+        assert response.status_code == status.HTTP_403_FORBIDDEN
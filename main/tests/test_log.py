@@ -0,0 +1,100 @@
+import io
+import json
+import logging
+import threading
+
+import pytest
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from main import request_context
+from main.log import BatchingQueueHandler, JsonFormatter
+
+from .factories import UserFactory
+
+
+class BlockingStream(io.StringIO):
+    """A stream whose writes wait until ``release`` is set."""
+
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def write(self, s):
+        self.release.wait()
+        return super().write(s)
+
+
+def make_logger(handler: logging.Handler) -> logging.Logger:
+    handler.setFormatter(JsonFormatter())
+    logger = logging.getLogger(f"test.{id(handler)}")
+    logger.propagate = False
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    return logger
+
+
+def read_lines(stream):
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+class TestBatchingQueueHandler:
+    def test_writes_json_lines_with_request_context(self):
+        stream = io.StringIO()
+        handler = BatchingQueueHandler(stream=stream)
+        logger = make_logger(handler)
+        token = request_context.activate(
+            request_context.RequestContext(method="GET", path="/", user_id=7)
+        )
+        try:
+            logger.info("hello %s", "world", extra={"answer": 42})
+        finally:
+            request_context.deactivate(token)
+        logger.info("outside")
+        handler.close()
+
+        first, second = read_lines(stream)
+        assert first["message"] == "hello world"
+        assert first["answer"] == 42
+        assert first["request_context"]["user_id"] == 7
+        assert "request_context" not in second
+
+    def test_drop_policy_when_full(self):
+        stream = BlockingStream()
+        handler = BatchingQueueHandler(stream=stream, maxsize=2, batch_size=1)
+        logger = make_logger(handler)
+
+        for i in range(20):
+            logger.info("line %s", i)
+        assert handler.dropped > 0
+        stream.release.set()
+        handler.close()
+
+        assert len(read_lines(stream)) == 20 - handler.dropped
+
+    def test_unknown_policy(self):
+        with pytest.raises(ValueError):
+            BatchingQueueHandler(policy="spill")
+
+
+@pytest.mark.django_db
+def test_access_log_carries_request_fields():
+    user = UserFactory()
+    client = APIClient()
+    client.force_authenticate(user=user)
+    stream = io.StringIO()
+    handler = BatchingQueueHandler(stream=stream)
+    handler.setFormatter(JsonFormatter())
+    access_logger = logging.getLogger("main.access")
+    access_logger.addHandler(handler)
+    try:
+        client.get(reverse("main:api-results"))
+    finally:
+        access_logger.removeHandler(handler)
+        handler.close()
+
+    (line,) = read_lines(stream)
+    assert line["status"] == 200
+    assert line["request_context"]["user_id"] == user.pk
+    assert line["request_context"]["view"] == "main:api-results"
+    assert line["request_context"]["db_queries"] >= 1
@@ -0,0 +1,82 @@
+from unittest.mock import Mock
+
+import pytest
+import requests
+from django.test import override_settings
+from django.urls import reverse
+from prometheus_client import CONTENT_TYPE_LATEST
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from main import metrics
+from main.integrations.ip_geolocation import IpGeolocationClient
+
+from .factories import BloodTestResultsFactory, UserFactory
+
+
+def sample(name, **labels):
+    return metrics.get_registry().get_sample_value(name, labels) or 0
+
+
+@pytest.mark.django_db
+class TestMetricsEndpoint:
+    def test_request_latency_and_queries_recorded(self):
+        user = UserFactory()
+        BloodTestResultsFactory(user=user)
+        client = APIClient()
+        client.force_authenticate(user=user)
+        labels = {"view": "main:api-results", "method": "GET", "status": "200"}
+        before = sample("numan_http_request_duration_seconds_count", **labels)
+
+        client.get(reverse("main:api-results"))
+
+        assert sample("numan_http_request_duration_seconds_count", **labels) == (
+            before + 1
+        )
+        assert sample("numan_db_queries_per_request_sum", view="main:api-results") > 0
+
+    def test_metrics_exposition(self):
+        response = APIClient().get(reverse("main:metrics"))
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response["Content-Type"] == CONTENT_TYPE_LATEST
+        body = response.content.decode()
+        assert "numan_http_request_duration_seconds_bucket" in body
+        assert "numan_http_requests_in_progress" in body
+
+
+class TestIpGeolocationMetrics:
+    @override_settings(IP_GEOLOCATION_BASE_URL="https://fakeipgeolocation.com")
+    def test_retries_then_counts_error(self, mocker):
+        retries = sample("numan_ip_geolocation_retries_total")
+        errors = sample("numan_ip_geolocation_errors_total", reason="ConnectionError")
+        mocker.patch(
+            "main.integrations.ip_geolocation.requests.get",
+            side_effect=requests.ConnectionError(),
+        )
+        mocker.patch("main.integrations.ip_geolocation.time.sleep")
+
+        with pytest.raises(requests.ConnectionError):
+            IpGeolocationClient(max_retries=2).get_ip_geolocation({"ip": "8.8.8.8"})
+
+        assert sample("numan_ip_geolocation_retries_total") == retries + 2
+        assert (
+            sample("numan_ip_geolocation_errors_total", reason="ConnectionError")
+            == errors + 1
+        )
+
+    @override_settings(IP_GEOLOCATION_BASE_URL="https://fakeipgeolocation.com")
+    def test_server_error_retried(self, mocker):
+        failure, success = Mock(status_code=502, reason="Bad Gateway"), Mock()
+        success.status_code = status.HTTP_200_OK
+        success.json.return_value = {"city": "London"}
+        get = mocker.patch(
+            "main.integrations.ip_geolocation.requests.get",
+            side_effect=[failure, success],
+        )
+        mocker.patch("main.integrations.ip_geolocation.time.sleep")
+
+        data = IpGeolocationClient(max_retries=1).get_ip_geolocation({"ip": "8.8.8.8"})
+
+        assert data == {"city": "London"}
+        assert get.call_count == 2
@@ -0,0 +1,120 @@
+import datetime
+import io
+from smtplib import SMTPRecipientsRefused
+
+import pytest
+from django.core import mail
+from django.core.management import call_command
+from django.utils import timezone
+
+from main import ingestion, outbox, worklist
+from main.models import Notification
+
+from .factories import BloodTestResultsFactory, LabFactory, UserFactory
+
+READY = Notification.KIND_RESULT_READY
+
+
+@pytest.fixture()
+def lab():
+    return LabFactory()
+
+
+def notify(*users):
+    orders = [BloodTestResultsFactory(user=user, ready=True) for user in users]
+    outbox.enqueue(orders, READY, using="default")
+    return orders
+
+
+@pytest.mark.django_db
+class TestOutbox:
+    def test_ready_changes_enqueue_notifications(self, lab):
+        worker = UserFactory(lab=lab)
+        orders = [BloodTestResultsFactory(lab=lab) for _ in range(3)]
+        worklist.claim(lab, worker, limit=1)
+        worklist.complete(lab, worker, {orders[0].pk: {"HDL": 50}})
+        ingestion.ingest(
+            io.StringIO(
+                "order_id,analyte,value\n"
+                f"{orders[0].pk},LDL,90\n{orders[1].pk},HDL,60\n"
+            ),
+            ingestion.FORMAT_CSV,
+        )
+
+        # Not again for orders[0], which was ready before ingestion.
+        assert sorted(Notification.objects.values_list("result_id", "kind")) == [
+            (orders[0].pk, READY),
+            (orders[1].pk, READY),
+        ]
+        assert mail.outbox == []
+
+    def test_drain_sends_over_one_connection(self, mocker):
+        users = [UserFactory() for _ in range(3)]
+        notify(*users)
+        get_connection = mocker.spy(mail, "get_connection")
+
+        report = outbox.drain(batch_size=2)
+
+        assert report == outbox.DrainReport(sent=3)
+        assert get_connection.call_count == 1
+        assert sorted(m.to[0] for m in mail.outbox) == sorted(u.email for u in users)
+        assert "are ready" in mail.outbox[0].body
+        assert not Notification.objects.filter(sent_at__isnull=True).exists()
+        assert outbox.drain() == outbox.DrainReport()
+
+    def test_failures_are_retried_with_backoff(self, mocker, settings):
+        settings.OUTBOX_MAX_ATTEMPTS = 2
+        bad, good = UserFactory(), UserFactory()
+        notify(bad, good)
+        send_messages = mail.get_connection().__class__.send_messages
+
+        def refuse(connection, messages):
+            if messages[0].to == [bad.email]:
+                raise SMTPRecipientsRefused({bad.email: (550, b"no")})
+            return send_messages(connection, messages)
+
+        mocker.patch(
+            "django.core.mail.backends.locmem.EmailBackend.send_messages", refuse
+        )
+
+        assert outbox.drain() == outbox.DrainReport(sent=1, retried=1)
+        failed = Notification.objects.get(user_id=bad.pk)
+        assert failed.attempts == 1
+        assert failed.last_error.startswith("SMTPRecipientsRefused")
+        assert failed.next_attempt_at > timezone.now()
+        assert [m.to for m in mail.outbox] == [[good.email]]
+
+        Notification.objects.update(next_attempt_at=timezone.now())
+        assert outbox.drain() == outbox.DrainReport(given_up=1)
+        Notification.objects.update(next_attempt_at=timezone.now())
+        assert outbox.drain() == outbox.DrainReport()
+
+    def test_patients_without_email_are_skipped(self):
+        notify(UserFactory(email=""))
+
+        assert outbox.drain() == outbox.DrainReport(skipped=1)
+        assert mail.outbox == []
+
+    def test_backoff_doubles_up_to_the_cap(self, settings):
+        settings.OUTBOX_BACKOFF_SECONDS = 60
+        settings.OUTBOX_MAX_BACKOFF_SECONDS = 200
+        assert [outbox.backoff(n).total_seconds() for n in (1, 2, 3, 4)] == [
+            60,
+            120,
+            200,
+            200,
+        ]
+
+    def test_command_drains_and_purges(self):
+        notify(UserFactory())
+        old = notify(UserFactory())[0]
+        Notification.objects.filter(result_id=old.pk).update(
+            sent_at=timezone.now() - datetime.timedelta(days=30)
+        )
+        out = io.StringIO()
+
+        call_command("send_notifications", once=True, stdout=out)
+
+        assert "Sent 1" in out.getvalue()
+        assert not Notification.objects.filter(result_id=old.pk).exists()
+        assert len(mail.outbox) == 1
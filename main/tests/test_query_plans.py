@@ -0,0 +1,152 @@
+"""Fail when a hot endpoint's queries stop using an index.
+
+Each test seeds enough rows for the planner to prefer an index, captures the
+SQL an endpoint runs against our tables and EXPLAINs it on the test database
+(SQLite or Postgres).
+"""
+import re
+from contextlib import contextmanager
+from typing import List, Tuple
+
+import pytest
+from django.db import connection
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+from rest_framework.test import APIClient
+
+from ..models import BloodTestResults, CustomToken, Lab, User
+
+SEED_USERS = 200
+SEED_RESULTS_PER_USER = 25
+SEED_LABS = 2000
+SEED_TOKENS_PER_USER = 10
+
+HOT_TABLES = ("main_bloodtestresults", "main_lab", "main_customtoken")
+
+
+@contextmanager
+def capture_sql():
+    """Collect the (sql, params) of every query touching one of HOT_TABLES."""
+    captured: List[Tuple[str, tuple]] = []
+
+    def wrapper(execute, sql, params, many, context):
+        if sql.lstrip().upper().startswith("SELECT") and any(
+            table in sql for table in HOT_TABLES
+        ):
+            captured.append((sql, params))
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(wrapper):
+        yield captured
+
+
+def explain(sql: str, params, ordered=False) -> str:
+    prefix = "EXPLAIN QUERY PLAN " if connection.vendor == "sqlite" else "EXPLAIN "
+    with connection.cursor() as cursor:
+        # Postgres may rightly sort a user's few rows rather than walk an
+        # index in order; only a plan that has to sort regardless is a miss.
+        if ordered and connection.vendor == "postgresql":
+            cursor.execute("SET enable_sort = off")
+        try:
+            cursor.execute(prefix + sql, params)
+            rows = cursor.fetchall()
+        finally:
+            if ordered and connection.vendor == "postgresql":
+                cursor.execute("RESET enable_sort")
+        return "\n".join(" ".join(str(col) for col in row) for row in rows)
+
+
+def full_scans(plan: str) -> List[str]:
+    """Return the tables ``plan`` reads without an index."""
+    if connection.vendor == "sqlite":
+        # "SCAN t" is a full scan, "SCAN t USING [COVERING] INDEX" is not.
+        pattern = r"\bSCAN (?:TABLE )?(\w+)(?! USING)"
+    else:
+        pattern = r"Seq Scan on (\w+)"
+    return [table for table in re.findall(pattern, plan) if table in HOT_TABLES]
+
+
+def sorts_in_memory(plan: str) -> bool:
+    if connection.vendor == "sqlite":
+        return "USE TEMP B-TREE FOR ORDER BY" in plan
+    return bool(re.search(r"^\s*(->\s*)?Sort\b", plan, re.MULTILINE))
+
+
+def assert_indexed(captured, ordered=False):
+    assert captured, "the endpoint ran no queries against the hot tables"
+    for sql, params in captured:
+        plan = explain(sql, params, ordered)
+        assert not full_scans(plan), f"Sequential scan for:\n{sql}\n{plan}"
+        if ordered:
+            assert not sorts_in_memory(plan), f"Unindexed sort for:\n{sql}\n{plan}"
+
+
+@pytest.fixture()
+def seeded():
+    users = User.objects.bulk_create(
+        User(username=f"seed_{i}") for i in range(SEED_USERS)
+    )
+    labs = Lab.objects.bulk_create(
+        Lab(
+            name=f"seed_lab_{i}",
+            address="1 Lab Street",
+            city=f"City {i % 300}",
+            post_code="SW1 9RH",
+            country=("GB", "NZ", "AU", "CA", "US", "FR", "DE", "ES")[i % 8],
+            email=f"lab_{i}@example.com",
+            number="0795033954",
+        )
+        for i in range(SEED_LABS)
+    )
+    BloodTestResults.objects.bulk_create(
+        BloodTestResults(
+            user=user, lab=labs[i % SEED_LABS], ready=i % 10 != 0, results={}
+        )
+        for user in users
+        for i in range(SEED_RESULTS_PER_USER)
+    )
+    # Every request looks its token up, so the tokens table needs rows too.
+    CustomToken.objects.bulk_create(
+        CustomToken(user=user, key=get_random_string(length=32), name=f"explain_{i}")
+        for user in users
+        for i in range(SEED_TOKENS_PER_USER)
+    )
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+    return users
+
+
+@pytest.fixture()
+def client(seeded) -> APIClient:
+    token = CustomToken.objects.get(user=seeded[0], name="explain_0")
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+    return client
+
+
+@pytest.mark.django_db
+class TestHotQueryPlans:
+    def test_results_list(self, client):
+        with capture_sql() as captured:
+            assert client.get(reverse("main:api-results")).status_code == 200
+        assert_indexed(captured, ordered=True)
+
+    def test_labs_by_country(self, client):
+        with capture_sql() as captured:
+            response = client.get(reverse("main:api-lab", kwargs={"country": "gb"}))
+        assert response.status_code == 200
+        assert_indexed(captured)
+
+    def test_labs_by_country_and_city(self, client):
+        url = reverse("main:api-lab", kwargs={"country": "GB"})
+        with capture_sql() as captured:
+            response = client.get(url, {"city": "city 8"})
+        assert response.status_code == 200
+        assert len(response.json()) > 0
+        assert_indexed(captured)
+
+    def test_pending_results_by_lab(self, seeded):
+        lab = Lab.objects.first()
+        with capture_sql() as captured:
+            list(BloodTestResults.objects.filter(lab=lab, ready=False))
+        assert_indexed(captured)
@@ -0,0 +1,97 @@
+import datetime
+import decimal
+import io
+import json
+import uuid
+
+import cbor2
+import msgpack
+import pytest
+from django.core.management import call_command
+from django.urls import reverse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from main import renderers
+from main.models import CustomToken
+
+from .factories import BloodTestResultsFactory, LabFactory, UserFactory
+
+DECODERS = {
+    "application/msgpack": lambda data: msgpack.unpackb(data, raw=False),
+    "application/cbor": cbor2.loads,
+}
+
+
+@pytest.fixture()
+def client():
+    user = UserFactory()
+    client = APIClient()
+    token = CustomToken.objects.create(key="w" * 32, user=user)
+    client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+    client.user = user
+    return client
+
+
+class TestRenderers:
+    @pytest.mark.parametrize(
+        "renderer", [renderers.MessagePackRenderer(), renderers.CBORRenderer()]
+    )
+    def test_values_match_json(self, renderer):
+        data = {
+            "when": datetime.datetime(2024, 5, 1, 12, 30, tzinfo=datetime.timezone.utc),
+            "day": datetime.date(2024, 5, 1),
+            "amount": decimal.Decimal("1.50"),
+            "id": uuid.UUID(int=1),
+            "rows": [(1, None, True, 2.5)],
+        }
+
+        rendered = DECODERS[renderer.media_type](renderer.render(data))
+
+        assert rendered == json.loads(JSONRenderer().render(data))
+        assert rendered["when"] == "2024-05-01T12:30:00Z"
+
+    def test_parse_errors(self):
+        with pytest.raises(renderers.ParseError):
+            renderers.MessagePackParser().parse(io.BytesIO(b"\xc1"))
+        with pytest.raises(renderers.ParseError):
+            # An array of two items that ends after the first.
+            renderers.CBORParser().parse(io.BytesIO(b"\x82\x01"))
+
+
+@pytest.mark.django_db
+class TestNegotiation:
+    @pytest.mark.parametrize("media_type", DECODERS)
+    def test_results_list(self, client, media_type):
+        BloodTestResultsFactory.create_batch(3, user=client.user)
+        as_json = client.get(reverse("main:api-results")).json()
+
+        response = client.get(reverse("main:api-results"), HTTP_ACCEPT=media_type)
+
+        assert response["Content-Type"] == media_type
+        assert DECODERS[media_type](response.content) == as_json
+
+    @pytest.mark.parametrize(
+        "media_type, encode",
+        [("application/msgpack", msgpack.packb), ("application/cbor", cbor2.dumps)],
+    )
+    def test_binary_request_bodies(self, client, media_type, encode):
+        lab = LabFactory()
+
+        response = client.post(
+            reverse("main:api-results"),
+            encode({"lab": lab.pk, "blood_test": ["HDL", "LDL"]}),
+            content_type=media_type,
+            HTTP_ACCEPT=media_type,
+        )
+
+        assert response.status_code == 200
+        assert DECODERS[media_type](response.content)["results"] == {
+            "HDL": None,
+            "LDL": None,
+        }
+
+    def test_benchmark_command(self):
+        out = io.StringIO()
+        call_command("benchmark_wire_formats", rows=50, repeat=2, stdout=out)
+        assert "msgpack" in out.getvalue()
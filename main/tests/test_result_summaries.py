@@ -0,0 +1,260 @@
+import datetime
+import io
+
+import pytest
+from django.contrib.admin.sites import site
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import QuerySet
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from main import ingestion, lab_stats, result_summaries, worklist
+from main.models import BloodTestResults, CustomToken, ResultSummary
+
+from .factories import BloodTestResultsFactory, LabFactory, UserFactory
+
+URL = reverse("main:api-results-summary")
+
+
+@pytest.fixture()
+def lab():
+    return LabFactory()
+
+
+def client_for(user):
+    client = APIClient()
+    token = CustomToken.objects.create(user=user)
+    client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+    return client
+
+
+def snapshot(user):
+    row = ResultSummary.objects.get(pk=user.pk)
+    return row.pending, {code: entry["value"] for code, entry in row.latest.items()}
+
+
+def order(user, lab, days_ago=0):
+    instance = BloodTestResultsFactory(user=user, lab=lab)
+    if days_ago:
+        timestamp = timezone.now() - datetime.timedelta(days=days_ago)
+        BloodTestResults.objects.filter(pk=instance.pk).update(timestamp=timestamp)
+        instance.refresh_from_db()
+    lab_stats.record_created([instance])
+    result_summaries.record_created([instance])
+    return instance
+
+
+@pytest.mark.django_db
+class TestResultSummaries:
+    def test_kept_up_to_date_by_every_write_path(self, lab):
+        patient, worker = UserFactory(), UserFactory(lab=lab)
+        client_for(patient).post(
+            reverse("main:api-results"),
+            {"lab": lab.pk, "blood_test": ["HDL", "LDL"]},
+            format="json",
+        )
+        first = BloodTestResults.objects.get(user=patient)
+        second = order(patient, lab)
+        assert snapshot(patient) == (2, {})
+
+        worklist.claim(lab, worker, limit=1)
+        worklist.complete(lab, worker, {first.pk: {"HDL": 50, "LDL": None}})
+        assert snapshot(patient) == (1, {"HDL": 50})
+
+        ingestion.ingest(
+            io.StringIO(
+                f"order_id,analyte,value\n{first.pk},LDL,90\n{second.pk},HDL,60\n"
+            ),
+            ingestion.FORMAT_CSV,
+        )
+
+        # The first order was already ready but gained a value.
+        assert snapshot(patient) == (0, {"HDL": 60, "LDL": 90})
+        latest = ResultSummary.objects.get(pk=patient.pk).latest
+        assert latest["HDL"]["result"] == second.pk
+
+    def test_older_results_dont_replace_newer_ones(self, lab):
+        patient = UserFactory()
+        older, newer = order(patient, lab, days_ago=3), order(patient, lab)
+        newer.results, newer.ready = {"HDL": 70}, True
+        result_summaries.record_ready([newer])
+
+        older.results, older.ready = {"HDL": 40, "LDL": 100}, True
+        result_summaries.record_ready([older])
+
+        assert snapshot(patient) == (0, {"HDL": 70, "LDL": 100})
+
+    def test_admin_edits(self, lab, rf, admin_user):
+        patient = UserFactory()
+        admin = site._registry[BloodTestResults]
+        request = rf.post("/")
+        request.user = admin_user
+
+        class Form:
+            changed_data = ["ready", "results"]
+
+        added = BloodTestResults(user=patient, lab=lab, results={"HDL": 55})
+        added.ready = True
+        admin.save_model(request, added, Form(), change=False)
+        assert snapshot(patient) == (0, {"HDL": 55})
+
+        added.ready = False
+        admin.save_model(request, added, Form(), change=True)
+        assert snapshot(patient) == (1, {})
+
+    def test_admin_deletes(self, lab, rf, admin_user):
+        patient = UserFactory()
+        older, newer = order(patient, lab, days_ago=2), order(patient, lab)
+        newer.results, newer.ready = {"HDL": 70}, True
+        newer.save()
+        result_summaries.record_ready([newer])
+        older.results, older.ready = {"HDL": 40}, True
+        older.save()
+        result_summaries.record_ready([older])
+        waiting = order(patient, lab)
+        # Deletes take the orders back out of the lab's stats too.
+        lab_stats.record_ready([older, newer])
+        admin = site._registry[BloodTestResults]
+        request = rf.post("/")
+        request.user = admin_user
+        assert snapshot(patient) == (1, {"HDL": 70})
+
+        admin.delete_model(request, waiting)
+        assert snapshot(patient) == (0, {"HDL": 70})
+
+        admin.delete_queryset(request, BloodTestResults.objects.filter(pk=newer.pk))
+        assert snapshot(patient) == (0, {"HDL": 40})
+
+    def test_archived_orders_stop_pending(self, lab, settings, tmp_path):
+        settings.RESULT_ARCHIVE_DIR = str(tmp_path)
+        patient = UserFactory()
+        done = order(patient, lab, days_ago=5 * 365)
+        done.results, done.ready = {"HDL": 65}, True
+        done.save()
+        result_summaries.record_ready([done])
+        order(patient, lab, days_ago=5 * 365)
+        order(patient, lab)
+
+        call_command("archive_results", stdout=io.StringIO())
+
+        assert snapshot(patient) == (1, {"HDL": 65})
+
+    def test_deletes_keep_values_only_archived_results_hold(
+        self, lab, rf, admin_user, settings, tmp_path
+    ):
+        settings.RESULT_ARCHIVE_DIR = str(tmp_path)
+        patient = UserFactory()
+        old = order(patient, lab, days_ago=5 * 365)
+        old.results, old.ready = {"HDL": 40, "LDL": 100}, True
+        old.save()
+        result_summaries.record_ready([old])
+        call_command("archive_results", stdout=io.StringIO())
+        newer = order(patient, lab)
+        newer.results, newer.ready = {"HDL": 70}, True
+        newer.save()
+        lab_stats.record_ready([newer])
+        result_summaries.record_ready([newer])
+        assert snapshot(patient) == (0, {"HDL": 70, "LDL": 100})
+        admin = site._registry[BloodTestResults]
+        request = rf.post("/")
+        request.user = admin_user
+
+        admin.delete_model(request, newer)
+
+        assert snapshot(patient) == (0, {"HDL": 40, "LDL": 100})
+        assert ResultSummary.objects.get(pk=patient.pk).latest["HDL"]["result"] == (
+            old.pk
+        )
+
+    def test_rebuild_locks_before_reading_results(self, lab, mocker):
+        patient = UserFactory()
+        order(patient, lab)
+        seen = []
+        compute = result_summaries.compute
+        mocker.patch.object(
+            result_summaries,
+            "compute",
+            side_effect=lambda user_ids: seen.append("compute") or compute(user_ids),
+        )
+        select_for_update = QuerySet.select_for_update
+        mocker.patch.object(
+            QuerySet,
+            "select_for_update",
+            autospec=True,
+            side_effect=lambda queryset: seen.append("lock")
+            or select_for_update(queryset),
+        )
+
+        result_summaries.rebuild(user_ids=[patient.pk])
+
+        assert seen == ["lock", "compute"]
+        assert snapshot(patient) == (1, {})
+
+    def test_rebuild_matches_incremental_updates(self, lab):
+        patients = [UserFactory(), UserFactory()]
+        for patient in patients:
+            done = order(patient, lab, days_ago=1)
+            done.results, done.ready = {"HDL": patient.pk, "XYZ": 1}, True
+            done.save()
+            result_summaries.record_ready([done])
+            order(patient, lab)
+        incremental = [snapshot(patient) for patient in patients]
+        ResultSummary.objects.filter(pk=patients[0].pk).update(pending=9, latest={})
+        ResultSummary.objects.create(user=UserFactory(), pending=3)
+
+        result_summaries.rebuild(batch_size=1)
+
+        assert [snapshot(patient) for patient in patients] == incremental
+        assert incremental[0] == (1, {"HDL": patients[0].pk})
+        assert ResultSummary.objects.count() == 2
+
+    def test_rebuild_one_patient(self, lab):
+        patient, other = UserFactory(), UserFactory()
+        order(patient, lab)
+        ResultSummary.objects.create(user=other, pending=5)
+
+        result_summaries.rebuild(user_ids=[patient.pk])
+
+        assert snapshot(patient) == (1, {})
+        assert snapshot(other) == (5, {})
+
+
+@pytest.mark.django_db
+class TestResultSummaryViewSet:
+    def test_one_read_of_the_snapshot(self, lab):
+        patient = UserFactory()
+        done = order(patient, lab)
+        done.results, done.ready = {"HDL": 80}, True
+        result_summaries.record_ready([done])
+        order(patient, lab)
+        client = client_for(patient)
+        # The first request also loads the current Site.
+        client.get(URL)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(URL)
+
+        assert response.status_code == status.HTTP_200_OK
+        tables = [q["sql"] for q in queries if "main_resultsummary" in q["sql"]]
+        assert len(tables) == 1
+        assert not [q for q in queries if "main_bloodtestresults" in q["sql"]]
+        body = response.json()
+        assert body["pending"] == 1
+        assert set(body["latest"]) == set(result_summaries.ANALYTES)
+        assert body["latest"]["HDL"]["value"] == 80
+        assert body["latest"]["HDL"]["result"] == done.pk
+        assert body["latest"]["LDL"] is None
+
+    def test_without_orders(self):
+        response = client_for(UserFactory()).get(URL)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["pending"] == 0
+        assert not any(response.json()["latest"].values())
+
+    def test_needs_authentication(self):
+        assert APIClient().get(URL).status_code == status.HTTP_401_UNAUTHORIZED
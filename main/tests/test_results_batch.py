@@ -0,0 +1,116 @@
+import pytest
+from django.contrib.auth.models import Permission
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from main import sharding
+from main.models import CustomToken
+
+from .factories import BloodTestResultsFactory, LabFactory, UserFactory
+
+URL = reverse("main:api-results-batch")
+
+
+def client_for(user):
+    client = APIClient()
+    token = CustomToken.objects.create(user=user)
+    client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+    return client
+
+
+@pytest.fixture()
+def clinician():
+    user = UserFactory()
+    user.user_permissions.add(Permission.objects.get(codename="view_bloodtestresults"))
+    return user
+
+
+def panel(size, lab):
+    patients = [UserFactory() for _ in range(size)]
+    for patient in patients:
+        BloodTestResultsFactory.create_batch(2, user=patient, lab=lab)
+    return patients
+
+
+@pytest.mark.django_db
+class TestResultsBatch:
+    def test_grouped_per_patient_in_request_order(self, clinician):
+        lab = LabFactory()
+        first, second, without_results = UserFactory(), UserFactory(), UserFactory()
+        older = BloodTestResultsFactory(user=second, lab=lab, results={"HDL": 80})
+        newer = BloodTestResultsFactory(user=second, lab=None)
+        mine = BloodTestResultsFactory(user=first, lab=lab)
+        BloodTestResultsFactory(user=UserFactory(), lab=lab)
+
+        response = client_for(clinician).post(
+            URL,
+            {"user_ids": [second.pk, first.pk, without_results.pk, second.pk]},
+            format="json",
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        patients = response.json()["patients"]
+        assert [p["user"] for p in patients] == [
+            second.pk,
+            first.pk,
+            without_results.pk,
+        ]
+        assert [r["id"] for r in patients[0]["results"]] == [older.pk, newer.pk]
+        assert patients[0]["results"][0]["lab_name"] == lab.name
+        assert patients[0]["results"][0]["flags"] == {"HDL": "N"}
+        assert patients[0]["results"][1]["lab_name"] is None
+        assert [r["id"] for r in patients[1]["results"]] == [mine.pk]
+        assert patients[2]["results"] == []
+
+    def test_query_count_is_constant(self, clinician):
+        lab = LabFactory()
+        small, large = panel(1, lab), panel(25, lab)
+        client = client_for(clinician)
+
+        def queries(patients):
+            with CaptureQueriesContext(connection) as context:
+                response = client.post(
+                    URL, {"user_ids": [p.pk for p in patients]}, format="json"
+                )
+            assert response.status_code == status.HTTP_200_OK
+            results = sum(len(p["results"]) for p in response.json()["patients"])
+            assert results == 2 * len(patients)
+            return len(context.captured_queries)
+
+        # The first request also loads the current Site.
+        queries(small)
+        # Token and user, the clinician's permissions (user and group), the
+        # results with their labs, and the patients' demographics.
+        assert queries(small) == queries(large) == 5
+
+    def test_sharded_fetches_labs_once(self, settings, django_assert_num_queries):
+        # Every "shard" is the test database, which still takes the sharded path.
+        settings.RESULT_SHARDS = ["default", "default"]
+        lab = LabFactory()
+        patients = panel(3, lab)
+
+        with django_assert_num_queries(2):
+            results = sharding.results_for_users(p.pk for p in patients)
+            assert {result.lab.name for result in results} == {lab.name}
+        assert [r.user_id for r in results] == sorted(r.user_id for r in results)
+
+    def test_needs_permission(self):
+        response = client_for(UserFactory()).post(URL, {"user_ids": [1]}, format="json")
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    def test_batch_size_capped(self, clinician, settings):
+        too_many = list(range(1, settings.RESULTS_BATCH_MAX_USERS + 2))
+
+        response = client_for(clinician).post(
+            URL, {"user_ids": too_many}, format="json"
+        )
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert "user_ids" in response.json()
+
+    def test_needs_ids(self, clinician):
+        response = client_for(clinician).post(URL, {"user_ids": []}, format="json")
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
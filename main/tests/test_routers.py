@@ -0,0 +1,113 @@
+import json
+
+import pytest
+from django.core.cache import cache
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from main import routers
+from main.models import BloodTestResults
+
+from .factories import LabFactory, UserFactory
+
+REPLICAS = {"replica_1": 3, "replica_2": 1, "replica_3": 0}
+
+
+@pytest.fixture(autouse=True)
+def reset_state(settings):
+    settings.REPLICA_DATABASES = REPLICAS
+    routers._health.clear()
+    cache.clear()
+    yield
+    routers._health.clear()
+    cache.clear()
+
+
+@pytest.fixture()
+def healthy(mocker):
+    return mocker.patch("main.routers.check_replica", return_value=True)
+
+
+class TestReplicaRouter:
+    router = routers.ReplicaRouter()
+
+    def test_reads_default_outside_replica_block(self, healthy):
+        assert self.router.db_for_read(BloodTestResults) == "default"
+
+    def test_reads_replica_inside_block(self, healthy):
+        with routers.replica_reads() as alias:
+            assert alias in ("replica_1", "replica_2")
+            assert self.router.db_for_read(BloodTestResults) == alias
+        assert self.router.db_for_read(BloodTestResults) == "default"
+
+    def test_writes_go_to_primary(self, healthy):
+        with routers.replica_reads():
+            assert self.router.db_for_write(BloodTestResults) == "default"
+
+    def test_unhealthy_replica_skipped(self, mocker):
+        mocker.patch(
+            "main.routers.check_replica", side_effect=lambda alias: alias == "replica_2"
+        )
+        for _ in range(20):
+            with routers.replica_reads() as alias:
+                assert alias == "replica_2"
+
+    def test_falls_back_to_primary_without_healthy_replicas(self, mocker):
+        mocker.patch("main.routers.check_replica", return_value=False)
+        with routers.replica_reads() as alias:
+            assert alias is None
+
+    def test_health_check_cached(self, healthy):
+        for _ in range(5):
+            with routers.replica_reads():
+                pass
+        assert healthy.call_count == 2
+
+    def test_health_rechecked_after_interval(self, healthy, settings):
+        settings.REPLICA_HEALTH_CHECK_INTERVAL = 0
+        for _ in range(3):
+            with routers.replica_reads():
+                pass
+        assert healthy.call_count == 6
+
+    def test_pinned_user_reads_primary(self, healthy):
+        routers.pin_to_primary(42)
+        with routers.replica_reads(42) as alias:
+            assert alias is None
+        with routers.replica_reads(43) as alias:
+            assert alias is not None
+
+    def test_replicas_not_migrated(self):
+        assert self.router.allow_migrate("replica_1", "main") is False
+        assert self.router.allow_migrate("default", "main") is None
+
+
+@pytest.mark.django_db
+class TestViewRouting:
+    def test_list_reads_from_replica(self, mocker):
+        choose = mocker.patch("main.routers.choose_replica", return_value=None)
+        user = UserFactory()
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        client.get(reverse("main:api-results"))
+        client.get(reverse("main:api-lab", kwargs={"country": "GB"}))
+
+        assert choose.call_count == 2
+
+    def test_create_pins_user_to_primary(self, mocker):
+        choose = mocker.patch("main.routers.choose_replica", return_value=None)
+        user = UserFactory()
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        client.post(
+            reverse("main:api-results"),
+            data=json.dumps({"lab": LabFactory().pk, "blood_test": ["HDL"]}),
+            content_type="application/json",
+        )
+        response = client.get(reverse("main:api-results"))
+
+        assert routers.is_pinned(user.pk)
+        assert len(response.json()) == 1
+        choose.assert_not_called()
@@ -0,0 +1,164 @@
+from datetime import timedelta
+from types import SimpleNamespace
+
+import pytest
+from django.core.management import CommandError, call_command
+from django.db import connections
+from django.urls import reverse
+from django.utils import timezone
+
+from main import sharding
+from main.models import BloodTestResults
+from main.routers import ShardRouter
+
+from .factories import BloodTestResultsFactory, UserFactory
+
+SHARDS = ["default", "shard_1", "shard_2"]
+
+
+@pytest.fixture()
+def target_shard():
+    """An empty in-memory database holding only the results table."""
+    shard = {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}
+    connections.settings["shard_1"] = shard
+    # Fills in the defaults of every setting left out.
+    connections.configure_settings(connections.settings)
+    with connections["shard_1"].schema_editor() as editor:
+        editor.create_model(BloodTestResults)
+    yield "shard_1"
+    connections["shard_1"].close()
+    del connections["shard_1"]
+    del connections.settings["shard_1"]
+
+
+@pytest.fixture()
+def sharded(settings):
+    settings.RESULT_SHARDS = SHARDS
+
+
+class TestShardResolution:
+    def test_stable_and_spread(self, sharded):
+        placements = {
+            user_id: sharding.shard_for_user(user_id) for user_id in range(300)
+        }
+
+        assert placements == {
+            user_id: sharding.shard_for_user(user_id) for user_id in range(300)
+        }
+        assert set(placements.values()) == set(SHARDS)
+
+    def test_single_shard(self):
+        assert not sharding.is_sharded()
+        assert sharding.shard_for_user(123) == "default"
+
+    def test_results_for_user_uses_shard(self, sharded):
+        queryset = sharding.results_for_user(7)
+        assert queryset.db == sharding.shard_for_user(7)
+
+    def test_results_for_user_unsharded_left_to_router(self):
+        assert sharding.results_for_user(7).query.where
+
+    def test_router_places_instance(self, sharded):
+        instance = BloodTestResults(user_id=7)
+        router = ShardRouter()
+
+        assert router.db_for_write(BloodTestResults, instance=instance) == (
+            sharding.shard_for_user(7)
+        )
+        assert router.db_for_read(BloodTestResults) is None
+
+
+class TestScatterGather:
+    def test_merges_in_order(self, sharded, mocker):
+        now = timezone.now()
+        per_shard = {
+            "default": [now, now - timedelta(minutes=3)],
+            "shard_1": [now - timedelta(minutes=1)],
+            "shard_2": [now - timedelta(minutes=2), now - timedelta(minutes=4)],
+        }
+        mocker.patch(
+            "main.sharding._run_on_shard",
+            side_effect=lambda build, alias: [
+                SimpleNamespace(timestamp=t, shard=alias) for t in per_shard[alias]
+            ],
+        )
+
+        merged = list(
+            sharding.scatter_gather(
+                BloodTestResults.objects.all, key=lambda r: r.timestamp, reverse=True
+            )
+        )
+
+        assert [r.shard for r in merged] == [
+            "default",
+            "shard_1",
+            "shard_2",
+            "default",
+            "shard_2",
+        ]
+
+
+@pytest.mark.django_db
+class TestShardAdminAndCommand:
+    def test_all_shards_admin_view(self, client):
+        admin = UserFactory(is_staff=True, is_superuser=True)
+        results = [BloodTestResultsFactory() for _ in range(3)]
+        client.force_login(admin)
+
+        response = client.get(reverse("admin:main_bloodtestresults_all_shards"))
+
+        assert response.status_code == 200
+        assert [r.pk for r, shard in response.context["results"]] == [
+            r.pk for r in reversed(results)
+        ]
+
+    def test_rebalance_dry_run(self, mocker, capsys):
+        result = BloodTestResultsFactory()
+        mocker.patch(
+            "main.management.commands.rebalance_result_shards.shard_for_user",
+            return_value="shard_1",
+        )
+
+        call_command("rebalance_result_shards", "--dry-run")
+
+        out = capsys.readouterr().out
+        assert f"user {result.user_id}: 1 rows default -> shard_1" in out
+        assert BloodTestResults.objects.filter(pk=result.pk).exists()
+
+    def test_rebalance_nothing_to_move(self, capsys):
+        BloodTestResultsFactory()
+
+        call_command("rebalance_result_shards")
+
+        assert "Moved 0 rows." in capsys.readouterr().out
+
+    def test_rebalance_moves_rows(self, mocker, target_shard):
+        results = [BloodTestResultsFactory(user=UserFactory()) for _ in range(3)]
+        mocker.patch(
+            "main.management.commands.rebalance_result_shards.shard_for_user",
+            return_value=target_shard,
+        )
+
+        call_command("rebalance_result_shards", "--chunk-size", "2")
+
+        assert not BloodTestResults.objects.exists()
+        moved = BloodTestResults.objects.using(target_shard).order_by("pk")
+        assert [r.pk for r in moved] == [r.pk for r in results]
+
+    def test_rebalance_keeps_rows_colliding_on_the_target(self, mocker, target_shard):
+        result, other = BloodTestResultsFactory(), BloodTestResultsFactory()
+        # Another user's row already holds the primary key on the target.
+        BloodTestResults.objects.using(target_shard).create(
+            pk=result.pk, user=other.user, lab=other.lab
+        )
+        mocker.patch(
+            "main.management.commands.rebalance_result_shards.shard_for_user",
+            return_value=target_shard,
+        )
+
+        with pytest.raises(CommandError, match=f"rows \\[{result.pk}\\] collide"):
+            call_command("rebalance_result_shards", "--user", str(result.user_id))
+
+        assert BloodTestResults.objects.get(pk=result.pk).user_id == result.user_id
+        copy = BloodTestResults.objects.using(target_shard).get(pk=result.pk)
+        assert copy.user_id == other.user_id
@@ -0,0 +1,59 @@
+import io
+
+import pytest
+from django.conf import settings
+from django.core.management import call_command
+
+from main import startup
+
+IMPORTTIME = """\
+import time: self [us] | cumulative | imported package
+import time:       120 |        120 |     django.utils.version
+import time:       300 |        420 |   django.utils
+import time:      1000 |       1420 | django
+"""
+
+
+def test_parse_importtime():
+    assert startup.parse_importtime(IMPORTTIME) == [
+        startup.ModuleTime("django.utils.version", 120, 120, 2),
+        startup.ModuleTime("django.utils", 300, 420, 1),
+        startup.ModuleTime("django", 1000, 1420, 0),
+    ]
+
+
+@pytest.fixture(scope="module")
+def cold_start():
+    return startup.cold_start()
+
+
+def test_first_request_within_budget(cold_start):
+    assert cold_start.status == 401
+    assert cold_start.total < settings.STARTUP_BUDGET_SECONDS, (
+        f"A cold start took {cold_start.total:.2f}s, over the "
+        f"{settings.STARTUP_BUDGET_SECONDS}s budget; see ./manage.py profile_imports."
+    )
+
+
+@pytest.mark.parametrize(
+    "module",
+    [
+        # The country table, built when a country's name is first needed.
+        "django_countries.data",
+        "main.integrations.ip_geolocation",
+        "numpy",
+        "pyarrow",
+    ],
+)
+def test_loaded_on_first_use(cold_start, module):
+    assert module not in cold_start.modules
+
+
+def test_profile_imports_command():
+    out = io.StringIO()
+    call_command("profile_imports", "--prefix", "main.", "--limit", "5", stdout=out)
+    lines = out.getvalue().splitlines()
+    assert lines[0].split() == ["cumulative", "self", "module"]
+    assert len(lines) == 7
+    assert all(" main." in line for line in lines[1:6])
+    assert "GET /api/lab/GB/, 401" in lines[-1]
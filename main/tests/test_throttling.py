@@ -0,0 +1,140 @@
+import fakeredis
+import pytest
+from django.core.cache.backends.redis import RedisCache
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from main import throttling
+from main.integrations.ip_geolocation import IpGeolocationClient
+from main.models import CustomToken
+
+from .factories import UserFactory
+
+
+def client_for(token):
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+    return client
+
+
+class TestBuckets:
+    @pytest.mark.parametrize(
+        "rate, expected",
+        [("10/s", (10, 10)), ("60/min", (1, 60)), ("7200/hour", (2, 7200))],
+    )
+    def test_parse_rate(self, rate, expected):
+        assert throttling.parse_rate(rate) == expected
+
+    def test_burst_then_refill(self, mocker):
+        clock = mocker.patch("main.throttling.time.time", return_value=1000.0)
+        bucket = throttling.Bucket("bucket:test:1", rate=2, burst=3)
+
+        assert [throttling.take([bucket]) for _ in range(3)] == [0, 0, 0]
+        assert throttling.take([bucket]) == pytest.approx(0.5)
+        clock.return_value = 1000.5
+        assert throttling.take([bucket]) == 0
+        assert throttling.take([bucket]) == pytest.approx(0.5)
+
+    def test_all_or_nothing(self):
+        roomy = throttling.Bucket("bucket:test:roomy", rate=1, burst=2)
+        empty = throttling.Bucket("bucket:test:empty", rate=1, burst=1)
+        throttling.take([empty])
+
+        assert throttling.take([roomy, empty]) > 0
+        assert throttling.take([roomy]) == 0
+        assert throttling.take([roomy]) == 0
+
+
+class TestRedisBuckets:
+    @pytest.fixture()
+    def redis(self, mocker):
+        backend = RedisCache("redis://cache:6379/0", {"KEY_PREFIX": "numan"})
+        client = fakeredis.FakeRedis()
+        mocker.patch.object(backend._cache, "get_client", return_value=client)
+        mocker.patch.object(throttling, "caches", {"default": backend})
+        # The script is registered once per process; register it on this client.
+        mocker.patch.object(throttling, "_script", None)
+        return client
+
+    def test_takes_through_the_script(self, redis, mocker):
+        local = mocker.spy(throttling, "_take_local")
+        bucket = throttling.Bucket("bucket:test:1", rate=0.001, burst=2)
+
+        assert [throttling.take([bucket]) for _ in range(2)] == [0, 0]
+        assert throttling.take([bucket]) == pytest.approx(1000, rel=0.01)
+        local.assert_not_called()
+        key = b"numan:1:bucket:test:1"
+        assert float(redis.hget(key, "tokens")) == pytest.approx(0, abs=0.01)
+        assert 0 < redis.ttl(key) <= 2001
+
+    def test_all_or_nothing(self, redis):
+        roomy = throttling.Bucket("bucket:test:roomy", rate=0.001, burst=2)
+        empty = throttling.Bucket("bucket:test:empty", rate=0.001, burst=1)
+        throttling.take([empty])
+
+        assert throttling.take([roomy, empty]) > 0
+        assert throttling.take([roomy]) == 0
+        assert throttling.take([roomy]) == 0
+
+
+@pytest.mark.django_db
+class TestTokenBucketThrottle:
+    def test_per_token_limit_with_retry_after(self, settings):
+        settings.THROTTLE_RATES = {"user": "100/min", "token": "2/min"}
+        user = UserFactory()
+        first = CustomToken.objects.create(key="1" * 32, user=user, name="phone")
+        second = CustomToken.objects.create(key="2" * 32, user=user, name="laptop")
+        url = reverse("main:api-results")
+
+        statuses = [client_for(first).get(url).status_code for _ in range(2)]
+        refused = client_for(first).get(url)
+
+        assert statuses == [status.HTTP_200_OK] * 2
+        assert refused.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+        assert refused["Retry-After"] == "30"
+        assert client_for(second).get(url).status_code == status.HTTP_200_OK
+
+    def test_per_user_limit_spans_tokens(self, settings):
+        settings.THROTTLE_RATES = {"user": "1/min"}
+        user = UserFactory()
+        first = CustomToken.objects.create(key="3" * 32, user=user, name="phone")
+        second = CustomToken.objects.create(key="4" * 32, user=user, name="laptop")
+        url = reverse("main:api-results")
+
+        assert client_for(first).get(url).status_code == status.HTTP_200_OK
+        assert client_for(second).get(url).status_code == 429
+
+    def test_endpoint_scope(self, settings, mocker):
+        settings.THROTTLE_RATES = {"geolocation": "1/min"}
+        mocker.patch(
+            "main.integrations.ip_geolocation.IpGeolocationClient.get_ip_geolocation",
+            return_value={"country_name": "USA", "city": "Rocky Mount"},
+        )
+        token = CustomToken.objects.create(key="5" * 32, user=UserFactory())
+        client = client_for(token)
+
+        assert client.get(reverse("main:api-results")).status_code == 200
+        url = reverse("main:api-geolocation") + "?ip=8.8.8.8"
+        assert client.get(url).status_code == status.HTTP_200_OK
+        assert client.get(url).status_code == 429
+        assert client.get(reverse("main:api-results")).status_code == 200
+
+    def test_upstream_bucket_is_shared(self, settings, mocker):
+        settings.THROTTLE_RATES = {"upstream:geolocation": "1/min"}
+        upstream = mocker.patch("main.integrations.ip_geolocation.requests.get")
+        upstream.return_value.status_code = 200
+        upstream.return_value.json.return_value = {
+            "country_name": "USA",
+            "city": "Rocky Mount",
+        }
+        IpGeolocationClient().get_ip_geolocation({"ip": "8.8.4.4"})
+        token = CustomToken.objects.create(key="6" * 32, user=UserFactory())
+
+        response = client_for(token).get(
+            reverse("main:api-geolocation") + "?ip=8.8.8.8"
+        )
+
+        assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+        assert response["Retry-After"] == "60"
+        assert upstream.call_count == 1
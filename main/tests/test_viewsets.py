@@ -3,6 +3,7 @@ from urllib.parse import urljoin
 
 import pytest
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.crypto import get_random_string
 from rest_framework import status
 from rest_framework.test import APIClient
@@ -125,6 +126,24 @@ class TestBloodTestResultsViewSet:
             assert data.get("lab") == lab.pk
             assert BloodTestResults.objects.filter(user=user).count() == 1
 
+    def test_worklist_fields_stay_internal(self, user, client):
+        create_blood_test_results(
+            user=user, claimed_by=UserFactory(), ready_at=timezone.now()
+        )
+        client.force_authenticate(user=user)
+
+        response = client.get(reverse("main:api-results"))
+
+        assert set(response.json()[0]) == {
+            "id",
+            "user",
+            "timestamp",
+            "results",
+            "ready",
+            "lab",
+            "flags",
+        }
+
     def test_create_blood_test_results_invalid_lab_404(self, user, client):
         data = {"lab": 4, "blood_test": ["HDL", "LDL", "CBC"]}
         client.force_authenticate(user=user)
@@ -299,7 +318,7 @@ class TestGeolocationViewSet:
         self, mocker, expected_status_code, mock_return_value, client, user
     ):
         mocker.patch(
-            "main.viewsets.IpGeolocationClient.get_ip_geolocation",
+            "main.integrations.ip_geolocation.IpGeolocationClient.get_ip_geolocation",
             return_value=mock_return_value,
         )
         client.force_authenticate(user=user)
@@ -314,7 +333,7 @@ class TestGeolocationViewSet:
 
     def test_geolocation_viewset_auth(self, mocker, client, user):
         mocker.patch(
-            "main.viewsets.IpGeolocationClient.get_ip_geolocation",
+            "main.integrations.ip_geolocation.IpGeolocationClient.get_ip_geolocation",
             return_value={"country_name": "USA", "city": "Rocky Mount"},
         )
         token = create_token(user=user, name="token1")
@@ -0,0 +1,48 @@
+import sys
+
+import pytest
+from django.conf import settings
+from django.contrib.sites import models as sites
+from django.db import connection
+from django.template import engines
+from django.test import override_settings
+from django.urls import clear_url_caches, get_resolver
+
+from main import warmup
+
+
+@pytest.mark.django_db
+class TestWarmup:
+    def test_preload_tasks(self, mocker):
+        # Spied on rather than removed from sys.modules: importing main.admin
+        # twice registers its models twice.
+        import_module = mocker.spy(warmup, "import_module")
+        clear_url_caches()
+        (loader,) = engines["django"].engine.template_loaders
+        loader.reset()
+
+        warmup.warm_up_preload()
+
+        imported = [call.args[0] for call in import_module.call_args_list]
+        assert imported == settings.WARMUP_IMPORTS
+        assert set(imported) <= set(sys.modules)
+        assert get_resolver()._populated
+        assert set(settings.WARMUP_TEMPLATES) <= set(loader.get_template_cache)
+
+    # Outside a test transaction: a pooled connection closed inside one is
+    # closed for good, as Django would close any other.
+    @pytest.mark.django_db(transaction=True)
+    def test_worker_tasks_open_connection(self):
+        sites.Site.objects.clear_cache()
+
+        warmup.warm_up_worker()
+
+        assert connection.connection is not None
+        assert connection.is_usable()
+        # Rebound by clear_cache(), so looked up on the module.
+        assert settings.SITE_ID in sites.SITE_CACHE
+
+    @override_settings(WARMUP_WORKER_TASKS=["main.warmup.not_a_task"])
+    def test_unknown_task(self):
+        with pytest.raises(ImportError):
+            warmup.warm_up_worker()
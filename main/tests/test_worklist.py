@@ -0,0 +1,159 @@
+import datetime
+
+import pytest
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from main import worklist
+from main.models import BloodTestResults, CustomToken
+
+from .factories import BloodTestResultsFactory, LabFactory, UserFactory
+
+
+@pytest.fixture()
+def lab():
+    return LabFactory()
+
+
+@pytest.fixture()
+def worker(lab):
+    return UserFactory(lab=lab)
+
+
+@pytest.fixture()
+def orders(lab):
+    return [
+        BloodTestResultsFactory(lab=lab, results={"HDL": None, "LDL": None})
+        for _ in range(5)
+    ]
+
+
+def client_for(user):
+    client = APIClient()
+    token = CustomToken.objects.create(key=f"{user.pk:032d}", user=user)
+    client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+    return client
+
+
+@pytest.mark.django_db
+class TestClaim:
+    def test_claims_oldest_pending_orders(self, lab, worker, orders):
+        BloodTestResultsFactory(lab=lab, ready=True)
+        BloodTestResultsFactory(lab=LabFactory())
+
+        claimed = worklist.claim(lab, worker, limit=3, lease_seconds=60)
+
+        assert claimed == orders[:3]
+        assert all(order.claimed_by == worker for order in claimed)
+        assert set(
+            BloodTestResults.objects.filter(claimed_by=worker).values_list(
+                "pk", flat=True
+            )
+        ) == {order.pk for order in orders[:3]}
+
+    def test_claimed_orders_are_not_claimed_again(self, lab, worker, orders):
+        other = UserFactory(lab=lab)
+        first = worklist.claim(lab, worker, limit=3)
+        second = worklist.claim(lab, other, limit=3)
+
+        assert second == orders[3:]
+        assert not set(first) & set(second)
+        assert worklist.claim(lab, other, limit=3) == []
+
+    def test_expired_leases_go_back_on_the_worklist(self, lab, worker, orders):
+        worklist.claim(lab, worker, limit=5)
+        BloodTestResults.objects.filter(pk=orders[1].pk).update(
+            claimed_until=timezone.now() - datetime.timedelta(seconds=1)
+        )
+
+        assert worklist.claim(lab, UserFactory(lab=lab), limit=5) == [orders[1]]
+
+
+@pytest.mark.django_db
+class TestComplete:
+    def test_completes_claimed_orders(self, lab, worker, orders):
+        worklist.claim(lab, worker, limit=2)
+
+        completion = worklist.complete(
+            lab, worker, {orders[0].pk: {"HDL": 50}, orders[1].pk: {"LDL": 90}}
+        )
+
+        assert completion.completed == [orders[0].pk, orders[1].pk]
+        assert completion.rejected == {}
+        orders[0].refresh_from_db()
+        assert orders[0].ready
+        assert orders[0].results == {"HDL": 50}
+        assert orders[0].claimed_by is None
+        assert orders[0].claimed_until is None
+
+    def test_rejects_orders_it_does_not_hold(self, lab, worker, orders):
+        worklist.claim(lab, worker, limit=1)
+        worklist.claim(lab, UserFactory(lab=lab), limit=1)
+        elsewhere = BloodTestResultsFactory(lab=LabFactory())
+
+        completion = worklist.complete(
+            lab,
+            worker,
+            {
+                orders[0].pk: {"HDL": 1},
+                orders[1].pk: {"HDL": 1},
+                elsewhere.pk: {"HDL": 1},
+                999999: {"HDL": 1},
+            },
+        )
+
+        assert completion.completed == [orders[0].pk]
+        assert completion.rejected == {
+            orders[1].pk: "Not claimed by you.",
+            elsewhere.pk: "Not an order of this lab.",
+            999999: "No such order.",
+        }
+        assert worklist.complete(lab, worker, {orders[0].pk: {}}).rejected == {
+            orders[0].pk: "Already completed."
+        }
+
+
+@pytest.mark.django_db
+class TestLabWorklistViewSet:
+    def test_claim_and_complete(self, worker, orders):
+        client = client_for(worker)
+
+        response = client.post(
+            reverse("main:api-lab-worklist"), {"limit": 2}, format="json"
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert [order["id"] for order in response.json()] == [
+            orders[0].pk,
+            orders[1].pk,
+        ]
+        assert response.json()[0]["tests"] == ["HDL", "LDL"]
+
+        response = client.post(
+            reverse("main:api-lab-worklist-complete"),
+            {
+                "orders": [
+                    {"id": orders[0].pk, "results": {"HDL": 50, "LDL": 80}},
+                    {"id": orders[2].pk, "results": {"HDL": 50}},
+                ]
+            },
+            format="json",
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json() == {
+            "completed": [orders[0].pk],
+            "rejected": [{"id": orders[2].pk, "reason": "Not claimed by you."}],
+        }
+
+    def test_unknown_blood_tests_are_refused(self, worker, orders):
+        response = client_for(worker).post(
+            reverse("main:api-lab-worklist-complete"),
+            {"orders": [{"id": orders[0].pk, "results": {"NOPE": 1}}]},
+            format="json",
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_only_lab_staff(self, orders):
+        response = client_for(UserFactory()).post(reverse("main:api-lab-worklist"))
+        assert response.status_code == status.HTTP_403_FORBIDDEN
@@ -0,0 +1,179 @@
+"""Token-bucket rate limiting, shared by every worker through the cache tier.
+
+A bucket with rate ``"<n>/<period>"`` (see ``THROTTLE_RATES``) holds up to
+``n`` tokens and refills at ``n`` per period; every request takes one token
+from each bucket that applies to it, or none if any of them is empty. A
+bucket is a ``(tokens, updated_at)`` pair in the default cache, and an idle
+one simply expires.
+
+On Redis, checking and taking every bucket of a request is one Lua script:
+atomic across workers and one round trip. Other cache backends do a
+read-modify-write under a process lock, which is exact on the local-memory
+cache (per process anyway) and approximate across memcached clients.
+
+``TokenBucketThrottle`` limits DRF requests per token, per user and per
+endpoint (views with a ``throttle_scope``); ``take_upstream`` guards paid
+upstream APIs with one bucket for the whole service.
+"""
+import threading
+import time
+from typing import List, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from rest_framework.exceptions import Throttled
+from rest_framework.throttling import BaseThrottle
+
+from . import metrics
+
+PERIODS = {
+    "s": 1,
+    "sec": 1,
+    "m": 60,
+    "min": 60,
+    "h": 3600,
+    "hour": 3600,
+    "d": 86400,
+    "day": 86400,
+}
+
+# KEYS: one per bucket. ARGV: cost, then rate (tokens/s) and burst per key.
+# Returns "0" having taken ``cost`` from every bucket, or the seconds to wait
+# until all of them have enough, having taken nothing.
+TAKE_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local cost = tonumber(ARGV[1])
+local wait = 0
+local tokens = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[2 * i])
+    local burst = tonumber(ARGV[2 * i + 1])
+    local saved = redis.call('HMGET', key, 'tokens', 'at')
+    local level = tonumber(saved[1]) or burst
+    local at = tonumber(saved[2]) or now
+    level = math.min(burst, level + math.max(0, now - at) * rate)
+    if level < cost then
+        wait = math.max(wait, (cost - level) / rate)
+    end
+    tokens[i] = level
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[2 * i])
+    local burst = tonumber(ARGV[2 * i + 1])
+    redis.call('HSET', key, 'tokens', tokens[i] - cost, 'at', now)
+    redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+end
+return '0'
+"""
+
+
+class Bucket(NamedTuple):
+    key: str
+    # tokens per second
+    rate: float
+    burst: float
+
+
+def parse_rate(rate: str) -> Tuple[float, float]:
+    """Turn ``"<n>/<period>"`` into (tokens per second, burst)."""
+    count, period = rate.split("/")
+    burst = float(count)
+    return burst / PERIODS[period], burst
+
+
+def bucket(scope: str, ident: str) -> Optional[Bucket]:
+    """The ``scope`` bucket of ``ident``, None if the scope isn't limited."""
+    rate = settings.THROTTLE_RATES.get(scope)
+    if not rate:
+        return None
+    per_second, burst = parse_rate(rate)
+    return Bucket(f"bucket:{scope}:{ident}", per_second, burst)
+
+
+_lock = threading.Lock()
+_script = None
+
+
+def _take_redis(backend, buckets: List[Bucket], cost: float) -> float:
+    global _script
+    keys = [backend.make_key(b.key) for b in buckets]
+    client = backend._cache.get_client(keys[0], write=True)
+    if _script is None:
+        _script = client.register_script(TAKE_SCRIPT)
+    args = [cost]
+    for b in buckets:
+        args += [b.rate, b.burst]
+    return float(_script(keys=keys, args=args, client=client))
+
+
+def _take_local(backend, buckets: List[Bucket], cost: float) -> float:
+    with _lock:
+        now = time.time()
+        saved = backend.get_many([b.key for b in buckets])
+        levels = []
+        wait = 0.0
+        for b in buckets:
+            level, at = saved.get(b.key, (b.burst, now))
+            level = min(b.burst, level + max(0.0, now - at) * b.rate)
+            if level < cost:
+                wait = max(wait, (cost - level) / b.rate)
+            levels.append(level)
+        if wait:
+            return wait
+        for b, level in zip(buckets, levels):
+            backend.set(b.key, (level - cost, now), b.burst / b.rate + 1)
+        return 0.0
+
+
+def take(buckets: List[Bucket], cost: float = 1) -> float:
+    """Take ``cost`` tokens from every bucket, or none of them.
+
+    Returns 0 on success and otherwise how many seconds to wait.
+    """
+    buckets = [b for b in buckets if b is not None]
+    if not buckets:
+        return 0.0
+    backend = caches["default"]
+    if isinstance(backend, RedisCache):
+        return _take_redis(backend, buckets, cost)
+    return _take_local(backend, buckets, cost)
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Limit requests per token, per user and per ``throttle_scope``."""
+
+    def allow_request(self, request, view) -> bool:
+        user = request.user
+        ident = str(user.pk) if user.is_authenticated else self.get_ident(request)
+        buckets = [bucket("user", ident)]
+        # By the token's id: keys in the cache shouldn't give tokens away.
+        token = getattr(request.auth, "pk", None)
+        if token is not None:
+            buckets.append(bucket("token", str(token)))
+        scope = getattr(view, "throttle_scope", None)
+        if scope:
+            buckets.append(bucket(scope, ident))
+        self._wait = take(buckets)
+        if self._wait:
+            metrics.THROTTLED.labels(scope=scope or "user").inc()
+        return not self._wait
+
+    def wait(self) -> float:
+        return self._wait
+
+
+def take_upstream(name: str) -> None:
+    """Take a token from the service-wide bucket for upstream API ``name``.
+
+    Raises ``Throttled``, which DRF turns into a 429 with Retry-After, when
+    the bucket is empty.
+    """
+    wait = take([bucket(f"upstream:{name}", "all")])
+    if wait:
+        metrics.THROTTLED.labels(scope=f"upstream:{name}").inc()
+        raise Throttled(wait, detail=f"Too many {name} lookups, try again later.")
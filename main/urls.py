@@ -10,12 +10,53 @@ urlpatterns = [
         viewsets.BloodTestResultsViewSet.as_view({"get": "list", "post": "create"}),
         name="api-results",
     ),
+    path(
+        "api/results/events/",
+        viewsets.result_events,
+        name="api-results-events",
+    ),
+    path(
+        "api/results/summary/",
+        viewsets.BloodTestResultsViewSet.as_view({"get": "summary"}),
+        name="api-results-summary",
+    ),
+    path(
+        "api/results/batch/",
+        viewsets.ResultsBatchViewSet.as_view({"post": "create"}),
+        name="api-results-batch",
+    ),
+    path(
+        "api/results/export/",
+        viewsets.ResultsExportViewSet.as_view({"get": "list"}),
+        name="api-results-export",
+    ),
     path(
         "api/geolocation/",
         viewsets.GeolocationViewSet.as_view({"get": "list"}),
         name="api-geolocation",
     ),
     path("", viewsets.index, name="index"),
+    path("metrics", viewsets.prometheus_metrics, name="metrics"),
+    path(
+        "api/lab/worklist/",
+        viewsets.LabWorklistViewSet.as_view({"post": "claim"}),
+        name="api-lab-worklist",
+    ),
+    path(
+        "api/lab/worklist/complete/",
+        viewsets.LabWorklistViewSet.as_view({"post": "complete"}),
+        name="api-lab-worklist-complete",
+    ),
+    path(
+        "api/lab/results/",
+        viewsets.LabResultsIngestViewSet.as_view({"post": "create"}),
+        name="api-lab-results",
+    ),
+    path(
+        "api/lab/<int:pk>/stats/",
+        viewsets.LabStatsViewSet.as_view({"get": "retrieve"}),
+        name="api-lab-stats",
+    ),
     path(
         "api/lab/<country>/",
         viewsets.LabViewSet.as_view({"get": "list"}),
@@ -1,20 +1,51 @@
+import datetime
+import io
 import ipaddress
 from typing import Dict, List
 
-from django.http import HttpResponse
+from asgiref.sync import sync_to_async
+from django.db import connections, transaction
+from django.db.models.functions import Lower
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render
+from django.utils import timezone
 from rest_framework import permissions, status, viewsets
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
+from rest_framework.parsers import MultiPartParser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 
+from . import (
+    archive,
+    compression,
+    events,
+    exports,
+    ingestion,
+    lab_directory,
+    lab_stats,
+    metrics,
+    result_summaries,
+    worklist,
+)
 from .authentication import TokenAuthentication
-from .integrations.ip_geolocation import IpGeolocationClient
-from .models import BloodTestResults, Lab
+from .models import Lab, LabDailyStats, ResultSummary
+from .routers import pin_to_primary, reads_from_replica
 from .serializers import (
+    add_archived_flags,
     BloodTestResultsModelSerializer,
     CreateBloodTestSerializer,
     GeolocationViewSetSerializer,
+    LabStatsQuerySerializer,
     LabViewSetSerializer,
+    PanelResultSerializer,
+    ResultsBatchSerializer,
+    ResultsExportSerializer,
+    ResultsIngestSerializer,
+    WorklistClaimSerializer,
+    WorklistCompleteSerializer,
+    WorklistOrderSerializer,
 )
+from .sharding import results_for_user, results_for_users
 
 
 def validate_ip_address(ip_address: str = None):
@@ -39,16 +70,85 @@ def index(request) -> HttpResponse:
     return render(request, "index.html")
 
 
+def prometheus_metrics(request) -> HttpResponse:
+    """Expose the service's metrics in the Prometheus text format."""
+    body, content_type = metrics.render_latest()
+    return HttpResponse(body, content_type=content_type)
+
+
+def _stream_user(request):
+    # EventSource can't set headers, so browsers pass the token as ?token=.
+    key = request.GET.get("token")
+    try:
+        if key:
+            user, _ = TokenAuthentication().authenticate_credentials(key)
+            return user
+        credentials = TokenAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return None
+    finally:
+        # Django only lets go of connections when the response ends, minutes
+        # from now for a stream, and no query follows: give them back now.
+        connections.close_all()
+    return credentials[0] if credentials else None
+
+
+async def result_events(request) -> HttpResponse:
+    """Stream the current user's result events as Server-Sent Events.
+
+    Reconnecting clients send the last id they saw as ``Last-Event-ID`` (or
+    ``?last_event_id=``) and get the events they missed first. Serve this
+    under ASGI: under WSGI every open stream holds a worker thread.
+    """
+    user = await sync_to_async(_stream_user)(request)
+    if user is None:
+        return JsonResponse(
+            {"detail": "Authentication credentials were not provided."},
+            status=status.HTTP_401_UNAUTHORIZED,
+        )
+    last_event_id = request.headers.get("Last-Event-ID") or request.GET.get(
+        "last_event_id"
+    )
+    return StreamingHttpResponse(
+        events.stream(user.pk, last_event_id),
+        content_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 class BloodTestResultsViewSet(viewsets.ViewSet):
     permission_classes = [permissions.IsAuthenticated]
     authentication_classes = [TokenAuthentication]
 
+    @reads_from_replica
     def list(self, request, **kwargs) -> Response:
-        """Return a list of blood test results for the current user."""
+        """Return a list of blood test results for the current user.
+
+        Results past the retention age are only included, oldest first, with
+        ``?include_archived=true``.
+        """
 
-        query = BloodTestResults.objects.filter(user=request.user)
+        query = results_for_user(request.user.pk).order_by("timestamp")
         serializer = BloodTestResultsModelSerializer(instance=query, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        data = serializer.data
+        if request.query_params.get("include_archived", "").lower() == "true":
+            archived = add_archived_flags(archive.archived_results(request.user.pk))
+            data = archived + data
+        return Response(data, status=status.HTTP_200_OK)
+
+    @reads_from_replica
+    def summary(self, request, **kwargs) -> Response:
+        """Return the current user's newest value of every analyte and pending count.
+
+        Served from their snapshot row (see main/result_summaries.py): a
+        single primary key read however many results they have.
+        """
+        try:
+            snapshot = ResultSummary.objects.get(pk=request.user.pk)
+        except ResultSummary.DoesNotExist:
+            # No orders yet.
+            snapshot = None
+        return Response(result_summaries.describe(snapshot), status=status.HTTP_200_OK)
 
     def create(self, request, **kwargs) -> Response:
         """Create BloodTestResults for user"""
@@ -64,34 +164,233 @@ class BloodTestResultsViewSet(viewsets.ViewSet):
             "user": user,
             "lab": lab,
         }
-        instance = BloodTestResults.objects.create(**data)
+        results = results_for_user(user.pk)
+        with transaction.atomic(using=results.db):
+            instance = results.create(**data)
+            result_summaries.record_created([instance])
+            lab_stats.record_created([instance])
+        events.publish([instance], events.EVENT_CREATED, using=instance._state.db)
+        pin_to_primary(user.pk)
         blood_test_model_serializer = BloodTestResultsModelSerializer(instance=instance)
         return Response(blood_test_model_serializer.data, status=status.HTTP_200_OK)
 
 
+class IsClinician(permissions.BasePermission):
+    message = "Only clinicians can read other patients' results."
+
+    def has_permission(self, request, view):
+        return bool(
+            request.user
+            and request.user.is_authenticated
+            and request.user.has_perm("main.view_bloodtestresults")
+        )
+
+
+class ResultsBatchViewSet(viewsets.ViewSet):
+    permission_classes = [IsClinician]
+    authentication_classes = [TokenAuthentication]
+
+    @reads_from_replica
+    def create(self, request, **kwargs) -> Response:
+        """Return the results of a panel of patients, grouped by patient.
+
+        The same number of queries serves any number of patients up to
+        ``RESULTS_BATCH_MAX_USERS``: one per shard for the results, one for
+        their labs when sharded and one for the patients' demographics that
+        flagging needs.
+        """
+        serializer = ResultsBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user_ids = serializer.validated_data["user_ids"]
+
+        rows = PanelResultSerializer(
+            instance=results_for_users(user_ids), many=True
+        ).data
+        per_user: Dict[int, List[dict]] = {user_id: [] for user_id in user_ids}
+        for row in rows:
+            per_user[row["user"]].append(row)
+        return Response(
+            {
+                "patients": [
+                    {"user": user_id, "results": results}
+                    for user_id, results in per_user.items()
+                ]
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+class ResultsExportViewSet(viewsets.ViewSet):
+    permission_classes = [permissions.IsAdminUser]
+    authentication_classes = [TokenAuthentication]
+
+    def list(self, request, **kwargs) -> StreamingHttpResponse:
+        """Stream all blood test results matching the filters as a file."""
+        serializer = ResultsExportSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = dict(serializer.validated_data)
+        fmt = params.pop("file_format")
+
+        chunks = exports.export(exports.export_queryset(**params), fmt)
+        response = StreamingHttpResponse(
+            (chunk.data for chunk in chunks), content_type=exports.CONTENT_TYPES[fmt]
+        )
+        response[
+            "Content-Disposition"
+        ] = f'attachment; filename="results.{exports.EXTENSIONS[fmt]}"'
+        return response
+
+
+class IsLabStaff(permissions.BasePermission):
+    message = "Only lab staff can work a lab's worklist."
+
+    def has_permission(self, request, view):
+        return bool(
+            request.user and request.user.is_authenticated and request.user.lab_id
+        )
+
+
+class LabWorklistViewSet(viewsets.ViewSet):
+    permission_classes = [IsLabStaff]
+    authentication_classes = [TokenAuthentication]
+
+    def claim(self, request, **kwargs) -> Response:
+        """Claim a batch of the lab's pending orders."""
+        serializer = WorklistClaimSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        orders = worklist.claim(
+            request.user.lab, request.user, **serializer.validated_data
+        )
+        return Response(
+            WorklistOrderSerializer(instance=orders, many=True).data,
+            status=status.HTTP_200_OK,
+        )
+
+    def complete(self, request, **kwargs) -> Response:
+        """Post the results of many claimed orders at once."""
+        serializer = WorklistCompleteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        completion = worklist.complete(
+            request.user.lab,
+            request.user,
+            {
+                order["id"]: order["results"]
+                for order in serializer.validated_data["orders"]
+            },
+        )
+        return Response(
+            {
+                "completed": completion.completed,
+                "rejected": [
+                    {"id": pk, "reason": reason}
+                    for pk, reason in sorted(completion.rejected.items())
+                ],
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+class LabResultsIngestViewSet(viewsets.ViewSet):
+    permission_classes = [IsLabStaff]
+    authentication_classes = [TokenAuthentication]
+    parser_classes = [MultiPartParser]
+
+    def create(self, request, **kwargs) -> Response:
+        """Apply a CSV or HL7-like file of results to the lab's orders."""
+        serializer = ResultsIngestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        lines = io.TextIOWrapper(
+            serializer.validated_data["file"], encoding="utf-8", newline=""
+        )
+        try:
+            report = ingestion.ingest(
+                lines,
+                serializer.validated_data["file_format"],
+                lab=request.user.lab,
+            )
+        except (ValueError, UnicodeDecodeError) as e:
+            raise ValidationError({"file": [str(e)]})
+        return Response(report.as_dict(), status=status.HTTP_200_OK)
+
+
+class IsAdminOrLabStaff(permissions.IsAuthenticated):
+    def has_object_permission(self, request, view, obj):
+        return request.user.is_staff or request.user.lab_id == obj.pk
+
+
+class LabStatsViewSet(viewsets.ViewSet):
+    permission_classes = [IsAdminOrLabStaff]
+    authentication_classes = [TokenAuthentication]
+    default_days = 30
+
+    def retrieve(self, request, pk=None, **kwargs) -> Response:
+        """Return a lab's daily order volumes and turnaround, from its summary rows."""
+        lab = get_object_or_404(Lab, pk=pk)
+        self.check_object_permissions(request, lab)
+        serializer = LabStatsQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        until = serializer.validated_data.get("until", timezone.localdate())
+        since = serializer.validated_data.get(
+            "since", until - datetime.timedelta(days=self.default_days - 1)
+        )
+        stats = LabDailyStats.objects.filter(
+            lab=lab, day__gte=since, day__lte=until
+        ).order_by("day")
+        return Response(
+            {
+                "lab": lab.pk,
+                "since": since,
+                "until": until,
+                **lab_stats.summarize(stats),
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
 class LabViewSet(viewsets.ViewSet):
     permission_classes = [permissions.IsAuthenticated]
     authentication_classes = [TokenAuthentication]
 
+    @reads_from_replica
     def list(self, request, **kwargs):
-        filters = {"country": kwargs.get("country").upper()}
-        city = self.request.query_params.get("city")
+        country = kwargs.get("country").upper()
+        city = self.request.query_params.get("city", "").lower()
+        if isinstance(request.accepted_renderer, JSONRenderer):
+            # Rendered and compressed once per country and city, then served
+            # as stored bytes until it expires.
+            payload = lab_directory.lab_lists.get_or_set(
+                lab_directory.lab_list_key(country, city),
+                lambda: compression.precompress(
+                    JSONRenderer().render(self.lab_data(country, city)),
+                    "application/json",
+                ),
+            )
+            return compression.payload_response(payload)
+        return Response(self.lab_data(country, city), status=status.HTTP_200_OK)
+
+    def lab_data(self, country: str, city: str):
+        filters = {"country": country}
         if city:
-            filters["city__iexact"] = city
-        queryset = Lab.objects.filter(**filters)
-        serializer = LabViewSetSerializer(instance=queryset, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+            # Compare against Lower("city") rather than using iexact so the
+            # lab_country_city_idx expression index can serve the lookup.
+            filters["city_lower"] = city
+        queryset = Lab.objects.alias(city_lower=Lower("city")).filter(**filters)
+        return LabViewSetSerializer(instance=queryset, many=True).data
 
 
 class GeolocationViewSet(viewsets.ViewSet):
     permission_classes = [permissions.IsAuthenticated]
     authentication_classes = [TokenAuthentication]
+    throttle_scope = "geolocation"
 
     def list(self, request, **kwargs) -> Response:
         """Perform geolocation on a given IP address."""
         ip = self.request.query_params.get("ip")
         validate_ip_address(ip)
 
+        # Imported on first use, like requests which it pulls in.
+        from .integrations.ip_geolocation import IpGeolocationClient
+
         query_params = {"ip": ip, "fields": "city,country_name"}
         data = IpGeolocationClient().get_ip_geolocation(params=query_params)
 
@@ -0,0 +1,89 @@
+"""Work done before a server process accepts traffic.
+
+Anything the first request would otherwise pay for lazily (importing modules,
+populating the URL resolver, compiling templates, connecting to the database)
+is done here instead. ``WARMUP_PRELOAD_TASKS`` run once in the gunicorn master
+after the app is preloaded, so forked workers share the result copy-on-write;
+``WARMUP_WORKER_TASKS`` run in every worker since they hold per-process state
+such as database sockets.
+"""
+import logging
+import time
+from importlib import import_module
+from typing import Sequence
+
+from django.conf import settings
+from django.db import connections
+from django.template.loader import get_template
+from django.urls import get_resolver
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+def import_lazy_modules() -> None:
+    for module in settings.WARMUP_IMPORTS:
+        import_module(module)
+
+    from django_countries import countries
+    from rest_framework.settings import api_settings
+
+    # Both resolve their contents on first access.
+    list(countries)
+    for setting in (
+        "DEFAULT_RENDERER_CLASSES",
+        "DEFAULT_PARSER_CLASSES",
+        "DEFAULT_AUTHENTICATION_CLASSES",
+        "DEFAULT_PERMISSION_CLASSES",
+        "DEFAULT_CONTENT_NEGOTIATION_CLASS",
+    ):
+        getattr(api_settings, setting)
+
+
+def populate_url_resolver() -> None:
+    get_resolver().reverse_dict
+
+
+def load_templates() -> None:
+    for template in settings.WARMUP_TEMPLATES:
+        get_template(template)
+
+
+def open_db_connections() -> None:
+    for connection in connections.all():
+        connection.ensure_connection()
+        if "POOL" in connection.settings_dict:
+            # Back to the pool, for whichever thread serves the first request.
+            connection.close()
+
+
+def prime_site_cache() -> None:
+    """Load the current Site, which CurrentSiteMiddleware reads on every request."""
+    from django.contrib.sites.models import Site
+
+    Site.objects.get_current()
+
+
+def close_db_connections() -> None:
+    """Drop connections inherited from a parent process; they can't be shared."""
+    for connection in connections.all():
+        connection.close()
+
+
+def run(tasks: Sequence[str]) -> None:
+    for path in tasks:
+        start = time.perf_counter()
+        import_string(path)()
+        logger.info(
+            "Warm-up task %s done",
+            path,
+            extra={"duration_ms": round((time.perf_counter() - start) * 1000, 3)},
+        )
+
+
+def warm_up_preload() -> None:
+    run(settings.WARMUP_PRELOAD_TASKS)
+
+
+def warm_up_worker() -> None:
+    run(settings.WARMUP_WORKER_TASKS)
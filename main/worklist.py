@@ -0,0 +1,111 @@
+"""The labs' worklist of pending blood test orders.
+
+Lab workers claim batches of their lab's pending orders (``ready=False``) and
+later post the results back. A claim is a lease: the rows are picked with
+``SELECT ... FOR UPDATE SKIP LOCKED``, so concurrent workers never wait on or
+double-claim each other's rows, and stamped with ``claimed_until``. An order
+whose lease runs out before it is completed goes back on the worklist and the
+next claim picks it up again.
+
+A lab's orders are spread over every result shard; claims and completions
+visit each in turn, one transaction per shard.
+"""
+import datetime
+from typing import Dict, List, NamedTuple, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import events, lab_stats, outbox, result_summaries
+from .models import BloodTestResults, Lab, Notification, User
+from .sharding import get_shards
+
+
+class Completion(NamedTuple):
+    completed: List[int]
+    # order id -> why it wasn't completed
+    rejected: Dict[int, str]
+
+
+def claimable(lab: Lab, now: datetime.datetime) -> Q:
+    return Q(lab=lab, ready=False) & (
+        Q(claimed_until__isnull=True) | Q(claimed_until__lte=now)
+    )
+
+
+def claim(
+    lab: Lab, worker: User, limit: int, lease_seconds: Optional[float] = None
+) -> List[BloodTestResults]:
+    """Claim up to ``limit`` of ``lab``'s pending orders for ``worker``, oldest first."""
+    if lease_seconds is None:
+        lease_seconds = settings.WORKLIST_LEASE_SECONDS
+    now = timezone.now()
+    claimed_until = now + datetime.timedelta(seconds=lease_seconds)
+    claimed: List[BloodTestResults] = []
+    for alias in get_shards():
+        if len(claimed) >= limit:
+            break
+        with transaction.atomic(using=alias):
+            orders = list(
+                BloodTestResults.objects.using(alias)
+                .select_for_update(skip_locked=True)
+                .filter(claimable(lab, now))
+                .order_by("timestamp", "pk")[: limit - len(claimed)]
+            )
+            BloodTestResults.objects.using(alias).filter(
+                pk__in=[order.pk for order in orders]
+            ).update(claimed_by=worker, claimed_until=claimed_until)
+        for order in orders:
+            order.claimed_by = worker
+            order.claimed_until = claimed_until
+        claimed.extend(orders)
+    return sorted(claimed, key=lambda order: (order.timestamp, order.pk))
+
+
+def complete(lab: Lab, worker: User, results: Dict[int, dict]) -> Completion:
+    """Store ``results`` (order id -> analyte values) and mark the orders ready.
+
+    Only pending orders of ``lab`` that ``worker`` holds the claim on are
+    completed; an expired claim still counts as long as nobody else has
+    claimed the order since. Each shard's orders are updated in one
+    transaction.
+    """
+    completed: List[int] = []
+    rejected: Dict[int, str] = {}
+    found = set()
+    now = timezone.now()
+    for alias in get_shards():
+        with transaction.atomic(using=alias):
+            orders = list(
+                BloodTestResults.objects.using(alias)
+                .select_for_update()
+                .filter(pk__in=results.keys())
+            )
+            done = []
+            for order in orders:
+                found.add(order.pk)
+                if order.lab_id != lab.pk:
+                    rejected[order.pk] = "Not an order of this lab."
+                elif order.ready:
+                    rejected[order.pk] = "Already completed."
+                elif order.claimed_by_id != worker.pk:
+                    rejected[order.pk] = "Not claimed by you."
+                else:
+                    order.results = results[order.pk]
+                    lab_stats.mark_ready(order, now)
+                    order.claimed_by = None
+                    order.claimed_until = None
+                    done.append(order)
+            BloodTestResults.objects.using(alias).bulk_update(
+                done, ["results", "ready", "ready_at", "claimed_by", "claimed_until"]
+            )
+            lab_stats.record_ready(done)
+            result_summaries.record_ready(done)
+            outbox.enqueue(done, Notification.KIND_RESULT_READY, using=alias)
+            events.publish(done, events.EVENT_READY, using=alias)
+        completed.extend(order.pk for order in done)
+    for pk in results.keys() - found:
+        rejected[pk] = "No such order."
+    return Completion(sorted(completed), rejected)
@@ -0,0 +1,20 @@
+"""
+ASGI config for numan_python_takehome project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+"""
+import os
+
+import dotenv
+from django.core.asgi import get_asgi_application
+
+dotenv.load_dotenv(
+    dotenv_path=os.path.join(os.path.dirname(os.path.dirname(__file__)), ".env")
+)
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "numan_python_takehome.settings")
+
+application = get_asgi_application()
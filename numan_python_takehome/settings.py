@@ -27,6 +27,17 @@ IP_GEOLOCATION_API_KEY = os.environ.get("IP_GEOLOCATION_API_KEY")
 IP_GEOLOCATION_BASE_URL = (
     os.environ.get("IP_GEOLOCATION_BASE_URL") or "https://api.ipgeolocation.io"
 )
+# Retries of failed ipgeolocation.io calls. Off by default: every attempt counts
+# against the paid quota.
+IP_GEOLOCATION_MAX_RETRIES = int(os.environ.get("IP_GEOLOCATION_MAX_RETRIES", 0))
+# Retry n waits a random time up to BACKOFF * 2 ** (n - 1) seconds, capped at
+# MAX_BACKOFF, so a struggling upstream isn't hit by every retry at once.
+IP_GEOLOCATION_BACKOFF_SECONDS = float(
+    os.environ.get("IP_GEOLOCATION_BACKOFF_SECONDS", 0.2)
+)
+IP_GEOLOCATION_MAX_BACKOFF_SECONDS = float(
+    os.environ.get("IP_GEOLOCATION_MAX_BACKOFF_SECONDS", 2)
+)
 
 
 # Application definition
@@ -44,6 +55,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "main.middleware.RequestContextMiddleware",
+    "main.middleware.AccessLogMiddleware",
+    "main.middleware.MetricsMiddleware",
+    "main.compression.CompressionMiddleware",
+    "main.admission.AdmissionControlMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -53,10 +69,82 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# Concurrency limits per class of endpoint and process, see main/admission.py.
+# Views are "default" unless listed; None means never limited.
+ADMISSION_CLASSES = {
+    "main:api-geolocation": "upstream",
+    "main:api-results-export": "bulk",
+    "main:api-lab-results": "bulk",
+    # Held open for minutes by design.
+    "main:api-results-events": None,
+    "main:metrics": None,
+}
+ADMISSION_LIMITS = {
+    # Calls to ipgeolocation.io: never more than half a worker's threads.
+    "upstream": {
+        "limit": 2,
+        "min_limit": 1,
+        "max_limit": 2,
+        "queue": 2,
+        "queue_timeout": 0.1,
+        "latency_target": 1.0,
+    },
+    "bulk": {
+        "limit": 1,
+        "min_limit": 1,
+        "max_limit": 2,
+        "queue": 1,
+        "queue_timeout": 0.5,
+        "latency_target": 30.0,
+    },
+    "default": {
+        "limit": 8,
+        "min_limit": 2,
+        "max_limit": 32,
+        "queue": 16,
+        "queue_timeout": 0.25,
+        "latency_target": 0.5,
+    },
+}
+
+# Token buckets, "<requests>/<s|min|hour|day>", see main/throttling.py: every
+# user and every token, each endpoint with a throttle_scope per user, and
+# "upstream:<name>" for the whole service's calls to a paid API. They hold
+# across workers only with CACHE_URL on Redis. Otherwise buckets are updated
+# under a per-process lock: with the local-memory cache every process limits
+# on its own, and on memcached concurrent processes can overdraw a bucket.
+THROTTLE_RATES = {
+    "user": os.getenv("THROTTLE_USER_RATE", "1200/min"),
+    "token": os.getenv("THROTTLE_TOKEN_RATE", "600/min"),
+    "geolocation": os.getenv("THROTTLE_GEOLOCATION_RATE", "30/min"),
+    "upstream:geolocation": os.getenv("GEOLOCATION_UPSTREAM_RATE", "20/s"),
+}
+
+# Responses smaller than this go out uncompressed; see main/compression.py.
+COMPRESSION_MIN_SIZE = 512
+# How long api/lab/<country>/ serves a rendered lab list from the cache, and
+# so how long edits to labs take to show there.
+LAB_LIST_CACHE_SECONDS = int(os.getenv("LAB_LIST_CACHE_SECONDS", 5 * 60))
+
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
         "rest_framework.authentication.TokenAuthentication",
     ],
+    # Clients may talk MessagePack or CBOR instead of JSON; see main/renderers.py.
+    "DEFAULT_RENDERER_CLASSES": [
+        "rest_framework.renderers.JSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+        "main.renderers.MessagePackRenderer",
+        "main.renderers.CBORRenderer",
+    ],
+    "DEFAULT_THROTTLE_CLASSES": ["main.throttling.TokenBucketThrottle"],
+    "DEFAULT_PARSER_CLASSES": [
+        "rest_framework.parsers.JSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+        "main.renderers.MessagePackParser",
+        "main.renderers.CBORParser",
+    ],
 }
 
 ROOT_URLCONF = "numan_python_takehome.urls"
@@ -84,44 +172,134 @@ DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
 
 WSGI_APPLICATION = "numan_python_takehome.wsgi.application"
 
+# Run by gunicorn before a process accepts traffic, see main/warmup.py.
+WARMUP_IMPORTS = [
+    "main.admin",
+    "main.viewsets",
+    "main.integrations.ip_geolocation",
+    "main.flagging",
+    "rest_framework.renderers",
+    "rest_framework.parsers",
+    "rest_framework.negotiation",
+]
+WARMUP_TEMPLATES = ["index.html"]
+WARMUP_PRELOAD_TASKS = [
+    "main.warmup.import_lazy_modules",
+    "main.warmup.populate_url_resolver",
+    "main.warmup.load_templates",
+]
+WARMUP_WORKER_TASKS = [
+    "main.warmup.open_db_connections",
+    "main.warmup.prime_site_cache",
+]
+
+# Seconds a cold process may take to set Django up and serve its first request,
+# enforced by main/tests/test_startup.py; see ./manage.py profile_imports.
+STARTUP_BUDGET_SECONDS = float(os.environ.get("STARTUP_BUDGET_SECONDS", 2))
+
 AUTH_USER_MODEL = "main.User"
 
+# Result notifications (see main/events.py) are shared between processes
+# through Redis pub/sub when this is set, and stay in-process otherwise.
+EVENTS_BROKER_URL = os.getenv("EVENTS_BROKER_URL", "")
+# How many recent events per user, and for how long, are kept for clients
+# reconnecting with Last-Event-ID.
+EVENTS_REPLAY_SIZE = 100
+EVENTS_REPLAY_SECONDS = 60 * 60
+EVENTS_HEARTBEAT_SECONDS = 15
+# Streams end after this long and the client reconnects.
+EVENTS_STREAM_SECONDS = int(os.getenv("EVENTS_STREAM_SECONDS", 5 * 60))
+EVENTS_RETRY_MILLISECONDS = 3000
+
 # Adjust this to taste.
 SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
 
-# Keep connections in the pool for an hour.
-CONN_MAX_AGE = 60 * 60
-
-if os.getenv("IN_DOCKER"):
-    DATABASES = {
+# The shared cache tier every worker talks to: sessions and the main.cache
+# caches live here. CACHE_URL is redis://host:port/db or memcached://host:port;
+# without it each process gets a local-memory stand-in.
+CACHE_URL = os.getenv("CACHE_URL") or (
+    "redis://cache:6379/0" if os.getenv("IN_DOCKER") else ""
+)
+if CACHE_URL.startswith(("redis://", "rediss://")):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": CACHE_URL,
+            "KEY_PREFIX": "numan",
+        }
+    }
+elif CACHE_URL.startswith("memcached://"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.memcached.PyMemcacheCache",
+            "LOCATION": CACHE_URL.split("://", 1)[1],
+            "KEY_PREFIX": "numan",
+        }
+    }
+else:
+    CACHES = {
         "default": {
-            "ENGINE": "django.db.backends.postgresql_psycopg2",
-            "NAME": "postgres",
-            "USER": "postgres",
-            "PASSWORD": "password",
-            "HOST": "db",
-            "PORT": 5432,
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "KEY_PREFIX": "numan",
         }
     }
 
+# Postgres connections. By default each thread keeps its own for CONN_MAX_AGE
+# seconds. With DB_POOL_SIZE set, the threads of a process share a pool
+# instead (see main/db_pool.py): DB_POOL_SIZE connections kept open and up to
+# DB_POOL_MAX_OVERFLOW more under load, waiting at most DB_POOL_TIMEOUT
+# seconds for one; connections are replaced after DB_POOL_RECYCLE seconds and,
+# with DB_POOL_PRE_PING, checked before every use.
+CONN_MAX_AGE = 60 * 60
+DB_POOL = {
+    "SIZE": int(os.getenv("DB_POOL_SIZE", 0)),
+    "MAX_OVERFLOW": int(os.getenv("DB_POOL_MAX_OVERFLOW", 5)),
+    "TIMEOUT": float(os.getenv("DB_POOL_TIMEOUT", 5)),
+    "RECYCLE": float(os.getenv("DB_POOL_RECYCLE", 30 * 60)),
+    "PRE_PING": os.getenv("DB_POOL_PRE_PING", "1") == "1",
+}
+# Behind PgBouncer in transaction mode a server connection is only ours for a
+# transaction, so no server-side cursors (they outlive it).
+PGBOUNCER_TRANSACTION_MODE = bool(os.getenv("PGBOUNCER_TRANSACTION_MODE"))
+
+
+def _postgres(name, user, password, host, port, **extra):
+    database = {
+        "ENGINE": "django.db.backends.postgresql_psycopg2",
+        "NAME": name,
+        "USER": user,
+        "PASSWORD": password,
+        "HOST": host,
+        "PORT": int(port),
+        "CONN_MAX_AGE": CONN_MAX_AGE,
+        "CONN_HEALTH_CHECKS": True,
+        "DISABLE_SERVER_SIDE_CURSORS": PGBOUNCER_TRANSACTION_MODE,
+        **extra,
+    }
+    if DB_POOL["SIZE"]:
+        # Connections go back to the pool at the end of every request.
+        database.update(
+            ENGINE="main.backends.pooled_postgresql",
+            CONN_MAX_AGE=0,
+            CONN_HEALTH_CHECKS=False,
+            POOL=DB_POOL,
+        )
+    return database
+
+
+DATABASE_URL_RE = r"^postgres://(?P<username>.*?)\:(?P<password>.*?)\@(?P<host>.*?)\:(?P<port>\d+)\/(?P<db>.*?)$"
+
+if os.getenv("IN_DOCKER"):
+    DATABASES = {"default": _postgres("postgres", "postgres", "password", "db", 5432)}
+
     SESSION_CACHE_ALIAS = "default"
     SESSION_COOKIE_AGE = 365 * 24 * 60 * 60
 elif os.getenv("DATABASE_URL"):
     USER, PASSWORD, HOST, PORT, NAME = re.match(  # type: ignore
-        r"^postgres://(?P<username>.*?)\:(?P<password>.*?)\@(?P<host>.*?)\:(?P<port>\d+)\/(?P<db>.*?)$",
-        os.getenv("DATABASE_URL", ""),
+        DATABASE_URL_RE, os.getenv("DATABASE_URL", "")
     ).groups()
 
-    DATABASES = {
-        "default": {
-            "ENGINE": "django.db.backends.postgresql_psycopg2",
-            "NAME": NAME,
-            "USER": USER,
-            "PASSWORD": PASSWORD,
-            "HOST": HOST,
-            "PORT": int(PORT),
-        }
-    }
+    DATABASES = {"default": _postgres(NAME, USER, PASSWORD, HOST, PORT)}
 
     SESSION_CACHE_ALIAS = "default"
     SESSION_ENGINE = "django.contrib.sessions.backends.cache"
@@ -135,6 +313,82 @@ else:
         }
     }
 
+# Read replicas as {alias: weight}. Only the reads main.routers.ReplicaRouter is
+# told about go there, everything else stays on "default".
+REPLICA_DATABASES = {}
+if os.getenv("DATABASE_REPLICA_URLS"):
+    _weights = os.getenv("DATABASE_REPLICA_WEIGHTS", "").split(",")
+    for _i, _url in enumerate(os.getenv("DATABASE_REPLICA_URLS", "").split(",")):
+        _user, _password, _host, _port, _name = re.match(  # type: ignore
+            DATABASE_URL_RE, _url.strip()
+        ).groups()
+        DATABASES[f"replica_{_i + 1}"] = _postgres(
+            _name, _user, _password, _host, _port, TEST={"MIRROR": "default"}
+        )
+        _weight = _weights[_i] if _i < len(_weights) else ""
+        REPLICA_DATABASES[f"replica_{_i + 1}"] = int(_weight or 1)
+elif os.getenv("SQLITE_REPLICAS") and "sqlite3" in DATABASES["default"]["ENGINE"]:
+    # Local stand-ins for the dev server: extra aliases on the same file
+    # exercise the routing. Leave unset for the test suite, whose transactions
+    # other SQLite connections can't see into.
+    for _i in range(int(os.getenv("SQLITE_REPLICAS", 0))):
+        DATABASES[f"replica_{_i + 1}"] = {
+            **DATABASES["default"],
+            "TEST": {"MIRROR": "default"},
+        }
+        REPLICA_DATABASES[f"replica_{_i + 1}"] = 1
+
+# Databases BloodTestResults are spread across by user, see main/sharding.py.
+# Shards need disjoint primary key ranges (e.g. per-shard sequence offsets) as
+# rows keep their id when rebalanced.
+RESULT_SHARDS = ["default"]
+if os.getenv("RESULT_SHARD_URLS"):
+    for _i, _url in enumerate(os.getenv("RESULT_SHARD_URLS", "").split(",")):
+        _user, _password, _host, _port, _name = re.match(  # type: ignore
+            DATABASE_URL_RE, _url.strip()
+        ).groups()
+        DATABASES[f"shard_{_i + 1}"] = _postgres(_name, _user, _password, _host, _port)
+        RESULT_SHARDS.append(f"shard_{_i + 1}")
+elif os.getenv("SQLITE_RESULT_SHARDS") and "sqlite3" in DATABASES["default"]["ENGINE"]:
+    for _i in range(int(os.getenv("SQLITE_RESULT_SHARDS", 0))):
+        DATABASES[f"shard_{_i + 1}"] = {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.path.join(BASE_DIR, f"db_shard_{_i + 1}.sqlite3"),
+        }
+        RESULT_SHARDS.append(f"shard_{_i + 1}")
+
+# Results older than this many months are moved to RESULT_ARCHIVE_DIR by
+# ./manage.py archive_results, see main/archive.py.
+RESULT_RETENTION_MONTHS = int(os.getenv("RESULT_RETENTION_MONTHS", 24))
+RESULT_ARCHIVE_DIR = os.getenv("RESULT_ARCHIVE_DIR") or os.path.join(
+    BASE_DIR, "archive"
+)
+
+# How long a lab worker holds the orders it claims from its worklist before
+# they go back on it, and how many it may claim at once.
+WORKLIST_LEASE_SECONDS = int(os.getenv("WORKLIST_LEASE_SECONDS", 15 * 60))
+WORKLIST_MAX_CLAIM = 500
+
+# Most patients a clinician can read the results of in one request to
+# api/results/batch/.
+RESULTS_BATCH_MAX_USERS = int(os.getenv("RESULTS_BATCH_MAX_USERS", 500))
+
+# ./manage.py send_notifications sends patients' emails from the outbox (see
+# main/outbox.py) in batches, retrying failures with exponential backoff
+# until OUTBOX_MAX_ATTEMPTS. Sent rows are deleted after OUTBOX_KEEP_DAYS.
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", 100))
+OUTBOX_LEASE_SECONDS = 5 * 60
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_BACKOFF_SECONDS = 60
+OUTBOX_MAX_BACKOFF_SECONDS = 6 * 60 * 60
+OUTBOX_KEEP_DAYS = 7
+
+DATABASE_ROUTERS = ["main.routers.ShardRouter", "main.routers.ReplicaRouter"]
+# How long a replica's health check result is trusted.
+REPLICA_HEALTH_CHECK_INTERVAL = 5
+# How long a user's reads stay on the primary after they write.
+REPLICA_READ_YOUR_WRITES_SECONDS = 10
+
 if os.getenv("EMAIL_URL", ""):
     EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
     EMAIL_HOST_USER, EMAIL_HOST_PASSWORD, EMAIL_HOST, EMAIL_PORT = re.match(  # type: ignore
@@ -174,14 +428,30 @@ SITE_ID = 1
 
 STATIC_URL = "/static/"
 
+# Logs are written as JSON lines by a background thread so a slow stdout never
+# blocks a request. LOG_QUEUE_POLICY=block trades that for never losing a line.
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
-    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "formatters": {"json": {"()": "main.log.JsonFormatter"}},
+    "handlers": {
+        "console": {
+            "class": "main.log.BatchingQueueHandler",
+            "formatter": "json",
+            "stream": "ext://sys.stdout",
+            "maxsize": int(os.getenv("LOG_QUEUE_SIZE", 10000)),
+            "batch_size": int(os.getenv("LOG_BATCH_SIZE", 500)),
+            "policy": os.getenv("LOG_QUEUE_POLICY", "drop"),
+        }
+    },
     "loggers": {
         "django": {
             "handlers": ["console"],
             "level": os.getenv("DJANGO_LOG_LEVEL", "INFO"),
-        }
+        },
+        "main": {
+            "handlers": ["console"],
+            "level": os.getenv("MAIN_LOG_LEVEL", "INFO"),
+        },
     },
 }